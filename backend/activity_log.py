@@ -0,0 +1,259 @@
+"""Batched activity-log writer.
+
+Routes hand log events to utils.log_action / log_action_for_owner, which put them on
+a bounded in-process queue. A background thread drains the queue, resolves resource
+owners and actor emails for the whole batch (with small caches), and writes the
+batch as one multi-row INSERT and one commit. A full queue drops the event and
+counts it rather than slowing the request. stop() flushes what is queued; it runs
+on application shutdown and at exit.
+
+Without a running writer (scripts, LOG_WRITER=sync) events are written inline on
+the caller's connection, as before.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import text, bindparam
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+LOG_WRITER = os.getenv("LOG_WRITER", "async")  # async | sync
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv("LOG_FLUSH_INTERVAL_SECONDS", "1.0"))
+LOG_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("LOG_SHUTDOWN_TIMEOUT_SECONDS", "10"))
+OWNER_CACHE_SIZE = 10000
+EMAIL_CACHE_TTL_SECONDS = 300
+
+INSERT_LOG = text(
+    """
+    INSERT INTO activity_logs (user_id, action, resource_type, resource_id, details, ip_address, created_at)
+    VALUES (:user_id, :action, :resource_type, :resource_id, :details, :ip_address, :created_at)
+    """
+)
+
+_OWNER_QUERIES = {
+    "file": "SELECT file_id, user_id FROM files WHERE file_id IN :ids",
+    "folder": "SELECT folder_id, user_id FROM folders WHERE folder_id IN :ids",
+}
+
+
+def make_event(user_id, action, resource_type=None, resource_id=None, details=None, ip_address=None,
+               actor_user_id=None):
+    """One log event. With actor_user_id set, user_id is resolved to the resource owner
+    (falling back to the actor) and the actor is appended to details.
+    """
+    return {
+        "user_id": user_id,
+        "actor_user_id": actor_user_id,
+        "action": action,
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "details": details,
+        "ip_address": ip_address,
+        "created_at": datetime.now(),
+    }
+
+
+class _Resolver:
+    """Owner and actor-email lookups for a batch, one query per kind, cached."""
+
+    def __init__(self):
+        self._owners = OrderedDict()  # (resource_type, id) -> user_id
+        self._emails = {}  # user_id -> (email, expires_at)
+
+    def _lookup_owners(self, db, keys):
+        missing = {}
+        for rtype, rid in keys:
+            if (rtype, rid) not in self._owners:
+                missing.setdefault(rtype, set()).add(rid)
+        for rtype, ids in missing.items():
+            rows = db.execute(
+                text(_OWNER_QUERIES[rtype]).bindparams(bindparam("ids", expanding=True)), {"ids": list(ids)}
+            ).fetchall()
+            for rid, owner in rows:
+                self._owners[(rtype, rid)] = owner
+                if len(self._owners) > OWNER_CACHE_SIZE:
+                    self._owners.popitem(last=False)
+        return {key: self._owners.get(key) for key in keys}
+
+    def _lookup_emails(self, db, user_ids):
+        now = time.monotonic()
+        missing = [u for u in user_ids if u not in self._emails or self._emails[u][1] < now]
+        if missing:
+            rows = db.execute(
+                text("SELECT user_id, email FROM users WHERE user_id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": missing},
+            ).fetchall()
+            found = dict(rows)
+            for u in missing:
+                self._emails[u] = (found.get(u), now + EMAIL_CACHE_TTL_SECONDS)
+        return {u: self._emails[u][0] for u in user_ids}
+
+    def rows(self, db, events):
+        """activity_logs rows for events, as the old per-call helpers would have written them."""
+        owned = [e for e in events if e["actor_user_id"] is not None]
+        owners = self._lookup_owners(db, {
+            (e["resource_type"], e["resource_id"]) for e in owned if e["resource_type"] in _OWNER_QUERIES
+        })
+        emails = self._lookup_emails(db, {e["actor_user_id"] for e in owned})
+        rows = []
+        for e in events:
+            row = {k: e[k] for k in ("user_id", "action", "resource_type", "resource_id", "details", "ip_address", "created_at")}
+            actor = e["actor_user_id"]
+            if actor is not None:
+                owner = owners.get((e["resource_type"], e["resource_id"]))
+                # Fallback: if owner not found, attribute to actor
+                row["user_id"] = owner if owner is not None else actor
+                extra = f" | actor_id={actor}"
+                if emails.get(actor):
+                    extra += f" actor_email={emails[actor]}"
+                row["details"] = (e["details"] or "") + extra
+            rows.append(row)
+        return rows
+
+
+class ActivityLogWriter:
+    def __init__(self, maxsize: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE,
+                 interval: float = LOG_FLUSH_INTERVAL_SECONDS):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.resolver = _Resolver()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()  # guards start() and the counters below
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.failed_batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, event) -> bool:
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _drain(self, first):
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=self.interval)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            batch = self._drain(first)
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+        try:
+            with engine.connect() as conn:
+                conn.execute(INSERT_LOG, self.resolver.rows(conn, batch))
+                conn.commit()
+        except Exception:
+            # the events are lost; failed / failed_batches in stats() say how many
+            logger.exception("Activity log batch of %d events failed", len(batch))
+            with self._lock:
+                self.failed += len(batch)
+                self.failed_batches += 1
+            return
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+
+    def flush(self, timeout: float = LOG_SHUTDOWN_TIMEOUT_SECONDS) -> bool:
+        """Wait until everything queued so far is written; False on timeout."""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if not self.running or time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout: float = LOG_SHUTDOWN_TIMEOUT_SECONDS):
+        """Flush the queue and stop the thread."""
+        if not self.running:
+            return
+        self.flush(timeout)
+        self._stopping.set()
+        self._thread.join(timeout=max(self.interval * 2, 1.0))
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = {
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+            }
+        return {
+            "running": self.running,
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            **counters,
+        }
+
+
+log_writer = ActivityLogWriter()
+_inline_resolver = _Resolver()
+
+
+def record(db, event):
+    """Queue an event, or write it on db (caller commits) when no writer is running."""
+    if log_writer.running:
+        log_writer.submit(event)
+        return
+    db.execute(INSERT_LOG, _inline_resolver.rows(db, [event]))
+
+
+def start_log_writer():
+    if LOG_WRITER == "async":
+        log_writer.start()
+        atexit.register(stop_log_writer)
+
+
+def stop_log_writer():
+    log_writer.stop()
@@ -1,9 +1,11 @@
 # app.py
 from fastapi import FastAPI
-from database import engine, create_tables
-from routes import auth , folders , files, recycle , shares, logs, search, execute, ai, api
+from database import engine
+from migrations import check_schema
+from routes import auth , folders , files, recycle , shares, logs, search, execute, ai, api, uploads
 from fastapi.middleware.cors import CORSMiddleware
 from schedular import start_cleanup_scheduler
+from activity_log import start_log_writer, stop_log_writer
 
 from sqlalchemy import text
 
@@ -20,6 +22,7 @@ app.add_middleware(
 app.include_router(prefix="/auth", router=auth.router)
 app.include_router(prefix="/folders", router=folders.router)
 app.include_router(prefix="/files", router=files.router)
+app.include_router(prefix="/uploads", router=uploads.router)
 app.include_router(prefix="/recycle", router=recycle.router)
 app.include_router(prefix='/shares',router=shares.router)
 app.include_router(prefix='/logs', router=logs.router)
@@ -29,6 +32,10 @@ app.include_router(prefix='/ai', router=ai.router)
 app.include_router(prefix='/api', router=api.router)
 
 app.on_event("startup")(start_cleanup_scheduler)
+app.on_event("startup")(start_log_writer)
+# flush queued activity logs before the process exits
+app.on_event("shutdown")(stop_log_writer)
 
-create_tables()
+# single version read; applies pending migrations only when AUTO_MIGRATE=1
+check_schema()
 
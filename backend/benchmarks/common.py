@@ -0,0 +1,151 @@
+"""Shared setup for the benchmark scripts: a throwaway database and timing helpers.
+
+Import this before anything from the app. It points DATABASE_URL at a temporary
+SQLite file, or at BENCH_DATABASE_URL when set (use a scratch PostgreSQL database;
+the benchmarks write to it); prepare_database() migrates it to the latest schema.
+
+Run the scripts from backend/, e.g.  python benchmarks/search_names.py --help
+"""
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlencode
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="fs-bench-")
+os.environ["DATABASE_URL"] = os.getenv("BENCH_DATABASE_URL") or f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+os.environ.setdefault("JWT_SECRET", "bench-secret-with-enough-bytes-for-hs256")
+os.environ.setdefault("DB_PROFILE", "production")
+os.environ["AUTO_MIGRATE"] = "1"
+os.chdir(WORKDIR)  # uploads/ and the blob store are relative to the working directory
+sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy import text  # noqa: E402
+
+from database import engine  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+def prepare_database():
+    migrate()
+    return engine
+
+
+def sizes_arg(value: str) -> list:
+    """"1000,10000,1e6" -> [1000, 10000, 1000000]"""
+    return [int(float(v)) for v in value.split(",") if v.strip()]
+
+
+def seed_users(conn, count: int, prefix: str = "bench") -> list:
+    """Insert count users and return their ids."""
+    start = conn.execute(text("SELECT COALESCE(MAX(user_id), 0) FROM users")).scalar()
+    now = datetime.now()
+    conn.execute(text(
+        """
+        INSERT INTO users (username, password, email, profile, created_at, storage)
+        VALUES (:username, 'x', :email, 'default.png', :now, 0)
+        """
+    ), [{"username": f"{prefix}{start + i}", "email": f"{prefix}{start + i}@example.com", "now": now}
+        for i in range(count)])
+    conn.commit()
+    return [r[0] for r in conn.execute(text("SELECT user_id FROM users WHERE user_id > :start ORDER BY user_id"),
+                                       {"start": start}).fetchall()]
+
+
+def timed(fn, repeat: int = 5) -> float:
+    """Median wall time of fn() in milliseconds, after one warm-up call."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def print_table(header, rows):
+    widths = [max(len(str(v)) for v in column) for column in zip(header, *rows)]
+    for row in [header] + list(rows):
+        print("  ".join(str(v).rjust(w) for v, w in zip(row, widths)))
+
+
+# --- HTTP against a real server, for the transfer benchmarks ---
+
+BOUNDARY = "benchboundary"
+MULTIPART_TAIL = f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def app_server(**env):
+    """uvicorn serving the app on the benchmark database; yields (port, pid). env adds
+    settings such as SENDFILE_MODE."""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning", "--backlog", "4096"],
+        cwd=WORKDIR, env={**os.environ, "PYTHONPATH": BACKEND_DIR, **env},
+    )
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        yield port, server.pid
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+async def request(port, method, path, headers=None, body=b"", timeout=30.0):
+    """One HTTP/1.1 request on its own connection; returns (status, body)."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        lines = [f"{method} {path} HTTP/1.1", "Host: bench", "Connection: close",
+                 f"Content-Length: {len(body)}"] + [f"{k}: {v}" for k, v in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+        raw = await asyncio.wait_for(reader.read(-1), timeout)
+    finally:
+        writer.close()
+    head, _, payload = raw.partition(b"\r\n\r\n")
+    return int(head.split()[1]), payload
+
+
+def multipart_head(file_name: str) -> bytes:
+    """Start of an upload_file body into the root folder; the file bytes and MULTIPART_TAIL follow."""
+    return (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"parent_id\"\r\n\r\n0\r\n"
+            f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{file_name}\"\r\n"
+            "Content-Type: application/octet-stream\r\n\r\n").encode()
+
+
+async def setup_user(port, data: bytes):
+    """A new user, their auth headers and the file_id of data uploaded as one file."""
+    tag = uuid.uuid4().hex[:8]
+    email = f"bench-{tag}@example.com"
+    account = {"username": email.split("@")[0], "password": "pw123456", "email": email}
+    await request(port, "POST", "/auth/signup", {"Content-Type": "application/json"}, json.dumps(account).encode())
+    status, body = await request(port, "POST", "/auth/login", {"Content-Type": "application/x-www-form-urlencoded"},
+                                 urlencode({"username": email, "password": account["password"]}).encode())
+    assert status == 200, body
+    headers = {"Authorization": "Bearer " + json.loads(body)["access_token"]}
+    status, body = await request(port, "POST", "/files/upload_file",
+                                 {**headers, "Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+                                 multipart_head(f"download_{tag}.bin") + data + MULTIPART_TAIL)
+    assert status == 200, body
+    return headers, json.loads(body)["file"]["file_id"]
@@ -0,0 +1,105 @@
+"""Download cost per SENDFILE_MODE: server CPU per GB and throughput.
+
+Starts uvicorn once per mode (see http_range.SENDFILE_MODE), uploads one --file-mb
+file and downloads it --requests times, --concurrency at a time, reading and
+discarding the body. Server CPU comes from /proc/<pid>/stat (Linux).
+
+  stream      the app sends the bytes with async chunked reads (uvicorn has no
+              http.response.zerocopysend, so sendfile mode measures the same)
+  x-accel     the app only authorizes and answers with X-Accel-Redirect
+  x-sendfile  the same with X-Sendfile
+
+In the offload modes no proxy sits in front here, so the numbers are the app's
+share: authorize, log and answer with headers. "GB" is then what the proxy would
+have sent.
+
+    python benchmarks/download_modes.py --file-mb 256 --requests 64 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from common import app_server, print_table, setup_user
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def cpu_seconds(pid: int) -> float:
+    """User + system CPU of a process so far."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+async def download(port, headers, file_id, read_size) -> tuple:
+    """(seconds, body bytes, offloaded) for one GET of the file."""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        lines = [f"GET /files/download_file/{file_id} HTTP/1.1", "Host: bench", "Connection: close"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        await writer.drain()
+        head = (await reader.readuntil(b"\r\n\r\n")).lower()
+        assert head.split()[1] == b"200", head
+        received = 0
+        while True:
+            chunk = await reader.read(read_size)
+            if not chunk:
+                break
+            received += len(chunk)
+    finally:
+        writer.close()
+    offloaded = b"x-accel-redirect:" in head or b"x-sendfile:" in head
+    return time.perf_counter() - started, received, offloaded
+
+
+async def measure(port, pid, args, data):
+    headers, file_id = await setup_user(port, data)
+    await download(port, headers, file_id, 1024 * 1024)  # warm caches
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        async with gate:
+            return await download(port, headers, file_id, 1024 * 1024)
+
+    cpu_before = cpu_seconds(pid)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    cpu = cpu_seconds(pid) - cpu_before
+    served = sum(r[1] for r in results)
+    assert all(r[1] == len(data) or r[2] for r in results), "short download"
+    gigabytes = len(data) * args.requests / 1024 ** 3
+    return {
+        "offloaded": all(r[2] for r in results),
+        "served_gb": served / 1024 ** 3,
+        "cpu": cpu,
+        "cpu_per_gb": cpu / gigabytes,
+        "mb_per_s": served / 1024 ** 2 / elapsed,
+        "p50_ms": statistics.median(r[0] for r in results) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default="stream,x-accel,x-sendfile")
+    parser.add_argument("--file-mb", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    data = os.urandom(args.file_mb * 1024 * 1024)
+    rows = []
+    for mode in args.modes.split(","):
+        with app_server(SENDFILE_MODE=mode) as (port, pid):
+            r = asyncio.run(measure(port, pid, args, data))
+        rows.append((mode, "proxy" if r["offloaded"] else "app", f"{r['served_gb']:.2f}", f"{r['cpu']:.2f}",
+                     f"{r['cpu_per_gb']:.3f}", f"{r['mb_per_s']:.0f}", f"{r['p50_ms']:.1f}"))
+    print_table(("mode", "bytes by", "GB by app", "server cpu s", "cpu s/GB", "MB/s by app", "p50 ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Activity log page latency against depth, on a large activity_logs table.
+
+Fills activity_logs with --rows events (10M is the target size; the default is
+smaller so a run takes a minute) spread over --users users and --days days, then
+pages through the first user's log with the routes' own functions. For each
+--pages depth it reports the keyset page time (next_cursor, as clients page)
+next to the same page fetched with the legacy offset parameter, plus the security
+view. Keyset times should stay flat with depth; offset times grow with it.
+
+    python benchmarks/log_paging.py --rows 10e6 --users 10 --pages 1,10,100,1000,10000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import prepare_database, print_table, seed_users, sizes_arg, text, timed
+
+from routes.logs import get_my_logs, get_security_highlights
+
+ACTIONS = ["upload", "download", "rename_file", "create_folder", "login", "delete_file", "create_share",
+           "view_file", "move_file", "delete_folder"]
+BATCH = 20000
+
+
+def fill(conn, user_ids, rows: int, days: int, rng):
+    now = datetime.now()
+    span = days * 86400
+    for offset in range(0, rows, BATCH):
+        conn.execute(text(
+            """
+            INSERT INTO activity_logs (user_id, action, resource_type, resource_id, details, ip_address, created_at)
+            VALUES (:user_id, :action, 'file', :resource_id, 'bench', '127.0.0.1', :created_at)
+            """
+        ), [{"user_id": rng.choice(user_ids), "action": rng.choice(ACTIONS), "resource_id": rng.randrange(10 ** 6),
+             "created_at": now - timedelta(seconds=rng.randrange(span))}
+            for _ in range(min(BATCH, rows - offset))])
+        conn.commit()
+
+
+def my_logs(conn, user_id, cursor=None, offset=0, limit=50):
+    return get_my_logs(db=conn, current_user={"user_id": user_id}, limit=limit, offset=offset, cursor=cursor,
+                       action=None, resource_type=None, start_date=None, end_date=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=lambda v: int(float(v)), default=1_000_000)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--pages", type=sizes_arg, default=sizes_arg("1,10,100,1000"))
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    with prepare_database().connect() as conn:
+        me, *others = seed_users(conn, args.users)
+        started = time.perf_counter()
+        fill(conn, [me] + others, args.rows, args.days, random.Random(1))
+        mine = conn.execute(text("SELECT COUNT(*) FROM activity_logs WHERE user_id = :u"), {"u": me}).scalar()
+        print(f"filled {args.rows} rows in {time.perf_counter() - started:.0f}s; {mine} belong to the paged user")
+
+        rows = []
+        depths = sorted(p for p in args.pages if (p - 1) * args.limit < mine)
+        cursor, page, security_cursor = None, 1, None
+        for depth in depths:
+            # walk to the page before `depth` the way a client does, following next_cursor
+            while page < depth:
+                cursor = my_logs(conn, me, cursor, limit=args.limit)["next_cursor"]
+                # the security view holds fewer rows: it stays on its last page once they run out
+                security_cursor = get_security_highlights(db=conn, current_user={"user_id": me}, limit=args.limit,
+                                                          cursor=security_cursor)["next_cursor"] or security_cursor
+                page += 1
+            keyset = timed(lambda: my_logs(conn, me, cursor, limit=args.limit), 5)
+            offset = timed(lambda: my_logs(conn, me, offset=(depth - 1) * args.limit, limit=args.limit), 3)
+            security = timed(lambda: get_security_highlights(db=conn, current_user={"user_id": me},
+                                                             limit=args.limit, cursor=security_cursor), 5)
+            rows.append((depth, f"{keyset:.2f}", f"{offset:.2f}", f"{security:.2f}"))
+    print_table(("page", "keyset ms", "offset ms", "security ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
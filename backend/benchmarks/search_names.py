@@ -0,0 +1,67 @@
+"""Name lookup latency against corpus size.
+
+Gives one user --mine names, grows everyone else's names through the given corpus
+sizes, and times search_names() for that user at each size: a substring query and
+a typo that only the trigram similarity pass finds. With candidates restricted to
+the visible owners (see search_index), latency should stay flat as the corpus grows.
+
+    python benchmarks/search_names.py --sizes 10000,100000,1000000 --users 1000
+"""
+import argparse
+import random
+from datetime import datetime
+
+from common import prepare_database, print_table, seed_users, sizes_arg, text, timed
+
+from search_index import search_names
+
+WORDS = ["invoice", "report", "budget", "photo", "notes", "draft", "summary", "contract", "receipt", "slides"]
+
+
+def grow(conn, user_ids, count: int, rng):
+    now = datetime.now()
+    last = conn.execute(text("SELECT COALESCE(MAX(file_id), 0) FROM files")).scalar()
+    for offset in range(0, count, 10000):
+        conn.execute(text(
+            """
+            INSERT INTO files (file_name, parent_id, user_id, created_at, updated_at, file_size, status)
+            VALUES (:name, 0, :user_id, :now, :now, 1, 'not_deleted')
+            """
+        ), [{"name": f"{rng.choice(WORDS)}_{rng.randint(2000, 2030)}_{offset + i}.txt",
+             "user_id": rng.choice(user_ids), "now": now} for i in range(min(10000, count - offset))])
+    # index the new rows as index_items() would (the triggers fill the trigram table)
+    conn.execute(text(
+        """
+        INSERT INTO search_documents (item_type, item_id, user_id, name, content, content_pending)
+        SELECT 'file', file_id, user_id, file_name, '', FALSE FROM files WHERE file_id > :last
+        """
+    ), {"last": last})
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=sizes_arg, default=sizes_arg("10000,50000,200000"))
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--mine", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    rows = []
+    with prepare_database().connect() as conn:
+        me, *others = seed_users(conn, args.users)
+        grow(conn, [me], args.mine, rng)
+        total = args.mine
+        for size in sorted(args.sizes):
+            grow(conn, others, size - total, rng)
+            total = size
+            mine = conn.execute(text("SELECT COUNT(*) FROM search_documents WHERE user_id = :u"), {"u": me}).scalar()
+            substring = timed(lambda: search_names(conn, me, "voice_20"), args.repeat)
+            typo = timed(lambda: search_names(conn, me, "invoce_202"), args.repeat)
+            rows.append((size, mine, f"{substring:.2f}", f"{typo:.2f}"))
+    print_table(("corpus", "user's names", "substring ms", "typo ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Lookup latency in the sharded blob layout against one flat directory.
+
+Creates N empty files twice, flat in one directory (as uploads/user_{id}/ used to
+be) and under LocalDriver's two-level hex prefixes, then times stat() of present
+and missing keys and one listing of the directory a lookup lands in. Sharded
+numbers should stay flat as N grows; flat ones grow with the directory.
+
+    python benchmarks/sharded_lookup.py --sizes 1000,10000,100000,1000000 --dir /srv/scratch
+"""
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+
+from common import print_table, sizes_arg, timed
+
+from storage import LocalDriver
+
+
+def _keys(start: int, stop: int):
+    return [hashlib.sha256(str(i).encode()).hexdigest() for i in range(start, stop)]
+
+
+def _touch(path: str):
+    with open(path, "wb"):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=sizes_arg, default=sizes_arg("1000,10000,100000"))
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--dir", default=None, help="scratch directory on the filesystem to measure")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="fs-shard-bench-", dir=args.dir)
+    flat_dir = os.path.join(root, "flat")
+    os.makedirs(flat_dir)
+    driver = LocalDriver(os.path.join(root, "sharded"))
+    rng = random.Random(1)
+    rows = []
+    try:
+        created = 0
+        for size in sorted(args.sizes):
+            for key in _keys(created, size):
+                _touch(os.path.join(flat_dir, key))
+                path = driver._path(key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                _touch(path)
+            created = size
+            present = [hashlib.sha256(str(rng.randrange(size)).encode()).hexdigest() for _ in range(args.lookups)]
+            missing = _keys(size + 10 ** 9, size + 10 ** 9 + args.lookups)
+
+            def per_lookup(fn, keys):
+                return timed(lambda: [fn(k) for k in keys], 3) * 1000 / len(keys)
+
+            rows.append((
+                size,
+                f"{per_lookup(lambda k: os.stat(os.path.join(flat_dir, k)), present):.2f}",
+                f"{per_lookup(driver.stat, present):.2f}",
+                f"{per_lookup(lambda k: os.path.exists(os.path.join(flat_dir, k)), missing):.2f}",
+                f"{per_lookup(driver.exists, missing):.2f}",
+                f"{timed(lambda: os.listdir(flat_dir), 3):.2f}",
+                f"{timed(lambda: os.listdir(os.path.dirname(driver._path(present[0]))), 3):.3f}",
+            ))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print_table(("files", "flat hit us", "sharded hit us", "flat miss us", "sharded miss us",
+                 "flat list ms", "shard list ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
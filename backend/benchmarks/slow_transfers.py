@@ -0,0 +1,134 @@
+"""Load test: many slow uploads and downloads at once, against a real uvicorn server.
+
+Starts the app on a throwaway database, then opens --downloads clients that read a
+--file-mb download --read-kb at a time with --delay between reads, and --uploads
+clients that trickle a --file-mb multipart upload the same way. Meanwhile it probes
+GET /files/file_metadata, a sync route that needs a threadpool worker. A transfer
+path that held a worker per transfer would leave the probe queued behind the
+threadpool's 40 workers; the probe latencies should stay in the milliseconds.
+Clients start spread over --ramp seconds: started together, they also finish
+together, and the probe then measures a burst of upload commits queueing for the
+database rather than the transfers.
+
+    python benchmarks/slow_transfers.py --downloads 1000 --uploads 1000
+"""
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import time
+
+from common import BOUNDARY, MULTIPART_TAIL, app_server, multipart_head, request, setup_user
+
+async def slow_download(port, headers, file_id, size, read_size, delay, start_after) -> bool:
+    await asyncio.sleep(start_after)
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        lines = [f"GET /files/download_file/{file_id} HTTP/1.1", "Host: bench", "Connection: close"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        received = 0
+        while True:
+            chunk = await reader.read(read_size)
+            if not chunk:
+                break
+            received += len(chunk)
+            await asyncio.sleep(delay)
+        return head.split()[1] == b"200" and received == size
+    finally:
+        writer.close()
+
+
+async def slow_upload(port, headers, index, data, read_size, delay, start_after) -> bool:
+    await asyncio.sleep(start_after)
+    body_head = multipart_head(f"upload_{index}.bin")
+    length = len(body_head) + len(data) + len(MULTIPART_TAIL)
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        lines = ["POST /files/upload_file HTTP/1.1", "Host: bench", "Connection: close",
+                 f"Content-Type: multipart/form-data; boundary={BOUNDARY}", f"Content-Length: {length}"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body_head)
+        for offset in range(0, len(data), read_size):
+            writer.write(data[offset:offset + read_size])
+            await writer.drain()
+            await asyncio.sleep(delay)
+        writer.write(MULTIPART_TAIL)
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        return head.split()[1] == b"200"
+    finally:
+        writer.close()
+
+
+async def probe(port, headers, file_id, done: asyncio.Event, interval: float):
+    """Latencies (ms) of a sync route while the transfers run; None for a failed probe."""
+    samples = []
+    while not done.is_set():
+        started = time.perf_counter()
+        try:
+            status, _ = await request(port, "GET", f"/files/file_metadata?file_id={file_id}", headers, timeout=10)
+            samples.append((time.perf_counter() - started) * 1000 if status == 200 else None)
+        except (OSError, asyncio.TimeoutError):
+            samples.append(None)
+        await asyncio.sleep(interval)
+    return samples
+
+
+async def run(args, port):
+    data = os.urandom(args.file_mb * 1024 * 1024)
+    headers, file_id = await setup_user(port, data)
+    read_size = args.read_kb * 1024
+    count = args.downloads + args.uploads
+    starts = [args.ramp * i / max(count, 1) for i in range(count)]
+    transfers = [slow_download(port, headers, file_id, len(data), read_size, args.delay, starts[i])
+                 for i in range(args.downloads)]
+    transfers += [slow_upload(port, headers, i, data, read_size, args.delay, starts[args.downloads + i])
+                  for i in range(args.uploads)]
+
+    done = asyncio.Event()
+    prober = asyncio.create_task(probe(port, headers, file_id, done, args.probe_interval))
+    started = time.perf_counter()
+    results = await asyncio.gather(*transfers, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    done.set()
+    samples = await prober
+
+    ok = sum(1 for r in results if r is True)
+    latencies = sorted(s for s in samples if s is not None)
+    print(f"transfers: {ok}/{len(results)} ok in {elapsed:.1f}s, started over {args.ramp:.0f}s "
+          f"({args.downloads} downloads, {args.uploads} uploads of {args.file_mb} MiB)")
+    if latencies:
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"probe: {len(latencies)} ok, {len(samples) - len(latencies)} failed; "
+              f"p50 {statistics.median(latencies):.1f} ms, p99 {p99:.1f} ms, max {latencies[-1]:.1f} ms")
+    else:
+        print(f"probe: all {len(samples)} failed")
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        print(f"first transfer error: {errors[0]!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--downloads", type=int, default=500)
+    parser.add_argument("--uploads", type=int, default=500)
+    parser.add_argument("--file-mb", type=int, default=1)
+    parser.add_argument("--read-kb", type=int, default=16)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds between reads or writes per client")
+    parser.add_argument("--ramp", type=float, default=10.0, help="seconds over which the clients start")
+    parser.add_argument("--probe-interval", type=float, default=0.1)
+    args = parser.parse_args()
+
+    # every client is a socket on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    with app_server() as (port, _):
+        asyncio.run(run(args, port))
+
+if __name__ == "__main__":
+    main()
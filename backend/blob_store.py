@@ -0,0 +1,346 @@
+"""Content-addressed blob store.
+
+File bytes live once per SHA-256 digest in the configured storage driver (see
+storage.py); files rows point at them through files.blob_digest, and file_path
+records where the driver put them. blobs.ref_count counts the files rows, including
+ones in the recycle bin, that use a blob. Quota stays per user: every owner is charged
+for their own files whether or not the bytes are shared.
+
+    python blob_store.py [verify|repair|gc|migrate]
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from sqlalchemy import text, bindparam
+from starlette.concurrency import run_in_threadpool
+
+from storage import BLOB_DIR, get_storage, local_copy
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# uploads are staged here; next to the local blob root so storing them is a rename
+STAGING_DIR = os.getenv("UPLOAD_STAGING_DIR", os.path.join(BLOB_DIR, "tmp"))
+
+
+def hash_stream(fileobj):
+    """SHA-256 and size of a readable stream, read from its current position to EOF."""
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        block = fileobj.read(HASH_CHUNK_SIZE)
+        if not block:
+            break
+        digest.update(block)
+        size += len(block)
+    return digest.hexdigest(), size
+
+
+def hash_file(path: str):
+    with open(path, "rb") as f:
+        return hash_stream(f)
+
+
+def _hash_block(fileobj, digest) -> int:
+    block = fileobj.read(HASH_CHUNK_SIZE)
+    digest.update(block)
+    return len(block)
+
+
+async def hash_upload(fileobj):
+    """hash_stream from the start of an upload, one threadpool hop per chunk so a large
+    file never pins a worker thread for the whole pass.
+    """
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        n = await run_in_threadpool(_hash_block, fileobj, digest)
+        if not n:
+            break
+        size += n
+    return digest.hexdigest(), size
+
+
+def blob_exists(db, digest: str) -> bool:
+    """True when the content is already stored, i.e. an upload of it needs no disk write."""
+    row = db.execute(text("SELECT 1 FROM blobs WHERE digest = :digest AND ref_count > 0"), {"digest": digest}).fetchone()
+    return row is not None and get_storage().exists(digest)
+
+
+def spool_to_staging(fileobj) -> str:
+    """Copy a stream into a staging file, so storing it later is a rename (local driver)."""
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=STAGING_DIR)
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(fileobj, out, HASH_CHUNK_SIZE)
+    return temp_path
+
+
+def _copy_block(src, dst) -> int:
+    block = src.read(HASH_CHUNK_SIZE)
+    dst.write(block)
+    return len(block)
+
+
+async def spool_upload(fileobj) -> str:
+    """spool_to_staging from the start of an upload, chunk by chunk like hash_upload."""
+    fileobj.seek(0)
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=STAGING_DIR)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while await run_in_threadpool(_copy_block, fileobj, out):
+                pass
+    except BaseException:
+        discard_temp(temp_path)
+        raise
+    return temp_path
+
+
+def acquire_blob(db, digest: str, size: int, temp_path: str = None, fileobj=None):
+    """Take a reference on `digest`, storing the content if it is not on disk yet.
+    The content comes from temp_path (renamed into place, or removed when the blob
+    already exists) or from fileobj (rewound and copied only when needed).
+    Returns (location, created); on rollback the caller should discard_blob() a
+    created blob. Runs inside the caller's transaction.
+    """
+    db.execute(text(
+        """
+        INSERT INTO blobs (digest, size, ref_count, created_at)
+        VALUES (:digest, :size, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (digest) DO UPDATE SET ref_count = blobs.ref_count + 1
+        """
+    ), {"digest": digest, "size": size})
+    storage = get_storage()
+    created = not storage.exists(digest)
+    if created:
+        if temp_path is None:
+            fileobj.seek(0)
+            temp_path = spool_to_staging(fileobj)
+        storage.put_file(digest, temp_path)
+    elif temp_path is not None:
+        os.remove(temp_path)
+    return storage.describe(digest), created
+
+
+def discard_blob(digest: str):
+    try:
+        get_storage().delete(digest)
+    except Exception:
+        pass
+
+
+def discard_temp(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@contextmanager
+def open_local(file_path: str, blob_digest: str = None):
+    """Local path of a file's content: the blob (downloaded if the driver is remote) or,
+    for files stored before the blob store, file_path itself.
+    """
+    if not blob_digest:
+        yield file_path
+        return
+    with local_copy(blob_digest) as path:
+        yield path
+
+
+def content_source(file_path: str, blob_digest: str = None):
+    """What stream_zip needs for one file: a local path, or a callable opening the blob."""
+    if not blob_digest:
+        return file_path
+    storage = get_storage()
+    local = storage.local_path(blob_digest)
+    if local is not None:
+        return local
+    return lambda: storage.open(blob_digest)
+
+
+def release_blobs_for_files(db, file_ids) -> list:
+    """Drop the references held by these files rows; call before deleting or repointing them.
+    Returns the digests that were released, for collect_garbage().
+    """
+    if not file_ids:
+        return []
+    digests = [r[0] for r in db.execute(text(
+        "SELECT DISTINCT blob_digest FROM files WHERE file_id IN :file_ids AND blob_digest IS NOT NULL"
+    ).bindparams(bindparam("file_ids", expanding=True)), {"file_ids": list(file_ids)}).fetchall()]
+    if not digests:
+        return []
+    db.execute(text(
+        """
+        UPDATE blobs
+        SET ref_count = ref_count - (
+            SELECT COUNT(*) FROM files
+            WHERE files.blob_digest = blobs.digest AND files.file_id IN :file_ids
+        )
+        WHERE digest IN :digests
+        """
+    ).bindparams(bindparam("file_ids", expanding=True), bindparam("digests", expanding=True)),
+        {"file_ids": list(file_ids), "digests": digests})
+    return digests
+
+
+def collect_garbage(db, digests=None) -> int:
+    """Delete unreferenced blobs (all of them, or only the given digests) and their files.
+    Each blob's row is deleted and its file unlinked before that transaction commits, so a
+    concurrent upload of the same content waits and then stores a fresh copy.
+    """
+    query = "SELECT digest FROM blobs WHERE ref_count <= 0"
+    params = {}
+    if digests is not None:
+        if not digests:
+            return 0
+        query += " AND digest IN :digests"
+        params["digests"] = list(digests)
+    stmt = text(query)
+    if digests is not None:
+        stmt = stmt.bindparams(bindparam("digests", expanding=True))
+    candidates = [r[0] for r in db.execute(stmt, params).fetchall()]
+    db.commit()
+
+    removed = 0
+    for digest in candidates:
+        try:
+            deleted = db.execute(text("DELETE FROM blobs WHERE digest = :digest AND ref_count <= 0"), {"digest": digest})
+            if deleted.rowcount == 1:
+                discard_blob(digest)
+                removed += 1
+            db.commit()
+        except Exception:
+            db.rollback()
+    return removed
+
+
+def verify_blobs(db) -> dict:
+    """Compare ref_count with the files rows that point at each blob, and look for missing content."""
+    mismatched = db.execute(text(
+        """
+        SELECT COUNT(*) FROM blobs b
+        WHERE b.ref_count != (SELECT COUNT(*) FROM files f WHERE f.blob_digest = b.digest)
+        """
+    )).scalar()
+    dangling = db.execute(text(
+        "SELECT COUNT(*) FROM files f WHERE f.blob_digest IS NOT NULL "
+        "AND NOT EXISTS (SELECT 1 FROM blobs b WHERE b.digest = f.blob_digest)"
+    )).scalar()
+    storage = get_storage()
+    missing = sum(
+        1 for (digest,) in db.execute(text("SELECT digest FROM blobs WHERE ref_count > 0")).fetchall()
+        if not storage.exists(digest)
+    )
+    return {"mismatched": mismatched, "dangling": dangling, "missing": missing,
+            "ok": mismatched == 0 and dangling == 0 and missing == 0}
+
+
+def repair_ref_counts(db) -> int:
+    """Recompute every ref_count from the files table. Run while uploads are quiet."""
+    result = db.execute(text(
+        "UPDATE blobs SET ref_count = (SELECT COUNT(*) FROM files f WHERE f.blob_digest = blobs.digest)"
+    ))
+    return result.rowcount
+
+
+def _link_to_staging(path: str, file_id: int):
+    """A new hard link to path in STAGING_DIR, or None when the filesystem can't link it there."""
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    link = os.path.join(STAGING_DIR, f"legacy_{os.getpid()}_{file_id}")
+    discard_temp(link)
+    try:
+        os.link(path, link)
+    except OSError:
+        return None
+    return link
+
+
+def migrate_legacy_files(db, batch_size: int = 100, max_files: int = None) -> int:
+    """Move files stored flat under uploads/user_{id}/ into the sharded blob store
+    (duplicates are deduplicated on the way), committing one file at a time.
+    Safe to re-run and to run from several workers; returns the number of files moved.
+    """
+    storage = get_storage()
+    moved = 0
+    last_id = 0
+    while max_files is None or moved < max_files:
+        rows = db.execute(text(
+            """
+            SELECT file_id, file_path FROM files
+            WHERE blob_digest IS NULL AND file_id > :last_id
+            ORDER BY file_id LIMIT :limit
+            """
+        ), {"last_id": last_id, "limit": batch_size}).fetchall()
+        db.commit()
+        if not rows:
+            break
+        for file_id, file_path in rows:
+            last_id = file_id
+            if max_files is not None and moved >= max_files:
+                break
+            try:
+                digest, size = hash_file(file_path)
+            except (OSError, TypeError):
+                continue  # missing on disk, or already moved by another worker
+            link = None
+            created = False
+            try:
+                # claim the row first so two migrators never move the same file
+                claimed = db.execute(text(
+                    "UPDATE files SET blob_digest = :digest, file_path = :path "
+                    "WHERE file_id = :file_id AND blob_digest IS NULL"
+                ), {"digest": digest, "path": storage.describe(digest), "file_id": file_id})
+                if claimed.rowcount != 1:
+                    db.rollback()
+                    continue
+                # store a hard link (or a copy), never the file itself: until the commit
+                # lands, files.file_path may still point at it
+                link = _link_to_staging(file_path, file_id)
+                if link is not None:
+                    _, created = acquire_blob(db, digest, size, temp_path=link)
+                else:
+                    with open(file_path, "rb") as f:
+                        _, created = acquire_blob(db, digest, size, fileobj=f)
+                db.commit()
+                moved += 1
+            except Exception as e:
+                db.rollback()
+                if created:
+                    discard_blob(digest)
+                if link is not None:
+                    discard_temp(link)
+                print(f"Could not migrate file {file_id}: {e}")
+                continue
+            discard_temp(file_path)
+            try:
+                os.rmdir(os.path.dirname(file_path))  # drop the legacy directory once it is empty
+            except OSError:
+                pass
+    return moved
+
+
+if __name__ == "__main__":
+    import sys
+    from database import engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    with engine.connect() as conn:
+        if command == "verify":
+            result = verify_blobs(conn)
+            print(f"blobs mismatched={result['mismatched']} dangling={result['dangling']} missing={result['missing']}")
+            sys.exit(0 if result["ok"] else 1)
+        elif command == "repair":
+            count = repair_ref_counts(conn)
+            conn.commit()
+            print(f"blob ref counts recomputed: {count} rows")
+        elif command == "gc":
+            print(f"blobs collected: {collect_garbage(conn)}")
+        elif command == "migrate":
+            print(f"files moved into the blob store: {migrate_legacy_files(conn)}")
+        else:
+            print("usage: python blob_store.py [verify|repair|gc|migrate]")
+            sys.exit(2)
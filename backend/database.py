@@ -1,19 +1,98 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
+from dotenv import load_dotenv
+import os
+import re
+
+load_dotenv()
 
 # Database setup
-DATABASE_URL = "sqlite:///online_file_system.db"
-engine = create_engine(DATABASE_URL, echo=True)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///online_file_system.db")
+# production: WAL + tuned pragmas + sized pool; plain: SQLite defaults (e.g. for tests)
+DB_PROFILE = os.getenv("DB_PROFILE", "production")
+SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# pooled connections kept back from requests, for the scheduler, the log writer and
+# the auth helpers that connect directly (see utils.get_db)
+DB_RESERVED_CONNECTIONS = int(os.getenv("DB_RESERVED_CONNECTIONS", "5"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))  # per connection
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+engine_kwargs = {"echo": SQL_ECHO}
+if DB_PROFILE == "production":
+    engine_kwargs.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=True,
+    )
+    if DATABASE_URL.startswith("sqlite"):
+        # pooled connections are handed between threadpool workers
+        engine_kwargs["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+        }
+
+engine = create_engine(DATABASE_URL, **engine_kwargs)
+# connections the pool hands out at once (SQLAlchemy's QueuePool defaults outside production)
+DB_POOL_CAPACITY = DB_POOL_SIZE + DB_MAX_OVERFLOW if DB_PROFILE == "production" else 5 + 10
+# "sqlite" or "postgresql"; query sites use the helpers below instead of dialect-specific SQL
+DIALECT = engine.dialect.name
+IS_POSTGRES = DIALECT == "postgresql"
 from sqlalchemy import event
 
-@event.listens_for(engine, "connect")
+
+def sql_month(column: str) -> str:
+    """'YYYY-MM' of a timestamp column."""
+    if IS_POSTGRES:
+        return f"to_char({column}, 'YYYY-MM')"
+    return f"strftime('%Y-%m', {column})"
+
+
+def sql_date(expr: str) -> str:
+    """Calendar date of a timestamp column or bound parameter."""
+    if IS_POSTGRES:
+        return f"CAST({expr} AS DATE)"
+    return f"date({expr})"
+
+
+def translate_ddl(query: str) -> str:
+    """Rewrite the SQLite DDL in `queries` for the active dialect."""
+    if not IS_POSTGRES:
+        return query
+    query = query.replace("INTEGER PRIMARY KEY AUTOINCREMENT", "BIGSERIAL PRIMARY KEY")
+    query = query.replace("BOOLEAN DEFAULT 0", "BOOLEAN DEFAULT FALSE")
+    # the app writes full datetimes into DATE columns; SQLite keeps the time, so keep it here too
+    query = re.sub(r"\bDATE(TIME)?\b", "TIMESTAMP", query)
+    # sizes and storage totals overflow a 32-bit INTEGER
+    query = query.replace("INTEGER", "BIGINT")
+    return query
+
+
 def set_sqlite_pragma(dbapi_connection, connection_record):
     try:
         cursor = dbapi_connection.cursor()
         cursor.execute("PRAGMA foreign_keys=ON")
+        if DB_PROFILE == "production":
+            # WAL lets readers run alongside a writer; NORMAL is durable enough under WAL
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+            cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
         cursor.close()
     except Exception:
         pass
 
+
+if DIALECT == "sqlite":
+    event.listen(engine, "connect", set_sqlite_pragma)
+
+# Baseline schema, applied as migration 1; later tables and indexes go in migrations.py
 queries = [
 
     # Users table
@@ -144,12 +223,37 @@ queries = [
     CREATE INDEX IF NOT EXISTS idx_starred_user_id ON starred(user_id)
     """,
 
+    # Folder ancestry index (closure table), maintained by folder_tree.py
+    """
+    CREATE TABLE IF NOT EXISTS folder_closure (
+        ancestor_id INTEGER NOT NULL,
+        descendant_id INTEGER NOT NULL,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id),
+        FOREIGN KEY (ancestor_id) REFERENCES folders(folder_id) ON DELETE CASCADE,
+        FOREIGN KEY (descendant_id) REFERENCES folders(folder_id) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_folder_closure_descendant ON folder_closure(descendant_id, depth)
+    """,
+
+    # Recursive size rollups per folder and file owner, maintained by folder_tree.py
+    """
+    CREATE TABLE IF NOT EXISTS folder_stats (
+        folder_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        total_bytes INTEGER NOT NULL DEFAULT 0,
+        file_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (folder_id, user_id),
+        FOREIGN KEY (folder_id) REFERENCES folders(folder_id) ON DELETE CASCADE
+    )
+    """,
+
     
 ]
 
 def create_tables():
-    conn = engine.connect()
-    for q in queries:
-        conn.execute(text(q))
-    conn.commit()
-    conn.close()
+    """Bring the schema up to date (see migrations.py)."""
+    from migrations import migrate
+    migrate()
@@ -0,0 +1,341 @@
+from sqlalchemy import text, bindparam
+
+
+def get_subtree(db, root_ids, include_files: bool = True, file_user_id: int = None):
+    """Materialize the folder subtrees under root_ids with a single recursive CTE.
+    Returns {"folders": [...], "files": [...]}; every row carries the root_id it hangs
+    under and an archive-style path starting at the root folder's name ("top/sub/").
+    Only non-deleted files are returned; file_user_id narrows them to one owner.
+    """
+    if not root_ids:
+        return {"folders": [], "files": []}
+
+    files_sql = ""
+    if include_files:
+        files_sql = '''
+            UNION ALL
+            SELECT 'file' AS kind, t.root_id, fi.parent_id AS folder_id, fi.file_id,
+                   fi.file_name AS name, t.path || fi.file_name AS path, fi.file_path, fi.file_size, fi.blob_digest
+            FROM files fi
+            JOIN tree t ON fi.parent_id = t.folder_id
+            WHERE fi.status = 'not_deleted'
+        '''
+        if file_user_id is not None:
+            files_sql += " AND fi.user_id = :file_user_id"
+
+    query = text(f'''
+        WITH RECURSIVE tree(root_id, folder_id, parent_id, folder_name, path) AS (
+            SELECT folder_id, folder_id, parent_id, folder_name, folder_name || '/'
+            FROM folders
+            WHERE folder_id IN :root_ids
+            UNION ALL
+            SELECT t.root_id, f.folder_id, f.parent_id, f.folder_name, t.path || f.folder_name || '/'
+            FROM folders f
+            JOIN tree t ON f.parent_id = t.folder_id
+        )
+        SELECT 'folder' AS kind, root_id, folder_id, NULL AS file_id,
+               folder_name AS name, path, NULL AS file_path, NULL AS file_size, NULL AS blob_digest
+        FROM tree
+        {files_sql}
+    ''').bindparams(bindparam("root_ids", expanding=True))
+
+    params = {"root_ids": list(root_ids)}
+    if file_user_id is not None:
+        params["file_user_id"] = file_user_id
+
+    folders, files = [], []
+    for row in db.execute(query, params).fetchall():
+        item = dict(row._mapping)
+        kind = item.pop("kind")
+        if kind == "folder":
+            item.pop("file_id")
+            item.pop("file_path")
+            item.pop("file_size")
+            item.pop("blob_digest")
+            folders.append(item)
+        else:
+            files.append(item)
+
+    return {"folders": folders, "files": files}
+
+
+# ---------- Ancestry index (folder_closure) ----------
+# One row per (ancestor, descendant) pair, including the (folder, folder, 0) self row.
+# The virtual root (parent_id = 0) is not stored, so top-level folders only have their self row.
+
+def add_folder_to_closure(db, folder_id: int, parent_id: int):
+    """Index a newly created folder under parent_id."""
+    db.execute(text(
+        '''
+            INSERT INTO folder_closure (ancestor_id, descendant_id, depth)
+            SELECT :folder_id, :folder_id, 0
+            UNION ALL
+            SELECT ancestor_id, :folder_id, depth + 1
+            FROM folder_closure
+            WHERE descendant_id = :parent_id
+        '''
+    ), {"folder_id": folder_id, "parent_id": parent_id or 0})
+
+
+def move_folder_subtrees(db, folder_ids, new_parent_id: int):
+    """Re-hang the subtrees of folder_ids under new_parent_id, updating both the
+    ancestry index and the size rollups. Call after folders.parent_id is updated.
+    Runs per folder so nested selections (a folder and one of its children) stay correct.
+    """
+    for folder_id in folder_ids:
+        shift_subtree_stats(db, folder_id, -1)
+        # detach the subtree from its old ancestors
+        db.execute(text(
+            '''
+                DELETE FROM folder_closure
+                WHERE descendant_id IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = :folder_id)
+                  AND ancestor_id NOT IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = :folder_id)
+            '''
+        ), {"folder_id": folder_id})
+        # attach it below every ancestor of the new parent
+        db.execute(text(
+            '''
+                INSERT INTO folder_closure (ancestor_id, descendant_id, depth)
+                SELECT p.ancestor_id, c.descendant_id, p.depth + c.depth + 1
+                FROM folder_closure p
+                JOIN folder_closure c ON c.ancestor_id = :folder_id
+                WHERE p.descendant_id = :parent_id
+            '''
+        ), {"folder_id": folder_id, "parent_id": new_parent_id or 0})
+        shift_subtree_stats(db, folder_id, 1)
+
+
+def remove_folders_from_closure(db, folder_ids):
+    """Drop index and rollup rows of deleted folders (FK cascades do the same when enabled)."""
+    if not folder_ids:
+        return
+    db.execute(text(
+        '''
+            DELETE FROM folder_stats WHERE folder_id IN :folder_ids
+        '''
+    ).bindparams(bindparam("folder_ids", expanding=True)), {"folder_ids": list(folder_ids)})
+    db.execute(text(
+        '''
+            DELETE FROM folder_closure
+            WHERE descendant_id IN :folder_ids OR ancestor_id IN :folder_ids
+        '''
+    ).bindparams(bindparam("folder_ids", expanding=True)), {"folder_ids": list(folder_ids)})
+
+
+def get_descendant_ids(db, folder_ids) -> list:
+    """All folders under folder_ids, the folders themselves included."""
+    if not folder_ids:
+        return []
+    rows = db.execute(text(
+        '''
+            SELECT DISTINCT descendant_id FROM folder_closure WHERE ancestor_id IN :folder_ids
+        '''
+    ).bindparams(bindparam("folder_ids", expanding=True)), {"folder_ids": list(folder_ids)}).fetchall()
+    return [r[0] for r in rows]
+
+
+def get_ancestor_ids(db, folder_id: int) -> list:
+    """The folder itself followed by its ancestors, nearest first."""
+    rows = db.execute(text(
+        '''
+            SELECT ancestor_id FROM folder_closure WHERE descendant_id = :folder_id ORDER BY depth
+        '''
+    ), {"folder_id": folder_id}).fetchall()
+    return [r[0] for r in rows]
+
+
+def is_descendant(db, folder_id: int, ancestor_ids) -> bool:
+    """True if folder_id is one of ancestor_ids or lies below any of them."""
+    if not ancestor_ids:
+        return False
+    row = db.execute(text(
+        '''
+            SELECT 1 FROM folder_closure
+            WHERE ancestor_id IN :ancestor_ids AND descendant_id = :folder_id
+            LIMIT 1
+        '''
+    ).bindparams(bindparam("ancestor_ids", expanding=True)), {"ancestor_ids": list(ancestor_ids), "folder_id": folder_id}).fetchone()
+    return row is not None
+
+
+_EXPECTED_CLOSURE = '''
+    WITH RECURSIVE expected(ancestor_id, descendant_id, depth) AS (
+        SELECT folder_id, folder_id, 0 FROM folders WHERE folder_id != 0
+        UNION ALL
+        SELECT f.parent_id, e.descendant_id, e.depth + 1
+        FROM expected e
+        JOIN folders f ON f.folder_id = e.ancestor_id
+        WHERE f.parent_id IS NOT NULL AND f.parent_id != 0
+    )
+'''
+
+
+def rebuild_folder_closure(db) -> int:
+    """Recompute the whole index from folders.parent_id. Returns the row count."""
+    db.execute(text("DELETE FROM folder_closure"))
+    db.execute(text(_EXPECTED_CLOSURE + '''
+        INSERT INTO folder_closure (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, depth FROM expected
+    '''))
+    return db.execute(text("SELECT COUNT(*) FROM folder_closure")).scalar()
+
+
+def verify_folder_closure(db) -> dict:
+    """Compare the index against folders.parent_id without modifying anything."""
+    missing = db.execute(text(_EXPECTED_CLOSURE + '''
+        SELECT COUNT(*) FROM (
+            SELECT ancestor_id, descendant_id, depth FROM expected
+            EXCEPT
+            SELECT ancestor_id, descendant_id, depth FROM folder_closure
+        ) AS m
+    ''')).scalar()
+    extra = db.execute(text(_EXPECTED_CLOSURE + '''
+        SELECT COUNT(*) FROM (
+            SELECT ancestor_id, descendant_id, depth FROM folder_closure
+            EXCEPT
+            SELECT ancestor_id, descendant_id, depth FROM expected
+        ) AS x
+    ''')).scalar()
+    return {"missing": int(missing), "extra": int(extra), "ok": missing == 0 and extra == 0}
+
+
+# ---------- Size rollups (folder_stats) ----------
+# Recursive non-deleted byte and file counts per folder and file owner, adjusted in
+# the same transaction as the change that causes them. Keyed by owner so the quota
+# pages can read one user's share of a folder that others also write to. Rows are
+# created on first use; a missing row means zero.
+
+_ADD_TO_STATS = '''
+    ON CONFLICT (folder_id, user_id) DO UPDATE
+    SET total_bytes = folder_stats.total_bytes + excluded.total_bytes,
+        file_count = folder_stats.file_count + excluded.file_count
+'''
+
+
+def adjust_stats_for_files(db, file_ids, sign: int):
+    """Add (sign=1) or remove (sign=-1) the given files from every folder above them.
+    Uses the rows as they are now: call with -1 before a file leaves its folder
+    (move, soft delete, replace, purge) and with 1 once it has arrived.
+    Files that are deleted or sit in the root do not count towards any folder.
+    """
+    if not file_ids:
+        return
+    db.execute(text(
+        '''
+            INSERT INTO folder_stats (folder_id, user_id, total_bytes, file_count)
+            SELECT c.ancestor_id, fi.user_id, :sign * COALESCE(SUM(fi.file_size), 0), :sign * COUNT(*)
+            FROM files fi
+            JOIN folder_closure c ON c.descendant_id = fi.parent_id
+            WHERE fi.file_id IN :file_ids AND fi.status = 'not_deleted' AND c.ancestor_id != 0
+            GROUP BY c.ancestor_id, fi.user_id
+        ''' + _ADD_TO_STATS
+    ).bindparams(bindparam("file_ids", expanding=True)), {"file_ids": list(file_ids), "sign": sign})
+
+
+def shift_subtree_stats(db, folder_id: int, sign: int):
+    """Add (sign=1) or remove (sign=-1) a folder's rollup from its strict ancestors."""
+    db.execute(text(
+        '''
+            INSERT INTO folder_stats (folder_id, user_id, total_bytes, file_count)
+            SELECT c.ancestor_id, s.user_id, :sign * s.total_bytes, :sign * s.file_count
+            FROM folder_closure c
+            JOIN folder_stats s ON s.folder_id = :folder_id
+            WHERE c.descendant_id = :folder_id AND c.depth > 0 AND c.ancestor_id != 0
+        ''' + _ADD_TO_STATS
+    ), {"folder_id": folder_id, "sign": sign})
+
+
+def top_level_ids(db, folder_ids) -> list:
+    """folder_ids without those that sit inside another selected folder."""
+    folder_ids = list(dict.fromkeys(folder_ids))
+    if len(folder_ids) < 2:
+        return folder_ids
+    nested = {r[0] for r in db.execute(text(
+        '''
+            SELECT DISTINCT descendant_id FROM folder_closure
+            WHERE descendant_id IN :folder_ids AND ancestor_id IN :folder_ids AND depth > 0
+        '''
+    ).bindparams(bindparam("folder_ids", expanding=True)), {"folder_ids": folder_ids}).fetchall()}
+    return [f for f in folder_ids if f not in nested]
+
+
+def detach_deleted_folders(db, folder_ids):
+    """Remove the rollups of folders about to be deleted from the ancestors that remain.
+    A selected folder inside another selected folder leaves with it, so only the
+    top-most ones are detached; detaching both would subtract the inner one twice.
+    """
+    for folder_id in top_level_ids(db, folder_ids):
+        shift_subtree_stats(db, folder_id, -1)
+
+
+_EXPECTED_STATS = '''
+    SELECT c.ancestor_id AS folder_id, fi.user_id,
+           COALESCE(SUM(fi.file_size), 0) AS total_bytes,
+           COUNT(*) AS file_count
+    FROM folder_closure c
+    JOIN files fi ON fi.parent_id = c.descendant_id AND fi.status = 'not_deleted'
+    WHERE c.ancestor_id != 0
+    GROUP BY c.ancestor_id, fi.user_id
+'''
+
+
+def rebuild_folder_stats(db) -> int:
+    """Consistency repair: recompute every rollup from files and folder_closure."""
+    db.execute(text("DELETE FROM folder_stats"))
+    db.execute(text("INSERT INTO folder_stats (folder_id, user_id, total_bytes, file_count) " + _EXPECTED_STATS))
+    return db.execute(text("SELECT COUNT(*) FROM folder_stats")).scalar()
+
+
+def verify_folder_stats(db) -> dict:
+    """Count (folder, owner) rollups that differ from a fresh computation."""
+    mismatched = db.execute(text(f'''
+        SELECT COUNT(*) FROM ({_EXPECTED_STATS}) AS e
+        LEFT JOIN folder_stats s ON s.folder_id = e.folder_id AND s.user_id = e.user_id
+        WHERE s.folder_id IS NULL OR s.total_bytes != e.total_bytes OR s.file_count != e.file_count
+    ''')).scalar()
+    # rows left behind once an owner's last file went away must have dropped to zero
+    stale = db.execute(text(f'''
+        SELECT COUNT(*) FROM folder_stats s
+        WHERE (s.total_bytes != 0 OR s.file_count != 0)
+          AND NOT EXISTS (SELECT 1 FROM ({_EXPECTED_STATS}) AS e WHERE e.folder_id = s.folder_id AND e.user_id = s.user_id)
+    ''')).scalar()
+    mismatched = int(mismatched) + int(stale)
+    return {"mismatched": mismatched, "ok": mismatched == 0}
+
+
+def ensure_folder_closure(db):
+    """Build the index and rollups once for databases created before they existed."""
+    has_folders = db.execute(text("SELECT 1 FROM folders WHERE folder_id != 0 LIMIT 1")).fetchone()
+    if not has_folders:
+        return
+    if not db.execute(text("SELECT 1 FROM folder_closure LIMIT 1")).fetchone():
+        rebuild_folder_closure(db)
+    if not db.execute(text("SELECT 1 FROM folder_stats LIMIT 1")).fetchone():
+        rebuild_folder_stats(db)
+
+
+if __name__ == "__main__":
+    # python folder_tree.py [verify|rebuild|rebuild-stats]
+    import sys
+    from database import engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    with engine.connect() as conn:
+        if command == "rebuild":
+            count = rebuild_folder_closure(conn)
+            rebuild_folder_stats(conn)
+            conn.commit()
+            print(f"folder_closure rebuilt: {count} rows")
+        elif command == "rebuild-stats":
+            count = rebuild_folder_stats(conn)
+            conn.commit()
+            print(f"folder_stats rebuilt: {count} rows")
+        elif command == "verify":
+            result = verify_folder_closure(conn)
+            stats = verify_folder_stats(conn)
+            print(f"folder_closure missing={result['missing']} extra={result['extra']}")
+            print(f"folder_stats mismatched={stats['mismatched']}")
+            sys.exit(0 if result["ok"] and stats["ok"] else 1)
+        else:
+            print("usage: python folder_tree.py [verify|rebuild|rebuild-stats]")
+            sys.exit(2)
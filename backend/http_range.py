@@ -0,0 +1,279 @@
+import logging
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+import anyio
+from fastapi.responses import Response, StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+MAX_RANGES = 16  # more parts than this (after merging) is served as a plain 200
+
+# How local files reach the client once the request is authorized:
+#   stream      - the app sends the bytes with async chunked reads (default); zero-copy
+#                 only if the ASGI server offers the zerocopysend extension, and uvicorn
+#                 does not
+#   sendfile    - the same, for servers that offer zerocopysend; warns when the server
+#                 lacks it, as every byte then goes through the worker
+#   x-accel     - empty response with X-Accel-Redirect; nginx streams the file (and ranges)
+#   x-sendfile  - empty response with X-Sendfile (Apache mod_xsendfile, lighttpd)
+# Under uvicorn only x-accel and x-sendfile keep the download's CPU cost off the app.
+SENDFILE_MODE = os.getenv("SENDFILE_MODE", "stream")
+# x-accel: the `internal` nginx location that maps onto X_ACCEL_ROOT on disk
+X_ACCEL_PREFIX = os.getenv("X_ACCEL_PREFIX", "/protected/")
+X_ACCEL_ROOT = os.path.abspath(os.getenv("X_ACCEL_ROOT", "uploads"))
+
+
+logger = logging.getLogger(__name__)
+_zerocopy_checked = False
+
+
+def _check_zerocopy(scope) -> bool:
+    """Whether the server offers zero-copy send; in sendfile mode, warns once when it does not
+    (servers only advertise extensions on request scopes, so this runs on the first download)."""
+    global _zerocopy_checked
+    available = "http.response.zerocopysend" in scope.get("extensions", {})
+    if not available and not _zerocopy_checked and SENDFILE_MODE == "sendfile":
+        logger.warning("SENDFILE_MODE=sendfile but the ASGI server does not offer http.response.zerocopysend; "
+                       "downloads fall back to chunked reads. Use x-accel or x-sendfile behind a proxy instead.")
+    _zerocopy_checked = True
+    return available
+
+
+def make_etag(file_id: int, stat: os.stat_result) -> str:
+    """Strong validator: changes whenever the stored bytes are replaced (new size or mtime)."""
+    return f'"{file_id}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int):
+    """Parse a `Range: bytes=...` header into sorted, merged (start, end) pairs (end inclusive).
+    Returns None when the header should be ignored and [] when nothing is satisfiable.
+    """
+    if not header or size == 0 or not header.strip().lower().startswith("bytes="):
+        return None
+    ranges = []
+    for spec in header.split("=", 1)[1].split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        start, sep, end = spec.partition("-")
+        if not sep:
+            return None
+        try:
+            if start.strip() == "":
+                # suffix range: last N bytes
+                length = int(end)
+                if length <= 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            first = int(start)
+            last = int(end) if end.strip() else size - 1
+        except ValueError:
+            return None
+        if end.strip() and first > last:
+            return None
+        if first >= size:
+            continue
+        ranges.append((first, min(last, size - 1)))
+    ranges.sort()
+    merged = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = [t.strip() for t in header.split(",")]
+    # If-None-Match uses weak comparison
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _not_modified(request, etag: str, mtime: float) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return _etag_matches(inm, etag)
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _if_range_ok(request, etag: str, last_modified: str) -> bool:
+    value = request.headers.get("if-range")
+    if value is None:
+        return True
+    # If-Range needs a strong, exact match; otherwise the full representation is sent
+    return value.strip() == etag or value.strip() == last_modified
+
+
+def _read_span(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = f.read(min(CHUNK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+class SendfileResponse(Response):
+    """count bytes of a local file from offset, with async chunked reads, or the server's
+    zero-copy send (os.sendfile) when it advertises http.response.zerocopysend.
+    """
+
+    def __init__(self, path: str, offset: int, count: int, status_code: int = 200,
+                 media_type: str = None, headers=None):
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.init_headers({**(headers or {}), "Content-Length": str(count)})
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD" or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if _check_zerocopy(scope):
+            with open(self.path, "rb") as f:
+                await send({"type": "http.response.zerocopysend", "file": f,
+                            "offset": self.offset, "count": self.count, "more_body": False})
+            return
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # file shrank under us; end the body rather than hang the client
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _offload_headers(path: str):
+    """Header telling the front proxy to serve path itself, or None to serve it from here."""
+    if SENDFILE_MODE == "x-sendfile":
+        return {"X-Sendfile": os.path.abspath(path)}
+    if SENDFILE_MODE == "x-accel":
+        relative = os.path.relpath(os.path.abspath(path), X_ACCEL_ROOT)
+        if relative.startswith(".."):
+            return None  # outside the proxy's internal location
+        return {"X-Accel-Redirect": X_ACCEL_PREFIX.rstrip("/") + "/" + quote(relative.replace(os.sep, "/"))}
+    return None
+
+
+def ranged_file_response(request, path: str, etag: str, media_type: str = "application/octet-stream", headers=None):
+    """Serve a local file honouring Range, If-Range, If-None-Match and If-Modified-Since.
+    Returns 304, 416, 206 (single or multipart/byteranges) or a full 200. In x-accel /
+    x-sendfile mode the proxy sends the bytes and handles Range itself.
+    """
+    stat = os.stat(path)
+    offload = _offload_headers(path)
+    if offload is not None:
+        base = {**(headers or {}), "ETag": etag, "Cache-Control": "private, no-cache"}
+        if _not_modified(request, etag, stat.st_mtime):
+            return Response(status_code=304, headers={k: v for k, v in base.items() if k != "Content-Disposition"})
+        response = Response(status_code=200, media_type=media_type, headers={**base, **offload})
+        del response.headers["content-length"]  # the proxy sets it for the real body
+        return response
+    return _ranged_response(
+        request, stat.st_size, stat.st_mtime, etag,
+        read_span=lambda start, end: _read_span(path, start, end),
+        full_response=lambda hdrs: SendfileResponse(path, 0, stat.st_size, media_type=media_type, headers=hdrs),
+        media_type=media_type, headers=headers,
+        single_range=lambda start, end, hdrs: SendfileResponse(
+            path, start, end - start + 1, status_code=206, media_type=media_type, headers=hdrs),
+    )
+
+
+def ranged_storage_response(request, storage, key: str, etag: str, media_type: str = "application/octet-stream", headers=None):
+    """Same as ranged_file_response for an object in a storage driver (see storage.py)."""
+    stat = storage.stat(key)
+    if stat is None:
+        raise FileNotFoundError(key)
+
+    def full_response(hdrs):
+        hdrs = {**hdrs, "Content-Length": str(stat.size)}
+        body = storage.iter_range(key, 0, stat.size - 1) if stat.size else iter(())
+        return StreamingResponse(body, media_type=media_type, headers=hdrs)
+
+    return _ranged_response(
+        request, stat.size, stat.mtime, etag,
+        read_span=lambda start, end: storage.iter_range(key, start, end),
+        full_response=full_response,
+        media_type=media_type, headers=headers,
+    )
+
+
+def _ranged_response(request, size: int, mtime: float, etag: str, read_span, full_response, media_type, headers,
+                     single_range=None):
+    last_modified = formatdate(mtime, usegmt=True)
+    base = dict(headers or {})
+    base.update({
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        # authenticated content: let the browser keep it but always revalidate
+        "Cache-Control": "private, no-cache",
+    })
+
+    if _not_modified(request, etag, mtime):
+        return Response(status_code=304, headers={k: v for k, v in base.items() if k != "Content-Disposition"})
+
+    ranges = None
+    if _if_range_ok(request, etag, last_modified):
+        ranges = parse_range(request.headers.get("range"), size)
+    if ranges == []:
+        return Response(status_code=416, headers={**base, "Content-Range": f"bytes */{size}"})
+    if not ranges or len(ranges) > MAX_RANGES:
+        return full_response(base)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        base.update({
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(end - start + 1),
+        })
+        if single_range is not None:
+            return single_range(start, end, base)
+        return StreamingResponse(read_span(start, end), status_code=206, media_type=media_type, headers=base)
+
+    boundary = secrets.token_hex(16)
+    parts = []
+    length = 0
+    for start, end in ranges:
+        head = (
+            f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        parts.append((head, start, end))
+        length += len(head) + (end - start + 1) + 2
+    tail = f"--{boundary}--\r\n".encode()
+    length += len(tail)
+    base["Content-Length"] = str(length)
+
+    def body():
+        for head, start, end in parts:
+            yield head
+            yield from read_span(start, end)
+            yield b"\r\n"
+        yield tail
+
+    return StreamingResponse(
+        body(), status_code=206, media_type=f"multipart/byteranges; boundary={boundary}", headers=base
+    )
@@ -0,0 +1,219 @@
+"""Activity log retention.
+
+activity_logs is the hot table: recent raw events, small enough that the batched
+writer's inserts and the keyset reads in routes/logs.py stay cheap. The scheduler
+job here
+  1. rolls complete days into activity_log_daily (per user, action and day), then
+  2. moves raw rows older than LOG_RETENTION_DAYS into one archive table per month
+     (activity_logs_YYYYMM, listed in activity_log_archives), and
+  3. drops archive months older than LOG_ARCHIVE_MONTHS, when set.
+
+Archives hold only rows older than everything in the hot table, and months don't
+overlap, so readers go hot table first, then archive months newest first, and stop
+once a page is full (see archive_tables).
+"""
+import os
+import re
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text, bindparam
+
+from database import sql_date, translate_ddl
+
+# raw rows older than this leave the hot table; 0 keeps everything hot
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "90"))
+# archive months kept before they are dropped; 0 keeps them forever
+LOG_ARCHIVE_MONTHS = int(os.getenv("LOG_ARCHIVE_MONTHS", "0"))
+LOG_ARCHIVE_BATCH = int(os.getenv("LOG_ARCHIVE_BATCH", "5000"))
+
+LOG_COLUMNS = "log_id, user_id, action, resource_type, resource_id, details, ip_address, created_at"
+_ARCHIVE_NAME = re.compile(r"^activity_logs_\d{6}$")
+
+
+def create_retention_schema(conn):
+    conn.execute(text(translate_ddl(
+        """
+        CREATE TABLE IF NOT EXISTS activity_log_daily (
+            log_date DATE NOT NULL,
+            user_id INTEGER NOT NULL,
+            action VARCHAR(50) NOT NULL,
+            event_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, log_date, action)
+        )
+        """
+    )))
+    conn.execute(text(translate_ddl(
+        """
+        CREATE TABLE IF NOT EXISTS activity_log_archives (
+            table_name VARCHAR(40) PRIMARY KEY,
+            month_start DATE NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )))
+
+
+def _month_start(value) -> date:
+    return date(int(str(value)[:4]), int(str(value)[5:7]), 1)
+
+
+def _day(value) -> date:
+    return date.fromisoformat(str(value)[:10])
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+def create_archive_table(conn, table_name: str):
+    """Archive table with the hot table's columns and read indexes."""
+    if not _ARCHIVE_NAME.match(table_name):
+        raise ValueError(f"bad archive table name {table_name!r}")
+    conn.execute(text(translate_ddl(
+        f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            log_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            action VARCHAR(50) NOT NULL,
+            resource_type VARCHAR(50),
+            resource_id INTEGER,
+            details TEXT,
+            ip_address VARCHAR(45),
+            created_at DATETIME
+        )
+        """
+    )))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_user_created ON {table_name}(user_id, created_at, log_id)"))
+    conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS idx_{table_name}_user_action_created ON {table_name}(user_id, action, created_at, log_id)"
+    ))
+
+
+def _ensure_archive(db, month: date) -> str:
+    table_name = f"activity_logs_{month:%Y%m}"
+    create_archive_table(db, table_name)
+    db.execute(text(
+        """
+        INSERT INTO activity_log_archives (table_name, month_start) VALUES (:t, :m)
+        ON CONFLICT (table_name) DO NOTHING
+        """
+    ), {"t": table_name, "m": month})
+    return table_name
+
+
+def archive_tables(db, start: datetime = None, end: datetime = None) -> list:
+    """Archive tables newest month first, limited to months overlapping [start, end)."""
+    rows = db.execute(text("SELECT table_name, month_start FROM activity_log_archives")).fetchall()
+    tables = []
+    for table_name, month_start in rows:
+        month = _month_start(month_start)
+        if end is not None and datetime.combine(month, datetime.min.time()) >= end:
+            continue
+        if start is not None and datetime.combine(_next_month(month), datetime.min.time()) <= start:
+            continue
+        if _ARCHIVE_NAME.match(table_name):
+            tables.append((month, table_name))
+    return [t for _, t in sorted(tables, reverse=True)]
+
+
+def roll_up_daily(db) -> int:
+    """Recount complete days not yet rolled up (and the last rolled day, which may have
+    gained late events). Returns the number of (user, day, action) rows written."""
+    last = db.execute(text("SELECT MAX(log_date) FROM activity_log_daily")).scalar()
+    if last is not None:
+        since = datetime.combine(_day(last), datetime.min.time())
+    else:
+        first = db.execute(text("SELECT MIN(created_at) FROM activity_logs")).scalar()
+        if first is None:
+            return 0
+        since = datetime.combine(_day(first), datetime.min.time())
+    today = datetime.combine(date.today(), datetime.min.time())
+    if since >= today:
+        return 0
+
+    rows = db.execute(text(
+        f"""
+        SELECT user_id, {sql_date('created_at')} AS log_date, action, COUNT(*) AS event_count
+        FROM activity_logs
+        WHERE created_at >= :since AND created_at < :today
+        GROUP BY user_id, {sql_date('created_at')}, action
+        """
+    ), {"since": since, "today": today}).fetchall()
+    if not rows:
+        return 0
+    db.execute(text(
+        """
+        INSERT INTO activity_log_daily (log_date, user_id, action, event_count)
+        VALUES (:log_date, :user_id, :action, :event_count)
+        ON CONFLICT (user_id, log_date, action) DO UPDATE SET event_count = excluded.event_count
+        """
+    ), [
+        {"log_date": _day(r.log_date), "user_id": r.user_id, "action": r.action, "event_count": r.event_count}
+        for r in rows
+    ])
+    db.commit()
+    return len(rows)
+
+
+def archive_old_logs(db, retention_days: int = LOG_RETENTION_DAYS, batch_size: int = LOG_ARCHIVE_BATCH,
+                     max_rows: int = None) -> int:
+    """Move raw rows older than retention_days into their month's archive table, one
+    committed batch at a time. Only days already rolled up are moved. Returns rows moved."""
+    if retention_days <= 0:
+        return 0
+    cutoff = datetime.combine(date.today() - timedelta(days=retention_days), datetime.min.time())
+    rolled = db.execute(text("SELECT MAX(log_date) FROM activity_log_daily")).scalar()
+    if rolled is None:
+        return 0
+    # the last rolled day may still be recounted, so it stays hot
+    cutoff = min(cutoff, datetime.combine(_day(rolled), datetime.min.time()))
+
+    moved = 0
+    while max_rows is None or moved < max_rows:
+        oldest = db.execute(text("SELECT MIN(created_at) FROM activity_logs WHERE created_at < :cutoff"),
+                            {"cutoff": cutoff}).scalar()
+        if oldest is None:
+            break
+        month = _month_start(oldest)
+        upto = min(cutoff, datetime.combine(_next_month(month), datetime.min.time()))
+        limit = batch_size if max_rows is None else min(batch_size, max_rows - moved)
+        ids = [r[0] for r in db.execute(text(
+            """
+            SELECT log_id FROM activity_logs
+            WHERE created_at >= :start AND created_at < :upto
+            ORDER BY created_at
+            LIMIT :limit
+            """
+        ), {"start": datetime.combine(month, datetime.min.time()), "upto": upto, "limit": limit}).fetchall()]
+        if not ids:
+            break
+        try:
+            table_name = _ensure_archive(db, month)
+            db.execute(text(
+                f"INSERT INTO {table_name} ({LOG_COLUMNS}) SELECT {LOG_COLUMNS} FROM activity_logs WHERE log_id IN :ids"
+            ).bindparams(bindparam("ids", expanding=True)), {"ids": ids})
+            db.execute(text("DELETE FROM activity_logs WHERE log_id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                       {"ids": ids})
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        moved += len(ids)
+    return moved
+
+
+def drop_expired_archives(db, keep_months: int = LOG_ARCHIVE_MONTHS) -> list:
+    """Drop archive months older than keep_months (counting the current month). Returns
+    the dropped table names."""
+    if keep_months <= 0:
+        return []
+    month = date.today().replace(day=1)
+    for _ in range(keep_months - 1):
+        month = date(month.year - (month.month == 1), (month.month - 2) % 12 + 1, 1)
+    dropped = []
+    for table_name in archive_tables(db, end=datetime.combine(month, datetime.min.time())):
+        db.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+        db.execute(text("DELETE FROM activity_log_archives WHERE table_name = :t"), {"t": table_name})
+        db.commit()
+        dropped.append(table_name)
+    return dropped
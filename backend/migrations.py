@@ -0,0 +1,342 @@
+"""Versioned schema migrations.
+
+Each migration is (version, name, steps) and runs once, in order; the applied
+versions are recorded in schema_migrations. Steps are SQL strings (SQLite DDL,
+translated for PostgreSQL), callables taking the connection, or OnlineIndex.
+Steps must be idempotent (IF NOT EXISTS) so a migration interrupted half way can
+simply be run again.
+
+    python migrations.py [status|upgrade]
+
+Workers only read the current version at startup (see check_schema).
+"""
+import os
+import sys
+import time
+
+from sqlalchemy import text, inspect
+
+from database import engine, queries, translate_ddl, IS_POSTGRES
+
+# 1: apply pending migrations at startup (single-process/dev); 0: refuse to start on an old schema
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1") == "1"
+MIGRATION_LOCK_KEY = 72_310_001  # pg_advisory_lock key
+
+
+class OnlineIndex:
+    """An index built without blocking writers where the database supports it.
+    PostgreSQL uses CREATE INDEX CONCURRENTLY outside a transaction; SQLite has no
+    online build, so it falls back to a plain CREATE INDEX. Indexes with an access
+    method (`using`, e.g. gin) are PostgreSQL-only and skipped on SQLite.
+    """
+
+    def __init__(self, name: str, table: str, columns: str, unique: bool = False, using: str = None):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.unique = unique
+        self.using = using
+
+    def create(self):
+        unique = "UNIQUE " if self.unique else ""
+        if not IS_POSTGRES:
+            if self.using:
+                return
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE {unique}INDEX IF NOT EXISTS {self.name} ON {self.table}({self.columns})"
+                ))
+            return
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            try:
+                conn.execute(text(
+                    f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {self.name} ON {self.table}"
+                    f"{' USING ' + self.using if self.using else ''} ({self.columns})"
+                ))
+            except Exception:
+                # a failed concurrent build leaves an INVALID index behind
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self.name}"))
+                raise
+
+
+def add_column(table: str, column: str, ddl: str):
+    """Step that runs ALTER TABLE ... ADD COLUMN only if the column is missing."""
+    def step(conn):
+        if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+            conn.execute(text(translate_ddl(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")))
+    return step
+
+
+def _seed_root_folder(conn):
+    # folder 0 is the virtual root that top-level folders and files point at
+    conn.execute(text(
+        """
+        INSERT INTO folders (folder_id, folder_name, parent_id, user_id)
+        SELECT 0, 'root', NULL, NULL
+        WHERE NOT EXISTS (SELECT 1 FROM folders WHERE folder_id = 0)
+        """
+    ))
+
+
+def _ensure_folder_closure(conn):
+    from folder_tree import ensure_folder_closure
+    ensure_folder_closure(conn)
+
+
+def _create_search_schema(conn):
+    from search_index import create_search_schema
+    create_search_schema(conn)
+
+
+def _create_name_trigram_index(conn):
+    from search_index import create_name_trigram_index
+    create_name_trigram_index(conn)
+
+
+def _drop_name_trigram_index(conn):
+    from search_index import drop_name_trigram_index
+    drop_name_trigram_index(conn)
+
+
+def _rebuild_folder_stats(conn):
+    from folder_tree import rebuild_folder_stats
+    rebuild_folder_stats(conn)
+
+
+def _create_retention_schema(conn):
+    from log_retention import create_retention_schema
+    create_retention_schema(conn)
+
+
+MIGRATIONS = [
+    # everything create_tables() used to build; IF NOT EXISTS lets existing databases adopt it
+    (1, "baseline", queries + [_seed_root_folder, _ensure_folder_closure]),
+    (2, "user activity and suggestions", [
+        """
+        CREATE TABLE IF NOT EXISTS user_activity (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            file_id INTEGER,
+            action VARCHAR(50) NOT NULL,
+            file_type VARCHAR(20),
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_suggestions (
+            user_id INTEGER NOT NULL,
+            suggestion_key VARCHAR(100) NOT NULL,
+            dismissed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, suggestion_key),
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+        """,
+        OnlineIndex("idx_user_activity_user_action_time", "user_activity", "user_id, action, timestamp"),
+    ]),
+    (3, "resumable upload sessions", [
+        """
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            upload_id VARCHAR(64) PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            parent_id INTEGER NOT NULL,
+            file_name VARCHAR(100) NOT NULL,
+            total_size INTEGER NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            temp_path VARCHAR(255) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'open' CHECK(status IN ('open', 'finalizing')),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS upload_chunks (
+            upload_id VARCHAR(64) NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            sha256 VARCHAR(64) NOT NULL,
+            PRIMARY KEY (upload_id, chunk_index),
+            FOREIGN KEY (upload_id) REFERENCES upload_sessions(upload_id) ON DELETE CASCADE
+        )
+        """,
+        OnlineIndex("idx_upload_sessions_updated_at", "upload_sessions", "updated_at"),
+    ]),
+    (4, "content-addressed blobs", [
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+            digest VARCHAR(64) PRIMARY KEY,
+            size INTEGER NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        add_column("files", "blob_digest", "VARCHAR(64)"),
+        OnlineIndex("idx_files_blob_digest", "files", "blob_digest"),
+        OnlineIndex("idx_blobs_ref_count", "blobs", "ref_count"),
+    ]),
+    (5, "full-text search index", [
+        _create_search_schema,
+        OnlineIndex("idx_search_documents_user", "search_documents", "user_id"),
+        OnlineIndex("idx_search_documents_pending", "search_documents", "content_pending"),
+    ]),
+    (6, "trigram name index", [
+        _create_name_trigram_index,
+        OnlineIndex("idx_search_documents_name_trgm", "search_documents", "lower(name) gin_trgm_ops", using="gin"),
+    ]),
+    (7, "listing sort keys", [
+        # keyset pagination needs non-NULL sort keys (see pagination.py)
+        "UPDATE files SET status = 'not_deleted' WHERE status IS NULL",
+        "UPDATE files SET file_size = 0 WHERE file_size IS NULL",
+        "UPDATE files SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL",
+        "UPDATE folders SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL",
+        OnlineIndex("idx_files_parent_status_name", "files", "parent_id, status, file_name, file_id"),
+        OnlineIndex("idx_files_parent_status_updated", "files", "parent_id, status, updated_at, file_id"),
+        OnlineIndex("idx_files_parent_status_size", "files", "parent_id, status, file_size, file_id"),
+        OnlineIndex("idx_files_user_parent_status_name", "files", "user_id, parent_id, status, file_name, file_id"),
+        OnlineIndex("idx_files_user_status_updated", "files", "user_id, status, updated_at, file_id"),
+        OnlineIndex("idx_folders_parent_name", "folders", "parent_id, folder_name, folder_id"),
+        OnlineIndex("idx_folders_parent_updated", "folders", "parent_id, updated_at, folder_id"),
+        OnlineIndex("idx_folders_user_parent_name", "folders", "user_id, parent_id, folder_name, folder_id"),
+        OnlineIndex("idx_starred_user_id_id", "starred", "user_id, id"),
+        OnlineIndex("idx_share_access_user_share", "share_access", "user_id, share_id"),
+    ]),
+    (8, "activity log action index", [
+        # per-action keyset reads for /logs/me?action= and /logs/me/security
+        OnlineIndex("idx_activity_logs_user_action_created", "activity_logs", "user_id, action, created_at, log_id"),
+    ]),
+    (9, "activity log retention", [
+        _create_retention_schema,
+        # retention finds the oldest hot rows by time alone
+        OnlineIndex("idx_activity_logs_created_at", "activity_logs", "created_at"),
+    ]),
+    (10, "per-owner folder stats", [
+        # quota pages count only the caller's bytes in folders others also write to
+        "DROP TABLE IF EXISTS folder_stats",
+        """
+        CREATE TABLE folder_stats (
+            folder_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            total_bytes INTEGER NOT NULL DEFAULT 0,
+            file_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (folder_id, user_id),
+            FOREIGN KEY (folder_id) REFERENCES folders(folder_id) ON DELETE CASCADE
+        )
+        """,
+        _rebuild_folder_stats,
+    ]),
+    (11, "in-flight upload chunks", [
+        # finalize waits for chunk writes that started before it claimed the session
+        add_column("upload_sessions", "chunks_in_flight", "INTEGER NOT NULL DEFAULT 0"),
+    ]),
+    (12, "per-owner name trigrams", [
+        # name lookups match only the owners a user can see (SQLite; pg_trgm is unchanged)
+        _drop_name_trigram_index,
+        _create_name_trigram_index,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(translate_ddl(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )))
+
+
+def get_schema_version(conn) -> int:
+    """Highest applied version, 0 for a database that predates migrations."""
+    try:
+        return int(conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar())
+    except Exception:
+        conn.rollback()
+        return 0
+
+
+def _apply(version: int, name: str, steps):
+    online = [s for s in steps if isinstance(s, OnlineIndex)]
+    with engine.begin() as conn:
+        for step in steps:
+            if isinstance(step, OnlineIndex):
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(text(translate_ddl(step)))
+    for index in online:
+        index.create()
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+            {"version": version, "name": name},
+        )
+
+
+def migrate(target: int = None) -> int:
+    """Apply pending migrations up to target (default: all). Returns the new version."""
+    target = LATEST_VERSION if target is None else target
+    with engine.connect() as lock_conn:
+        if IS_POSTGRES:
+            # serialize concurrent upgraders (e.g. several workers starting together)
+            lock_conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": MIGRATION_LOCK_KEY})
+            lock_conn.commit()
+        try:
+            with engine.begin() as conn:
+                _ensure_version_table(conn)
+            for version, name, steps in MIGRATIONS:
+                if version > target:
+                    break
+                with engine.connect() as conn:
+                    if get_schema_version(conn) >= version:
+                        continue
+                try:
+                    _apply(version, name, steps)
+                    print(f"Applied migration {version}: {name}")
+                except Exception:
+                    # on SQLite another process may have applied it while we waited for the write lock
+                    time.sleep(0.5)
+                    with engine.connect() as conn:
+                        if get_schema_version(conn) < version:
+                            raise
+        finally:
+            if IS_POSTGRES:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": MIGRATION_LOCK_KEY})
+                lock_conn.commit()
+    with engine.connect() as conn:
+        return get_schema_version(conn)
+
+
+def check_schema():
+    """Startup check: one version read; upgrades only when AUTO_MIGRATE is on."""
+    with engine.connect() as conn:
+        version = get_schema_version(conn)
+    if version >= LATEST_VERSION:
+        return
+    if not AUTO_MIGRATE:
+        raise RuntimeError(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}; run `python migrations.py upgrade`"
+        )
+    migrate()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "upgrade":
+        print(f"schema version {migrate()}")
+    elif command == "status":
+        with engine.connect() as conn:
+            version = get_schema_version(conn)
+        pending = [f"{v}: {n}" for v, n, _ in MIGRATIONS if v > version]
+        print(f"schema version {version} (latest {LATEST_VERSION})")
+        for p in pending:
+            print(f"  pending {p}")
+    else:
+        print("usage: python migrations.py [status|upgrade]")
+        sys.exit(2)
@@ -0,0 +1,98 @@
+"""Keyset (cursor) pagination for listings.
+
+A page is read as WHERE (sort_key, id) > (last_key, last_id) ORDER BY sort_key, id
+LIMIT n, so every page costs one index range scan however deep the client scrolls,
+and rows added meanwhile never shift later pages. Listings made of several sections
+(folders, then files) page through them in order. Cursors are opaque to clients.
+"""
+import base64
+import json
+from collections import namedtuple
+
+from sqlalchemy import text
+
+# ?sort= values and the columns behind them; each has a composite index (migration 7)
+SORT_PATTERN = "^(name|updated_at|size)$"
+FILE_SORTS = {"name": "file_name", "updated_at": "updated_at", "size": "file_size"}
+FOLDER_SORTS = {"name": "folder_name", "updated_at": "updated_at", "size": "folder_name"}  # folders have no size of their own
+
+# sql must end inside its WHERE clause; sort_key / id_key are the matching columns of each row
+Section = namedtuple("Section", ["name", "sql", "params", "sort_column", "id_column", "descending", "sort_key", "id_key"])
+
+
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """The values given to encode_cursor, or ValueError."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("invalid cursor")
+    return values
+
+
+def _page_query(section: Section, after, limit):
+    sql = section.sql
+    params = dict(section.params)
+    op, direction = ("<", "DESC") if section.descending else (">", "ASC")
+    if after is not None:
+        if section.sort_column == section.id_column:
+            sql += f" AND {section.id_column} {op} :after_id"
+        else:
+            sql += f" AND ({section.sort_column}, {section.id_column}) {op} (:after_key, :after_id)"
+            params["after_key"] = after[0]
+        params["after_id"] = after[1]
+    if section.sort_column == section.id_column:
+        sql += f" ORDER BY {section.id_column} {direction}"
+    else:
+        sql += f" ORDER BY {section.sort_column} {direction}, {section.id_column} {direction}"
+    if limit is not None:
+        sql += " LIMIT :limit"
+        params["limit"] = limit + 1
+    return text(sql), params
+
+
+def paginate_sections(db, sections, limit: int = None, cursor: str = None):
+    """Rows of each section (dicts) for one page, and the cursor of the next page (None at
+    the end). limit=None returns everything, in order. Raises ValueError on a bad cursor.
+    """
+    results = {s.name: [] for s in sections}
+    start, after = 0, None
+    if cursor:
+        values = decode_cursor(cursor)
+        names = [s.name for s in sections]
+        if len(values) != 3 or values[0] not in names:
+            raise ValueError("invalid cursor")
+        start = names.index(values[0])
+        after = None if values[2] is None else (values[1], values[2])
+
+    remaining = limit
+    for i in range(start, len(sections)):
+        section = sections[i]
+        section_after = after if i == start else None
+        query, params = _page_query(section, section_after, remaining)
+        rows = [dict(r._mapping) for r in db.execute(query, params).fetchall()]
+        if remaining is not None and len(rows) > remaining:
+            rows = rows[:remaining]
+            results[section.name] = rows
+            if rows:
+                return results, encode_cursor(section.name, rows[-1][section.sort_key], rows[-1][section.id_key])
+            # page filled up exactly at the end of the previous section
+            key, last_id = section_after if section_after else (None, None)
+            return results, encode_cursor(section.name, key, last_id)
+        results[section.name] = rows
+        if remaining is not None:
+            remaining -= len(rows)
+    return results, None
+
+
+def count_sections(db, sections) -> dict:
+    """Total rows per section, for clients that size a virtual scroller."""
+    return {
+        s.name: db.execute(text(f"SELECT COUNT(*) FROM ({s.sql}) counted"), s.params).scalar()
+        for s in sections
+    }
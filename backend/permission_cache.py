@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+PERMISSION_CACHE_SIZE = int(os.getenv("PERMISSION_CACHE_SIZE", "10000"))  # 0 disables the cache
+PERMISSION_CACHE_TTL_SECONDS = float(os.getenv("PERMISSION_CACHE_TTL_SECONDS", "60"))
+
+
+class PermissionCache:
+    """In-process LRU/TTL cache of effective permissions.
+    Keys are (user_id, resource_type, resource_id, operation). Every entry records the
+    resources it was derived from (the item plus each folder above it), so a change
+    to any of them drops exactly the entries that depended on it. The TTL bounds
+    staleness for changes made by other worker processes.
+    """
+
+    def __init__(self, max_entries: int = PERMISSION_CACHE_SIZE, ttl_seconds: float = PERMISSION_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (allowed, deps, expires_at)
+        self._by_dep = {}  # ("file"|"folder", id) -> set of keys
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def generation(self) -> int:
+        """Snapshot to pass back to put(); results computed across an invalidation are dropped."""
+        return self._generation
+
+    def get(self, key):
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            allowed, deps, expires_at = entry
+            if expires_at < time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return allowed
+
+    def put(self, key, allowed: bool, deps, generation: int):
+        if self.max_entries <= 0 or not deps:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            deps = frozenset(deps)
+            self._entries[key] = (allowed, deps, time.monotonic() + self.ttl_seconds)
+            for dep in deps:
+                self._by_dep.setdefault(dep, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, folder_ids=None, file_ids=None):
+        """Drop every entry derived from the given folders or files."""
+        deps = [("folder", int(i)) for i in (folder_ids or []) if i is not None]
+        deps += [("file", int(i)) for i in (file_ids or []) if i is not None]
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            for dep in deps:
+                for key in list(self._by_dep.get(dep, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_dep.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for dep in entry[1]:
+            keys = self._by_dep.get(dep)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_dep[dep]
+
+
+permission_cache = PermissionCache()
@@ -3,6 +3,7 @@ from sqlalchemy import text
 from sqlalchemy.orm import Session
 from utils import get_db, check_permission
 from verify_token import get_current_user
+from blob_store import open_local
 import os
 import google.generativeai as genai
 import base64
@@ -154,6 +155,23 @@ def _extract_xlsx_text(path: str) -> str:
         raise HTTPException(status_code=500, detail=f"XLSX parse failed: {str(e)}")
 
 
+def extract_text(path: str, file_name: str):
+    """Text of a document by extension (capped at MAX_BYTES), or None for types without text."""
+    _, ext = os.path.splitext(file_name or path or "")
+    ext = ext.lower()
+    if ext in TEXT_EXTS:
+        return _read_text_file(path)
+    if ext in PDF_EXTS:
+        return _extract_pdf_text(path)
+    if ext in DOCX_EXTS:
+        return _extract_docx_text(path)
+    if ext in PPTX_EXTS:
+        return _extract_pptx_text(path)
+    if ext in XLSX_EXTS:
+        return _extract_xlsx_text(path)
+    return None
+
+
 def _read_bytes(path: str) -> bytes:
     try:
         with open(path, "rb") as f:
@@ -168,34 +186,36 @@ def summarize(file_id: int = Form(...), db: Session = Depends(get_db), current_u
     perm = check_permission(db, user_id, file_id=file_id, operation="view")
     if not perm:
         raise HTTPException(status_code=403, detail="No permission")
-    row = db.execute(text("SELECT file_path, file_name FROM files WHERE file_id = :fid"), {"fid": file_id}).fetchone()
+    row = db.execute(text("SELECT file_path, file_name, blob_digest FROM files WHERE file_id = :fid"), {"fid": file_id}).fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="File not found")
     file_path = row.file_path
-    _, ext = os.path.splitext(file_path or "")
+    _, ext = os.path.splitext(row.file_name or file_path or "")
     ext = ext.lower()
 
     # Try to extract or attach content depending on type
     content = None
     image_part = None
-    if ext in TEXT_EXTS:
-        content = _read_text_file(file_path)
-    elif ext in PDF_EXTS:
-        content = _extract_pdf_text(file_path)
-    elif ext in DOCX_EXTS:
-        content = _extract_docx_text(file_path)
-    elif ext in PPTX_EXTS:
-        content = _extract_pptx_text(file_path)
-    elif ext in XLSX_EXTS:
-        content = _extract_xlsx_text(file_path)
-    elif ext in IMAGE_EXTS:
-        raw = _read_bytes(file_path)
-        mime = f"image/{'jpeg' if ext in {'.jpg', '.jpeg'} else ext.lstrip('.')}"
-        image_part = {"mime_type": mime, "data": base64.b64encode(raw).decode("ascii")}
-    else:
-        # Fallback: send bytes as attachment with a generic description
-        raw = _read_bytes(file_path)
-        image_part = {"mime_type": "application/octet-stream", "data": base64.b64encode(raw).decode("ascii")}
+    # blobs may live in remote storage; extractors get a local copy
+    with open_local(row.file_path, row.blob_digest) as file_path:
+        if ext in TEXT_EXTS:
+            content = _read_text_file(file_path)
+        elif ext in PDF_EXTS:
+            content = _extract_pdf_text(file_path)
+        elif ext in DOCX_EXTS:
+            content = _extract_docx_text(file_path)
+        elif ext in PPTX_EXTS:
+            content = _extract_pptx_text(file_path)
+        elif ext in XLSX_EXTS:
+            content = _extract_xlsx_text(file_path)
+        elif ext in IMAGE_EXTS:
+            raw = _read_bytes(file_path)
+            mime = f"image/{'jpeg' if ext in {'.jpg', '.jpeg'} else ext.lstrip('.')}"
+            image_part = {"mime_type": mime, "data": base64.b64encode(raw).decode("ascii")}
+        else:
+            # Fallback: send bytes as attachment with a generic description
+            raw = _read_bytes(file_path)
+            image_part = {"mime_type": "application/octet-stream", "data": base64.b64encode(raw).decode("ascii")}
 
     if not os.getenv("GEMINI_API_KEY"):
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY not set")
@@ -222,32 +242,34 @@ def ask(question: str = Form(...), file_id: int = Form(...), db: Session = Depen
     perm = check_permission(db, user_id, file_id=file_id, operation="view")
     if not perm:
         raise HTTPException(status_code=403, detail="No permission")
-    row = db.execute(text("SELECT file_path, file_name FROM files WHERE file_id = :fid"), {"fid": file_id}).fetchone()
+    row = db.execute(text("SELECT file_path, file_name, blob_digest FROM files WHERE file_id = :fid"), {"fid": file_id}).fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="File not found")
     file_path = row.file_path
-    _, ext = os.path.splitext(file_path or "")
+    _, ext = os.path.splitext(row.file_name or file_path or "")
     ext = ext.lower()
 
     content = None
     image_part = None
-    if ext in TEXT_EXTS:
-        content = _read_text_file(file_path)
-    elif ext in PDF_EXTS:
-        content = _extract_pdf_text(file_path)
-    elif ext in DOCX_EXTS:
-        content = _extract_docx_text(file_path)
-    elif ext in PPTX_EXTS:
-        content = _extract_pptx_text(file_path)
-    elif ext in XLSX_EXTS:
-        content = _extract_xlsx_text(file_path)
-    elif ext in IMAGE_EXTS:
-        raw = _read_bytes(file_path)
-        mime = f"image/{'jpeg' if ext in {'.jpg', '.jpeg'} else ext.lstrip('.')}"
-        image_part = {"mime_type": mime, "data": base64.b64encode(raw).decode("ascii")}
-    else:
-        raw = _read_bytes(file_path)
-        image_part = {"mime_type": "application/octet-stream", "data": base64.b64encode(raw).decode("ascii")}
+    # blobs may live in remote storage; extractors get a local copy
+    with open_local(row.file_path, row.blob_digest) as file_path:
+        if ext in TEXT_EXTS:
+            content = _read_text_file(file_path)
+        elif ext in PDF_EXTS:
+            content = _extract_pdf_text(file_path)
+        elif ext in DOCX_EXTS:
+            content = _extract_docx_text(file_path)
+        elif ext in PPTX_EXTS:
+            content = _extract_pptx_text(file_path)
+        elif ext in XLSX_EXTS:
+            content = _extract_xlsx_text(file_path)
+        elif ext in IMAGE_EXTS:
+            raw = _read_bytes(file_path)
+            mime = f"image/{'jpeg' if ext in {'.jpg', '.jpeg'} else ext.lstrip('.')}"
+            image_part = {"mime_type": mime, "data": base64.b64encode(raw).decode("ascii")}
+        else:
+            raw = _read_bytes(file_path)
+            image_part = {"mime_type": "application/octet-stream", "data": base64.b64encode(raw).decode("ascii")}
 
     if not os.getenv("GEMINI_API_KEY"):
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY not set")
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from utils import get_db
 from verify_token import get_current_user
+from permission_cache import permission_cache
+from activity_log import log_writer
+from pagination import Section, paginate_sections, count_sections
+from typing import Optional
 
 router = APIRouter()
 
@@ -18,8 +22,9 @@ def star_item(file_id: int | None = None, folder_id: int | None = None, db: Sess
     try:
         db.execute(text(
             """
-            INSERT OR IGNORE INTO starred(user_id, file_id, folder_id, created_at)
+            INSERT INTO starred(user_id, file_id, folder_id, created_at)
             VALUES (:uid, :fid, :folid, CURRENT_TIMESTAMP)
+            ON CONFLICT DO NOTHING
             """
         ), {"uid": user_id, "fid": file_id, "folid": folder_id})
         db.commit()
@@ -47,25 +52,42 @@ def unstar_item(file_id: int | None = None, folder_id: int | None = None, db: Se
     return {"status": "ok"}
 
 @router.get("/starred")
-def get_starred(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+def get_starred(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user),
+                limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = None,
+                include_total: bool = False):
+    """Starred folders, then files, most recently starred first; keyset-paginated with `limit`."""
     user_id = current_user["user_id"]
-    files = db.execute(text(
-        """
-        SELECT s.id, s.file_id, f.file_name, f.parent_id, f.updated_at
-        FROM starred s
-        JOIN files f ON f.file_id = s.file_id
-        WHERE s.user_id = :uid AND s.file_id IS NOT NULL
-        """
-    ), {"uid": user_id}).fetchall()
-    folders = db.execute(text(
-        """
+    sections = [
+        Section("folders", """
         SELECT s.id, s.folder_id, d.folder_name, d.parent_id, d.updated_at
         FROM starred s
         JOIN folders d ON d.folder_id = s.folder_id
         WHERE s.user_id = :uid AND s.folder_id IS NOT NULL
-        """
-    ), {"uid": user_id}).fetchall()
+        """, {"uid": user_id}, "s.id", "s.id", True, "id", "id"),
+        Section("files", """
+        SELECT s.id, s.file_id, f.file_name, f.parent_id, f.updated_at
+        FROM starred s
+        JOIN files f ON f.file_id = s.file_id
+        WHERE s.user_id = :uid AND s.file_id IS NOT NULL
+        """, {"uid": user_id}, "s.id", "s.id", True, "id", "id"),
+    ]
+    try:
+        page, next_cursor = paginate_sections(db, sections, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    response = {
+        "files": page["files"],
+        "folders": page["folders"],
+        "next_cursor": next_cursor,
+    }
+    if include_total:
+        response["total"] = count_sections(db, sections)
+    return response
+
+
+@router.get("/metrics")
+def get_metrics(current_user: dict = Depends(get_current_user)):
     return {
-        "files": [dict(r._mapping) for r in files],
-        "folders": [dict(r._mapping) for r in folders],
+        "permission_cache": permission_cache.stats(),
+        "activity_log": log_writer.stats(),
     }
@@ -1,10 +1,10 @@
 from fastapi import APIRouter, Depends, Body, HTTPException, status, Form
 from pydantics import UserOut, TokenOut, LoginIn, SignupIn 
 from database import engine, create_tables
-from utils import hash_password, verify_password, create_access_token, log_action
+from utils import hash_password, verify_password, create_access_token, log_action, password_fingerprint
 from sqlalchemy import text
-from db_helpers import create_user, get_user_by_username
-from verify_token import get_current_user 
+from db_helpers import create_user, get_user_by_username, get_user_by_id
+from verify_token import get_current_user, invalidate_cached_user
 from sqlalchemy import text
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import datetime
@@ -60,7 +60,14 @@ async def login(data: OAuth2PasswordRequestForm = Depends()):
         if not verify_password(data.password, user.password):
             raise HTTPException(status_code=401, detail="Incorrect username or password")
 
-        token = create_access_token({"user_id": user.user_id, "username": user.username})
+        # carry the fields routers need so authenticated requests can skip the user lookup
+        token = create_access_token({
+            "user_id": user.user_id,
+            "username": user.username,
+            "email": user.email,
+            "profile": user.profile,
+            "pwd_fp": password_fingerprint(user.password),
+        })
         # log login
         try:
             log_action(conn, user_id=user.user_id, action="login", resource_type="user", resource_id=user.user_id)
@@ -71,7 +78,18 @@ async def login(data: OAuth2PasswordRequestForm = Depends()):
 
 @router.get("/me", response_model=UserOut)
 async def read_me(current_user = Depends(get_current_user)):
-    return current_user
+    # storage changes on every upload, so read it fresh instead of from the token/cache
+    with engine.connect() as conn:
+        user = get_user_by_id(conn, current_user["user_id"])
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {
+        "user_id": user.user_id,
+        "username": user.username,
+        "email": user.email,
+        "profile": user.profile,
+        "storage": user.storage,
+    }
 
 
 # Change password
@@ -112,5 +130,6 @@ def change_password(
         except Exception:
             pass
         conn.commit()
+    invalidate_cached_user(user_id)
     return {"message": "Password changed successfully"}
 
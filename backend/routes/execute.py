@@ -5,9 +5,11 @@ from typing import Optional
 import os
 import base64
 import requests
+from contextlib import closing
 
 from utils import get_db, check_permission
 from verify_token import get_current_user
+from storage import get_storage
 
 router = APIRouter()
 
@@ -47,7 +49,7 @@ def run_code(
         raise HTTPException(status_code=403, detail="You don't have permission to execute this file")
 
     # Get file path and name
-    row = db.execute(text("SELECT file_path, file_name FROM files WHERE file_id = :fid"), {"fid": file_id}).fetchone()
+    row = db.execute(text("SELECT file_path, file_name, blob_digest FROM files WHERE file_id = :fid"), {"fid": file_id}).fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="File not found")
 
@@ -59,13 +61,20 @@ def run_code(
     if language_id is None:
         raise HTTPException(status_code=400, detail=f"Unsupported language for extension: {ext}")
 
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found on server")
-
     # Read source code
     try:
-        with open(file_path, "rb") as f:
-            source_bytes = f.read()
+        if row.blob_digest:
+            with closing(get_storage().open(row.blob_digest)) as f:
+                source_bytes = f.read()
+        else:
+            if not os.path.exists(file_path):
+                raise HTTPException(status_code=404, detail="File not found on server")
+            with open(file_path, "rb") as f:
+                source_bytes = f.read()
+    except HTTPException:
+        raise
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found on server")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to read file: {e}")
 
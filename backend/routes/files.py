@@ -1,13 +1,20 @@
-from fastapi import APIRouter, Depends,HTTPException,Form,File,UploadFile
+from fastapi import APIRouter, Depends,HTTPException,Form,File,UploadFile,Request
 from fastapi import Query
 from utils import get_db,check_permission, log_action_for_owner
 from verify_token import get_current_user
 from sqlalchemy import text,bindparam
 from datetime import datetime
 from sqlalchemy.orm import Session
-import os, shutil
-from fastapi.responses import FileResponse
+import os
 from urllib.parse import quote
+from folder_tree import adjust_stats_for_files
+from search_index import index_items
+from database import sql_month
+from http_range import ranged_file_response, ranged_storage_response, make_etag
+from storage import get_storage, STORAGE_REDIRECT
+from fastapi.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
+from blob_store import hash_stream, hash_upload, blob_exists, spool_to_staging, spool_upload, acquire_blob, discard_blob, discard_temp, release_blobs_for_files, collect_garbage
  
 
 
@@ -17,51 +24,38 @@ UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 STORAGE_LIMIT_BYTES = 10 * 1024 * 1024 * 1024
 
-@router.post('/upload_file')
-def upload_file(db: Session = Depends(get_db) , current_user: dict = Depends(get_current_user),file: UploadFile = File(...),parent_id: int = Form(None)):
-    user_id = current_user["user_id"]
+def _check_upload_target(db, user_id: int, parent_id, normalized_parent_id: int, file_name: str):
     #check for permission of the user
-
     perm = check_permission(db,user_id,folder_id=parent_id,operation='edit')
     if not perm and parent_id != 0:
         raise HTTPException(status_code=400, detail="You don't have permission to access this folder")
-    
-    # Normalize root folder: store NULL in DB instead of 0 to satisfy FK constraints
-    normalized_parent_id = 0 if parent_id in (0, None) else parent_id
-    
-    USER_DIR =os.path.join(UPLOAD_DIR, f'user_{user_id}')
 
     existing = db.execute(text(
         '''
             SELECT file_name FROM files 
             WHERE file_name = :file_name 
-              AND ( (:parent_id IS NULL AND parent_id IS NULL) OR parent_id = :parent_id )
+              AND parent_id = :parent_id
         '''
     ),
     {
-        'file_name': file.filename,
+        'file_name': file_name,
         'parent_id': normalized_parent_id
     }).fetchone()
     if existing:
         raise HTTPException(status_code=400, detail="File already exists")
 
-    os.makedirs(USER_DIR, exist_ok=True)
 
-    temp_path = os.path.join(USER_DIR, f'temp_{datetime.now().timestamp()}_{file.filename}')
-    try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        file_size = os.path.getsize(temp_path)
+def _check_quota(db, user_id: int, file_size: int):
+    current_storage_row = db.execute(text('SELECT storage FROM users WHERE user_id = :user_id'), {"user_id": user_id}).fetchone()
+    current_storage = int(current_storage_row[0]) if current_storage_row else 0
+    if current_storage + file_size > STORAGE_LIMIT_BYTES:
+        raise HTTPException(status_code=413, detail="Storage limit exceeded (10GB)")
 
-        current_storage_row = db.execute(text('SELECT storage FROM users WHERE user_id = :user_id'), {"user_id": user_id}).fetchone()
-        current_storage = int(current_storage_row[0]) if current_storage_row else 0
-        if current_storage + file_size > STORAGE_LIMIT_BYTES:
-            try:
-                os.remove(temp_path)
-            except Exception:
-                pass
-            raise HTTPException(status_code=413, detail="Storage limit exceeded (10GB)")
 
+def _record_upload(db, user_id: int, parent_id: int, file: UploadFile, digest: str, file_size: int, temp_path: str = None):
+    """Insert the files row and take the blob reference; temp_path (if any) is consumed."""
+    created = False
+    try:
         inserted = db.execute(text(
             '''
                 INSERT INTO FILES (file_name,parent_id,user_id,created_at,updated_at,status) 
@@ -70,24 +64,26 @@ def upload_file(db: Session = Depends(get_db) , current_user: dict = Depends(get
             '''
         ),{
             "file_name": file.filename,
-            "parent_id": normalized_parent_id,
+            "parent_id": parent_id,
             "user_id": user_id,
             "created_at": datetime.now(),
             "updated_at": datetime.now()
         }).fetchone()
 
         file_id = inserted[0]
-        final_path = os.path.join(USER_DIR,f'{file_id}_{file.filename}')
+        blob, created = acquire_blob(db, digest, file_size, temp_path=temp_path, fileobj=file.file)
+        temp_path = None
         db.execute(text(
             '''
-                UPDATE files SET file_size = :file_size,file_path = :file_path, updated_at = :updated_at 
+                UPDATE files SET file_size = :file_size,file_path = :file_path, blob_digest = :digest, updated_at = :updated_at 
                 WHERE file_id = :file_id
             '''
         ),{
             "file_id": file_id,
             "file_size": file_size,
             "updated_at": datetime.now(),
-            "file_path": final_path
+            "file_path": blob,
+            "digest": digest
         })
 
         db.execute(text(
@@ -98,40 +94,65 @@ def upload_file(db: Session = Depends(get_db) , current_user: dict = Depends(get
             "file_size": file_size,
             "user_id": user_id
         })
+        adjust_stats_for_files(db, [file_id], 1)
+        index_items(db, file_ids=[file_id], content_changed=True)
 
         db.commit()
-        os.replace(temp_path, final_path)
+    except Exception:
+        db.rollback()
+        if temp_path:
+            discard_temp(temp_path)
+        if created:
+            discard_blob(digest)
+        raise
 
-        new_file = db.execute(text(
-            '''
-                SELECT * FROM files WHERE file_id = :file_id
-            '''
-        ),{
-            "file_id": file_id
-        }).fetchone()
+    new_file = db.execute(text(
+        '''
+            SELECT * FROM files WHERE file_id = :file_id
+        '''
+    ),{
+        "file_id": file_id
+    }).fetchone()
 
-        try:
-            log_action_for_owner(db, actor_user_id=user_id, action="upload", resource_type="file", resource_id=file_id, details=file.filename)
-            db.commit()
-        except Exception:
-            pass
+    try:
+        log_action_for_owner(db, actor_user_id=user_id, action="upload", resource_type="file", resource_id=file_id, details=file.filename)
+        db.commit()
+    except Exception:
+        pass
+
+    return dict(new_file._mapping)
+
+
+@router.post('/upload_file')
+async def upload_file(db: Session = Depends(get_db) , current_user: dict = Depends(get_current_user),file: UploadFile = File(...),parent_id: int = Form(None)):
+    # async so no worker thread is held for the whole upload: the body is received on the
+    # event loop, file I/O hops to the threadpool a chunk at a time, queries are short hops too
+    user_id = current_user["user_id"]
 
-        return {"message": "File uploaded successfully","file": dict(new_file._mapping)}
+    # Normalize root folder: store NULL in DB instead of 0 to satisfy FK constraints
+    normalized_parent_id = 0 if parent_id in (0, None) else parent_id
+    await run_in_threadpool(_check_upload_target, db, user_id, parent_id, normalized_parent_id, file.filename)
+
+    # Hash the spooled upload first; content we already hold is never written again
+    digest, file_size = await hash_upload(file.file)
+    try:
+        await run_in_threadpool(_check_quota, db, user_id, file_size)
+
+        temp_path = None
+        if not await run_in_threadpool(blob_exists, db, digest):
+            # new content: copy it out before taking the write lock, place it with a rename
+            temp_path = await spool_upload(file.file)
+
+        new_file = await run_in_threadpool(_record_upload, db, user_id, normalized_parent_id, file, digest, file_size, temp_path)
+        return {"message": "File uploaded successfully","file": new_file}
     except HTTPException:
         raise
     except Exception as e:
-        try:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-        except Exception:
-            pass
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
-    finally:
-        pass
 
 @router.get('/download_file/{file_id}')
 def download_file(
+    request: Request,
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user),
     file_id: int = None
@@ -145,17 +166,13 @@ def download_file(
 
     # Fetch file
     file = db.execute(
-        text("SELECT file_path, file_name FROM files WHERE file_id = :file_id "),
+        text("SELECT file_path, file_name, blob_digest FROM files WHERE file_id = :file_id "),
         {"file_id": file_id}
     ).fetchone()
 
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
 
-    file_path = os.path.abspath(file.file_path)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found on server")
-
     # Use quote to handle special characters in filename
     safe_filename = quote(file.file_name)
 
@@ -163,20 +180,40 @@ def download_file(
         "Content-Disposition": f"attachment; filename*=UTF-8''{safe_filename}"
     }
 
-    # Log download action (attribute to file owner)
-    try:
-        log_action_for_owner(db, actor_user_id=user_id, action="download", resource_type="file", resource_id=file_id, details=file.file_name)
-        db.commit()
-    except Exception:
-        pass
+    # Range / conditional GET: seeks and resumed downloads only move the bytes they need
+    if file.blob_digest:
+        # blob-backed files are validated by their content digest
+        etag = f'"{file.blob_digest}"'
+        storage = get_storage()
+        redirect_url = storage.presigned_url(file.blob_digest, file.file_name) if STORAGE_REDIRECT else None
+        local_path = storage.local_path(file.blob_digest)
+        if redirect_url:
+            # object storage serves the bytes (and ranges) itself
+            response = RedirectResponse(redirect_url, status_code=307)
+        elif local_path is not None:
+            if not os.path.exists(local_path):
+                raise HTTPException(status_code=404, detail="File not found on server")
+            response = ranged_file_response(request, local_path, etag, headers=headers)
+        else:
+            try:
+                response = ranged_storage_response(request, storage, file.blob_digest, etag, headers=headers)
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail="File not found on server")
+    else:
+        file_path = os.path.abspath(file.file_path)
+        if not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail="File not found on server")
+        response = ranged_file_response(request, file_path, make_etag(file_id, os.stat(file_path)), headers=headers)
 
- 
+    # Log download action (attribute to file owner); 304/416 transfer no content
+    if response.status_code in (200, 206, 307):
+        try:
+            log_action_for_owner(db, actor_user_id=user_id, action="download", resource_type="file", resource_id=file_id, details=file.file_name)
+            db.commit()
+        except Exception:
+            pass
 
-    return FileResponse(
-        path=file_path,
-        media_type="application/octet-stream",
-        headers=headers
-    )
+    return response
 
 @router.get('/file_metadata')
 def file_metadata(db: Session = Depends(get_db) , current_user = Depends(get_current_user),file_id: int = None):
@@ -238,6 +275,7 @@ def rename_file(db: Session = Depends(get_db) , current_user = Depends(get_curre
         "file_name": file_name,
         "updated_at": datetime.now()
     })
+    index_items(db, file_ids=[file_id])
 
     db.commit()
 
@@ -268,7 +306,7 @@ def replace_file(
 
     # --- Fetch old file record ---
     old_file = db.execute(text('''
-        SELECT file_id, file_name, file_path, file_size, user_id
+        SELECT file_id, file_name, file_path, file_size, user_id, blob_digest
         FROM files WHERE file_id = :file_id
     '''), {"file_id": file_id}).fetchone()
 
@@ -276,49 +314,51 @@ def replace_file(
         raise HTTPException(status_code=404, detail="File not found")
 
     old_file = dict(old_file._mapping)
-    USER_DIR = os.path.join(UPLOAD_DIR, f'user_{old_file["user_id"]}')
-    os.makedirs(USER_DIR, exist_ok=True)
-
-    # Paths
-    temp_new_path = os.path.join(USER_DIR, f'temp_{file_id}_{file.filename}')
-    final_new_path = os.path.join(USER_DIR, f'{file_id}_{file.filename}')
-
-    # ---  Write new file to TEMP location ---
-    try:
-        with open(temp_new_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
 
-    new_file_size = os.path.getsize(temp_new_path)
+    # Hash the new content; only content we do not hold yet is written to disk
+    digest, new_file_size = hash_stream(file.file)
 
     current_storage_row = db.execute(text('SELECT storage FROM users WHERE user_id = :user_id'), {"user_id": user_id}).fetchone()
     current_storage = int(current_storage_row[0]) if current_storage_row else 0
     projected_total = current_storage - int(old_file["file_size"] or 0) + new_file_size
     if projected_total > STORAGE_LIMIT_BYTES:
-        try:
-            os.remove(temp_new_path)
-        except Exception:
-            pass
         raise HTTPException(status_code=413, detail="Storage limit exceeded (10GB)")
 
+    temp_path = None
+    created = False
+    blob = None
+    try:
+        if not blob_exists(db, digest):
+            file.file.seek(0)
+            temp_path = spool_to_staging(file.file)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
+
     # ---  Start transactional logic ---
     try:
-        # a. Update DB record
+        # a. Point the row at the new blob and drop its reference on the old one
+        released = release_blobs_for_files(db, [file_id])
+        blob, created = acquire_blob(db, digest, new_file_size, temp_path=temp_path, fileobj=file.file)
+        temp_path = None
+        adjust_stats_for_files(db, [file_id], -1)
         db.execute(text('''
             UPDATE files 
             SET file_name = :file_name,
                 file_path = :file_path,
+                blob_digest = :digest,
                 file_size = :file_size,
                 updated_at = :updated_at
             WHERE file_id = :file_id
         '''), {
             "file_id": file_id,
             "file_name": file.filename,
-            "file_path": final_new_path,
+            "file_path": blob,
+            "digest": digest,
             "file_size": new_file_size,
             "updated_at": datetime.now()
         })
+        adjust_stats_for_files(db, [file_id], 1)
+        index_items(db, file_ids=[file_id], content_changed=True)
 
         # b. Adjust user storage
         size_diff = new_file_size - old_file["file_size"]
@@ -332,11 +372,10 @@ def replace_file(
         # --- Commit DB transaction ---
         db.commit()
 
-        # Move temp → final (atomic rename)
-        os.replace(temp_new_path, final_new_path)
-
-        # Delete old file AFTER successful commit
-        if os.path.exists(old_file["file_path"]):
+        # Delete the old content AFTER successful commit
+        if released:
+            collect_garbage(db, released)
+        elif old_file["file_path"] and os.path.exists(old_file["file_path"]):
             try:
                 os.remove(old_file["file_path"])
             except Exception as e:
@@ -344,8 +383,10 @@ def replace_file(
 
     except Exception as e:
         db.rollback()
-        if os.path.exists(temp_new_path):
-            os.remove(temp_new_path)
+        if temp_path:
+            discard_temp(temp_path)
+        if created:
+            discard_blob(digest)
         raise HTTPException(status_code=500, detail=f"Replace failed: {str(e)}")
 
     updated_file = db.execute(text('SELECT * FROM files WHERE file_id = :file_id'),
@@ -405,8 +446,8 @@ def storage_summary(
 
     # By month (YYYY-MM)
     month_rows = db.execute(text(
-        """
-        SELECT strftime('%Y-%m', created_at) AS ym, COALESCE(SUM(file_size),0) AS bytes, COUNT(*) AS cnt
+        f"""
+        SELECT {sql_month('created_at')} AS ym, COALESCE(SUM(file_size),0) AS bytes, COUNT(*) AS cnt
         FROM files
         WHERE user_id = :uid AND status != 'deleted'
         GROUP BY ym
@@ -419,37 +460,23 @@ def storage_summary(
     ]
 
     # Top-level folder breakdown (children of root) + root files
+    # Sizes come from the caller's folder_stats rollups, one indexed read
     top_folders = db.execute(text(
         """
-        SELECT folder_id, folder_name
-        FROM folders
-        WHERE user_id = :uid AND parent_id = 0
+        SELECT f.folder_id, f.folder_name, COALESCE(s.total_bytes, 0)
+        FROM folders f
+        LEFT JOIN folder_stats s ON s.folder_id = f.folder_id AND s.user_id = :uid
+        WHERE f.user_id = :uid AND f.parent_id = 0
         """
     ), {"uid": user_id}).fetchall()
 
-    def sum_folder_bytes(root_folder_id: int) -> int:
-        # Sum sizes of all files under the subtree of root_folder_id
-        q = text(
-            """
-            WITH RECURSIVE descendants(id) AS (
-                SELECT :root
-                UNION ALL
-                SELECT f.folder_id FROM folders f JOIN descendants d ON f.parent_id = d.id
-            )
-            SELECT COALESCE(SUM(file_size),0) FROM files
-            WHERE user_id = :uid AND status != 'deleted' AND parent_id IN (SELECT id FROM descendants)
-            """
-        )
-        r = db.execute(q, {"root": root_folder_id, "uid": user_id}).fetchone()
-        return int(r[0] or 0)
-
     by_folder = []
     for f in top_folders:
-        fid, fname = f[0], f[1]
+        fid, fname, fbytes = f[0], f[1], f[2]
         by_folder.append({
             "folder_id": int(fid),
             "folder_name": fname,
-            "bytes": sum_folder_bytes(int(fid))
+            "bytes": int(fbytes or 0)
         })
 
     # Files directly in root (parent_id = 0)
@@ -496,37 +523,23 @@ def folder_breakdown(
     else:
         parent_name = "Root"
 
-    # Immediate subfolders
+    # Immediate subfolders with the caller's folder_stats rollups
     subfolders = db.execute(text(
         """
-        SELECT folder_id, folder_name
-        FROM folders
-        WHERE user_id = :uid AND parent_id = :pid
+        SELECT f.folder_id, f.folder_name, COALESCE(s.total_bytes, 0)
+        FROM folders f
+        LEFT JOIN folder_stats s ON s.folder_id = f.folder_id AND s.user_id = :uid
+        WHERE f.user_id = :uid AND f.parent_id = :pid
         """
     ), {"uid": user_id, "pid": folder_id}).fetchall()
 
-    def sum_folder_bytes(root_folder_id: int) -> int:
-        q = text(
-            """
-            WITH RECURSIVE descendants(id) AS (
-                SELECT :root
-                UNION ALL
-                SELECT f.folder_id FROM folders f JOIN descendants d ON f.parent_id = d.id
-            )
-            SELECT COALESCE(SUM(file_size),0) FROM files
-            WHERE user_id = :uid AND status != 'deleted' AND parent_id IN (SELECT id FROM descendants)
-            """
-        )
-        r = db.execute(q, {"root": root_folder_id, "uid": user_id}).fetchone()
-        return int(r[0] or 0)
-
     by_child = []
     for f in subfolders:
-        fid, fname = f[0], f[1]
+        fid, fname, fbytes = f[0], f[1], f[2]
         by_child.append({
             "folder_id": int(fid),
             "folder_name": fname,
-            "bytes": sum_folder_bytes(int(fid))
+            "bytes": int(fbytes or 0)
         })
 
     # Files directly inside this folder
@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends,HTTPException,Form
-from utils import get_db,check_permission, log_action_for_owner
+from fastapi import APIRouter, Depends,HTTPException,Form,Query
+from utils import get_db,check_permission, filter_permitted, log_action_for_owner
 from verify_token import get_current_user
 from sqlalchemy import text,bindparam
 from datetime import datetime
 from sqlalchemy.orm import Session
-import zipfile
 from fastapi.responses import StreamingResponse
-from io import BytesIO
+from zip_stream import stream_zip
+from blob_store import content_source
+from folder_tree import get_subtree, add_folder_to_closure, move_folder_subtrees, remove_folders_from_closure, get_descendant_ids, is_descendant
+from folder_tree import adjust_stats_for_files, detach_deleted_folders
+from permission_cache import permission_cache
+from search_index import index_items, remove_from_index
+from pagination import Section, paginate_sections, count_sections, SORT_PATTERN, FILE_SORTS, FOLDER_SORTS
+from typing import Optional
  
 
 router = APIRouter()
@@ -55,6 +61,9 @@ def create_folder(db: Session = Depends(get_db), current_user: dict = Depends(ge
     })
 
     new_folder = result.fetchone()
+    if new_folder:
+        add_folder_to_closure(db, new_folder.folder_id, parent_id)
+        index_items(db, folder_ids=[new_folder.folder_id])
     db.commit()
 
     if not new_folder:
@@ -125,6 +134,7 @@ def folder_rename(db: Session = Depends(get_db), current_user: dict = Depends(ge
         'folder_name': folder_name,
         'updated_at': datetime.now()
     }).fetchall()
+    index_items(db, folder_ids=[folder_id])
 
     db.commit()
 
@@ -149,53 +159,20 @@ def folder_move(
 ):
     user_id = current_user["user_id"]
 
-    # check if the folder belongs to the user
-    if folder_ids is not None:
-        result = db.execute(
-            text('''
-                SELECT * FROM folders WHERE folder_id IN :folder_ids AND user_id = :user_id
-            ''').bindparams(bindparam("folder_ids", expanding=True)),
-            {"folder_ids": folder_ids, "user_id": user_id}
-        ).fetchall()
+    # check edit permission on every selected item in one pass
+    permitted_folders, permitted_files = filter_permitted(db, user_id, folder_ids=folder_ids, file_ids=file_ids, operation='edit')
+    if folder_ids is not None and len(permitted_folders) != len(folder_ids):
+        raise HTTPException(status_code=400, detail="Folder not found")
+    if file_ids is not None and len(permitted_files) != len(file_ids):
+        raise HTTPException(status_code=400, detail="File not found")
 
-        if len(result) != len(folder_ids):
-            raise HTTPException(status_code=400, detail="Folder not found")
-    
-    # check if the file belongs to the user
-    if file_ids is not None:
-        result = db.execute(
-            text('''
-                SELECT * FROM files WHERE file_id IN :file_ids AND user_id = :user_id
-            ''').bindparams(bindparam("file_ids", expanding=True)),
-            {"file_ids": file_ids, "user_id": user_id}
-        ).fetchall()
-
-        if len(result) != len(file_ids):
-            raise HTTPException(status_code=400, detail="File not found")
+    if parent_id != 0 and not check_permission(db, user_id, folder_id=parent_id, operation='edit'):
+        raise HTTPException(status_code=400, detail="You don't have permission to move items into this folder")
 
 
     if folder_ids is not None:
     # check if the folder is moved to its children or itself
-        descendants = db.execute(
-            text('''
-                WITH RECURSIVE descendants AS (
-                SELECT folder_id
-                FROM folders
-                WHERE folder_id IN :folder_ids
-                UNION ALL
-                SELECT f.folder_id
-                FROM folders f
-                JOIN descendants d ON f.parent_id = d.folder_id
-                WHERE f.user_id = :user_id
-            )
-            SELECT folder_id FROM descendants
-            ''').bindparams(bindparam("folder_ids", expanding=True)),
-            {"folder_ids": folder_ids, "user_id": user_id}
-        ).fetchall()
-
-        descendant_ids = [d[0] for d in descendants]
-
-        if parent_id in descendant_ids:
+        if is_descendant(db, parent_id, folder_ids):
             raise HTTPException(status_code=400, detail="Cannot move folder to its descendant")
 
     # updating the positions of the folders if they exist
@@ -207,9 +184,11 @@ def folder_move(
             ''').bindparams(bindparam("folder_ids", expanding=True)),
             {"folder_ids": folder_ids, "parent_id": parent_id, "updated_at": datetime.now()}
         )
+        move_folder_subtrees(db, folder_ids, parent_id)
 
     # updating the positions of the files if they exist
     if file_ids is not None:
+        adjust_stats_for_files(db, file_ids, -1)
         db.execute(
             text('''
                 UPDATE files SET parent_id = :parent_id, updated_at = :updated_at
@@ -217,9 +196,11 @@ def folder_move(
             ''').bindparams(bindparam("file_ids", expanding=True)),
             {"file_ids": file_ids, "parent_id": parent_id, "updated_at": datetime.now()}
         )
+        adjust_stats_for_files(db, file_ids, 1)
 
 
     db.commit()
+    permission_cache.invalidate(folder_ids=folder_ids, file_ids=file_ids)
 
     new_files = db.execute(text(
         '''
@@ -258,23 +239,7 @@ def folder_move(
 def delete_folder(db, folder_ids, user_id,file_ids):
     # get all children including self
     if folder_ids:
-        descendant_folders = db.execute(
-            text('''
-                WITH RECURSIVE descendants AS (
-                    SELECT folder_id
-                    FROM folders
-                    WHERE folder_id IN :folder_ids
-                    UNION ALL
-                    SELECT f.folder_id
-                    FROM folders f
-                    INNER JOIN descendants d ON f.parent_id = d.folder_id
-                )
-                SELECT folder_id FROM descendants;
-            ''').bindparams(bindparam("folder_ids", expanding=True)),
-            {"folder_ids": folder_ids, "user_id": user_id}
-        ).fetchall()
-
-        descendant_ids = [f[0] for f in descendant_folders]
+        descendant_ids = get_descendant_ids(db, folder_ids)
         if not descendant_ids:
             raise HTTPException(status_code=400, detail="Folder not found")
 
@@ -286,6 +251,9 @@ def delete_folder(db, folder_ids, user_id,file_ids):
             "status": "deleted"
         }
 
+        # Take the subtrees out of the size rollups of the folders that remain
+        detach_deleted_folders(db, folder_ids)
+
         # Soft-delete all files inside these folders
         db.execute(
             text(f"""
@@ -295,6 +263,8 @@ def delete_folder(db, folder_ids, user_id,file_ids):
             """),
             params
         )  
+        remove_folders_from_closure(db, descendant_ids)
+        remove_from_index(db, folder_ids=descendant_ids)
         # Hard delete all children folders
         db.execute(
             text(f"DELETE FROM folders WHERE folder_id IN ({placeholders})"),
@@ -302,7 +272,9 @@ def delete_folder(db, folder_ids, user_id,file_ids):
         )
 
         db.commit()
+        permission_cache.invalidate(folder_ids=descendant_ids)
     if file_ids:
+        adjust_stats_for_files(db, file_ids, -1)
         db.execute(text(
             '''
             UPDATE files SET parent_id = NULL, updated_at = :updated_at, status = 'deleted'
@@ -312,6 +284,7 @@ def delete_folder(db, folder_ids, user_id,file_ids):
         {"file_ids": file_ids, "user_id": user_id , "updated_at": datetime.now()}
         )
         db.commit()
+        permission_cache.invalidate(file_ids=file_ids)
 
     return {"message": "Folder deleted successfully" , "folders":folder_ids , "files":file_ids}
 
@@ -323,11 +296,7 @@ def folder_delete(db: Session = Depends(get_db) , current_user = Depends(get_cur
     file_ids = file_ids or []
 
     #check permission before deleting
-    folders , files = [],[]
-    for i in folder_ids:
-        if check_permission(db,user_id,folder_id=i,operation='edit'): folders.append(i)
-    for i in file_ids:
-        if check_permission(db,user_id,file_id=i,operation='edit'): files.append(i)
+    folders , files = filter_permitted(db, user_id, folder_ids=folder_ids, file_ids=file_ids, operation='edit')
     
     message = delete_folder(db, folders, user_id,files)
     # Log bulk delete (attribute to resource owners)
@@ -345,7 +314,13 @@ def folder_delete(db: Session = Depends(get_db) , current_user = Depends(get_cur
     return message
 
 @router.get('/get_all_children/{folder_id}')
-def get_all_childern(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user), folder_id: int = None):
+def get_all_childern(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user), folder_id: int = None,
+                     sort: str = Query("name", pattern=SORT_PATTERN), order: str = Query("asc", pattern="^(asc|desc)$"),
+                     limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = None,
+                     include_total: bool = False):
+    """Folders first, then files, each sorted by `sort`. With `limit`, pages are keyset-paginated:
+    pass next_cursor back as `cursor`. include_total adds per-section counts for virtual scrolling.
+    """
     user_id = current_user["user_id"]
 
     #check for permission of the user
@@ -358,93 +333,38 @@ def get_all_childern(db: Session = Depends(get_db), current_user: dict = Depends
     if not perm:
         raise HTTPException(status_code=400, detail="You don't have permission to access this folder")
 
-    folders = []
-    files = []
-
-    if folder_id == 0:
-        folders = db.execute(text(
-            '''
+    params = {"folder_id": folder_id, "user_id": user_id}
+    # the root is shared by every user, so it is listed per owner
+    owner_filter = " AND user_id = :user_id" if folder_id == 0 else ""
+    descending = order == "desc"
+    sections = [
+        Section("folders", f'''
                 SELECT folder_id,folder_name,parent_id,user_id,created_at,updated_at
                 FROM folders
-                WHERE parent_id = 0 
-                AND user_id = :user_id
-            '''
-        ),{
-            "user_id": user_id,
-            "parent_id": folder_id
-        }).fetchall()
-        
-        files = db.execute(text(
-            '''
-                SELECT file_id,file_name,parent_id,user_id,created_at,updated_at
+                WHERE parent_id = :folder_id{owner_filter}
+            ''', params, FOLDER_SORTS[sort], "folder_id", descending, FOLDER_SORTS[sort], "folder_id"),
+        Section("files", f'''
+                SELECT file_id,file_name,parent_id,user_id,file_size,created_at,updated_at
                 FROM files
-                WHERE parent_id = 0 AND status != 'deleted'
-                AND user_id = :user_id
-            '''
-        ),{
-            "parent_id": folder_id,
-            "user_id": user_id
-        }).fetchall()
-
-        folders_list = [dict(f._mapping) for f in folders]
-        files_list = [dict(f._mapping) for f in files]
-
-        return {"folders": folders_list, "files": files_list}
-
-    folders = db.execute(text(
-        '''
-            SELECT folder_id,folder_name,parent_id,user_id,created_at,updated_at
-            FROM folders
-            WHERE  parent_id = :folder_id 
-        '''
-    ),{
-        "folder_id": folder_id,
-    }).fetchall()
-    
-    files = db.execute(text(
-        '''
-            SELECT file_id,file_name,parent_id,user_id,created_at,updated_at
-            FROM files
-            WHERE parent_id = :folder_id AND status != 'deleted' 
-        '''
-    ),{
-        "folder_id": folder_id,
-        "user_id": user_id
-    }).fetchall()
-
-    folders_list = [dict(f._mapping) for f in folders]
-    files_list = [dict(f._mapping) for f in files]
-
-    return {"folders": folders_list, "files": files_list}
-
-def add_folder_to_zip(zip_file: zipfile.ZipFile, folder_id: int, db: Session, parent_path=""):
-    # Get all the files in the folder
-    files = db.execute(text(
-        "SELECT file_name, file_path FROM files WHERE parent_id = :folder_id AND status='not_deleted'"
-        ),{"folder_id": folder_id}
-    ).fetchall()
-
-    for f in files:
-        file_name, file_path = f
-        zip_file.write(file_path, arcname=f"{parent_path}{file_name}")
-
-    # Get all the subfolders
-    subfolders = db.execute(text(
-        "SELECT folder_id, folder_name FROM folders WHERE parent_id = :folder_id"
-        ),{"folder_id": folder_id}
-    ).fetchall()
-
-    for sub in subfolders:
-        sub_id, sub_name = sub
-        # Add the subfolders to the zip
-        add_folder_to_zip(zip_file, sub_id, db, parent_path=f"{parent_path}{sub_name}/")
+                WHERE parent_id = :folder_id AND status = 'not_deleted'{owner_filter}
+            ''', params, FILE_SORTS[sort], "file_id", descending, FILE_SORTS[sort], "file_id"),
+    ]
+    try:
+        page, next_cursor = paginate_sections(db, sections, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
+    response = {"folders": page["folders"], "files": page["files"], "next_cursor": next_cursor}
+    if include_total:
+        response["total"] = count_sections(db, sections)
+    return response
 
 @router.get("/download_folder/{folder_id}")
 def download_folder(
     folder_id: int,
     db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    store: bool = Query(False, description="Store entries without compression (for already-compressed media)")
 ):
     user_id = current_user["user_id"]
 
@@ -464,12 +384,10 @@ def download_folder(
 
     folder_name = folder[0]
 
-    # Create zip in memory
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-        add_folder_to_zip(zip_file, folder_id, db, parent_path=f"{folder_name}/")
+    # Resolve the whole tree in one query; the db connection is released before the body is streamed
+    subtree = get_subtree(db, [folder_id])
+    entries = [(f["path"], content_source(f["file_path"], f["blob_digest"]), f["file_size"]) for f in subtree["files"]]
 
-    zip_buffer.seek(0)
     # Log folder download (attribute to folder owner)
     try:
         log_action_for_owner(db, actor_user_id=user_id, action="download_folder", resource_type="folder", resource_id=folder_id)
@@ -477,10 +395,8 @@ def download_folder(
     except Exception:
         pass
 
-    
-
     return StreamingResponse(
-        zip_buffer,
+        stream_zip(entries, store=store),
         media_type="application/zip",
         headers={"Content-Disposition": f"attachment; filename={folder_name}.zip"}
-    )
\ No newline at end of file
+    )
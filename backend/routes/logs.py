@@ -2,29 +2,214 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from sqlalchemy import text
 from sqlalchemy.orm import Session
+from database import engine, sql_date
+from log_retention import archive_tables
 from utils import get_db
 from verify_token import get_current_user
+from pagination import encode_cursor, decode_cursor
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 import io
 import csv
+import json
+import os
+import zlib
 
 router = APIRouter()
 
+
+def _day(value: str, name: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be YYYY-MM-DD")
+
+
+def _log_filters(params: dict, action=None, resource_type=None, start_date=None, end_date=None) -> str:
+    """WHERE fragment for the optional filters. Dates become a half-open range on the raw
+    created_at so the (user_id, ..., created_at) indexes stay usable."""
+    sql = ""
+    if action:
+        sql += " AND al.action = :action"
+        params["action"] = action
+    if resource_type:
+        sql += " AND al.resource_type = :resource_type"
+        params["resource_type"] = resource_type
+    if start_date:
+        sql += " AND al.created_at >= :start_ts"
+        params["start_ts"] = _day(start_date, "start_date")
+    if end_date:
+        sql += " AND al.created_at < :end_ts"
+        params["end_ts"] = _day(end_date, "end_date") + timedelta(days=1)
+    return sql
+
+
+def _after_cursor(params: dict, cursor: Optional[str]) -> str:
+    """Keyset condition for newest-first paging on (created_at, log_id)."""
+    if not cursor:
+        return ""
+    try:
+        values = decode_cursor(cursor)
+        if len(values) != 2:
+            raise ValueError("invalid cursor")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    params["after_created_at"], params["after_log_id"] = values
+    return " AND (al.created_at, al.log_id) < (:after_created_at, :after_log_id)"
+
+
+def _log_tables(db, params: dict) -> list:
+    """The hot table, then archive months overlapping the date filters, newest first."""
+    return ["activity_logs"] + archive_tables(db, params.get("start_ts"), params.get("end_ts"))
+
+
+def _read_newest(db, query: str, params: dict, tables: list, limit: int) -> list:
+    """Up to `limit` rows of query (a template over {table}), newest first. Archive months
+    are strictly older than the hot table, so tables are read in turn until enough rows
+    are in hand."""
+    rows, seen = [], set()
+    for table in tables:
+        params["limit"] = limit - len(rows)
+        for r in db.execute(text(query.format(table=table)), params).fetchall():
+            # a row archived between two reads shows up in both tables
+            if r.log_id not in seen:
+                seen.add(r.log_id)
+                rows.append(r)
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def _page(rows, limit: int):
+    logs = [dict(r._mapping) for r in rows[:limit]]
+    next_cursor = encode_cursor(logs[-1]["created_at"], logs[-1]["log_id"]) if len(rows) > limit else None
+    return {"logs": logs, "count": len(logs), "next_cursor": next_cursor}
+
+
+EXPORT_BATCH_ROWS = int(os.getenv("LOG_EXPORT_BATCH_ROWS", "1000"))
+EXPORT_HEADER = ['Log ID', 'Username', 'Action', 'Resource Type', 'Resource ID', 'Details', 'Created At']
+
+
+def _export_batches(query: str, params: dict, tables: list):
+    """Lists of rows from a server-side cursor over each table in turn. Runs on its own
+    connection: the request's get_db connection is closed before a streaming body is sent."""
+    with engine.connect() as conn:
+        streaming = conn.execution_options(stream_results=True, max_row_buffer=EXPORT_BATCH_ROWS)
+        for table in tables:
+            result = streaming.execute(text(query.format(table=table)), params)
+            for rows in result.partitions(EXPORT_BATCH_ROWS):
+                yield rows
+
+
+def _csv_chunks(batches):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(EXPORT_HEADER)
+    for rows in batches:
+        for row in rows:
+            writer.writerow([
+                row.log_id,
+                row.username,
+                row.action,
+                row.resource_type,
+                row.resource_id,
+                row.details or '',
+                row.created_at
+            ])
+        yield output.getvalue().encode()
+        output.seek(0)
+        output.truncate()
+    if output.tell():
+        yield output.getvalue().encode()
+
+
+def _ndjson_chunks(batches):
+    for rows in batches:
+        yield "".join(json.dumps(dict(r._mapping), default=str) + "\n" for r in rows).encode()
+
+
+class _ChunkSink:
+    """Write-only file object that hands back what was written since the last take()."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_chunks(batches):
+    """One row group per batch, each sent as soon as it is written; the footer comes last."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("log_id", pa.int64()), ("username", pa.string()), ("action", pa.string()),
+        ("resource_type", pa.string()), ("resource_id", pa.int64()), ("details", pa.string()),
+        ("created_at", pa.string()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in batches:
+            columns = {name: [r._mapping[name] for r in rows] for name in schema.names}
+            columns["created_at"] = [None if v is None else str(v) for v in columns["created_at"]]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
 @router.get("/me")
 def get_my_logs(
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user),
     limit: int = Query(50, ge=1, le=200),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
     action: Optional[str] = Query(None),
     resource_type: Optional[str] = Query(None),
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None)
 ):
     """
-    Get activity logs for the current user with optional filters.
+    Get activity logs for the current user with optional filters, newest first.
     Filters: action, resource_type, start_date (YYYY-MM-DD), end_date (YYYY-MM-DD)
+    Page with `cursor` (next_cursor of the previous page); `offset` is kept for old clients.
+    Rows moved to the monthly archive tables are included transparently.
     """
     user_id = current_user["user_id"]
     
@@ -37,39 +222,20 @@ def get_my_logs(
                al.resource_id,
                al.details,
                al.created_at
-        FROM activity_logs al
+        FROM {table} al
         JOIN users u ON u.user_id = al.user_id
         WHERE al.user_id = :user_id
     """
     
-    params = {
-        "user_id": user_id,
-        "limit": limit,
-        "offset": offset
-    }
-    
-    if action:
-        query += " AND al.action = :action"
-        params["action"] = action
-    
-    if resource_type:
-        query += " AND al.resource_type = :resource_type"
-        params["resource_type"] = resource_type
-    
-    if start_date:
-        query += " AND date(al.created_at) >= date(:start_date)"
-        params["start_date"] = start_date
-    
-    if end_date:
-        query += " AND date(al.created_at) <= date(:end_date)"
-        params["end_date"] = end_date
-    
-    query += " ORDER BY datetime(al.created_at) DESC LIMIT :limit OFFSET :offset"
+    params = {"user_id": user_id}
     
-    rows = db.execute(text(query), params).fetchall()
-    logs = [dict(r._mapping) for r in rows]
+    query += _log_filters(params, action, resource_type, start_date, end_date)
+    query += _after_cursor(params, cursor)
+    query += " ORDER BY al.created_at DESC, al.log_id DESC LIMIT :limit"
+    skip = 0 if cursor else offset
     
-    return {"logs": logs, "count": len(logs)}
+    rows = _read_newest(db, query, params, _log_tables(db, params), skip + limit + 1)
+    return _page(rows[skip:], limit)
 
 @router.get("/me/export")
 def export_logs_csv(
@@ -78,9 +244,13 @@ def export_logs_csv(
     action: Optional[str] = Query(None),
     resource_type: Optional[str] = Query(None),
     start_date: Optional[str] = Query(None),
-    end_date: Optional[str] = Query(None)
+    end_date: Optional[str] = Query(None),
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet)$"),
+    gzip: bool = Query(False)
 ):
-    """Export activity logs as CSV with optional filters"""
+    """Export activity logs with optional filters as CSV, NDJSON or Parquet, optionally gzipped
+    (csv/ndjson; Parquet is compressed internally). Rows are streamed in batches, so memory
+    stays flat however long the log is."""
     user_id = current_user["user_id"]
     
     query = """
@@ -91,59 +261,40 @@ def export_logs_csv(
                al.resource_id,
                al.details,
                al.created_at
-        FROM activity_logs al
+        FROM {table} al
         JOIN users u ON u.user_id = al.user_id
         WHERE al.user_id = :user_id
     """
     
     params = {"user_id": user_id}
+    query += _log_filters(params, action, resource_type, start_date, end_date)
     
-    if action:
-        query += " AND al.action = :action"
-        params["action"] = action
+    query += " ORDER BY al.created_at DESC, al.log_id DESC"
+    tables = _log_tables(db, params)
     
-    if resource_type:
-        query += " AND al.resource_type = :resource_type"
-        params["resource_type"] = resource_type
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="format=parquet requires pyarrow (pip install pyarrow)")
+        chunks = _parquet_chunks(_export_batches(query, params, tables))
+        media_type, extension = "application/vnd.apache.parquet", "parquet"
+    elif format == "ndjson":
+        chunks = _ndjson_chunks(_export_batches(query, params, tables))
+        media_type, extension = "application/x-ndjson", "ndjson"
+    else:
+        chunks = _csv_chunks(_export_batches(query, params, tables))
+        media_type, extension = "text/csv", "csv"
     
-    if start_date:
-        query += " AND date(al.created_at) >= date(:start_date)"
-        params["start_date"] = start_date
+    if gzip and format != "parquet":
+        chunks = _gzip_chunks(chunks)
+        media_type, extension = "application/gzip", extension + ".gz"
     
-    if end_date:
-        query += " AND date(al.created_at) <= date(:end_date)"
-        params["end_date"] = end_date
-    
-    query += " ORDER BY datetime(al.created_at) DESC"
-    
-    rows = db.execute(text(query), params).fetchall()
-    
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['Log ID', 'Username', 'Action', 'Resource Type', 'Resource ID', 'Details', 'Created At'])
-    
-    # Write data
-    for row in rows:
-        writer.writerow([
-            row.log_id,
-            row.username,
-            row.action,
-            row.resource_type,
-            row.resource_id,
-            row.details or '',
-            row.created_at
-        ])
-    
-    output.seek(0)
-    
-    filename = f"activity_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    filename = f"activity_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
     
     return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
+        chunks,
+        media_type=media_type,
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
@@ -151,7 +302,8 @@ def export_logs_csv(
 def get_security_highlights(
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user),
-    limit: int = Query(20, ge=1, le=100)
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None)
 ):
     """Get security-relevant activity logs (destructive actions and share changes)"""
     user_id = current_user["user_id"]
@@ -161,11 +313,22 @@ def get_security_highlights(
         'create_share', 'update_share', 'delete_share'
     ]
     
-    # Create placeholders for IN clause
-    placeholders = ','.join([f':action{i}' for i in range(len(security_actions))])
-    params = {f'action{i}': action for i, action in enumerate(security_actions)}
-    params['user_id'] = user_id
-    params['limit'] = limit
+    params = {'user_id': user_id}
+    after = _after_cursor(params, cursor)
+    
+    # Newest `limit` rows per action straight off the (user_id, action, created_at) index,
+    # merged; an IN list over the index would sort every matching row instead.
+    per_action = []
+    for i, action in enumerate(security_actions):
+        params[f'action{i}'] = action
+        per_action.append(f"""
+            SELECT * FROM (
+                SELECT al.log_id, al.created_at FROM {{table}} al
+                WHERE al.user_id = :user_id AND al.action = :action{i}{after}
+                ORDER BY al.created_at DESC, al.log_id DESC
+                LIMIT :limit
+            ) a{i}
+        """)
     
     query = f"""
         SELECT al.log_id,
@@ -176,15 +339,65 @@ def get_security_highlights(
                al.resource_id,
                al.details,
                al.created_at
-        FROM activity_logs al
+        FROM ({' UNION ALL '.join(per_action)}) recent
+        JOIN {{table}} al ON al.log_id = recent.log_id
         JOIN users u ON u.user_id = al.user_id
-        WHERE al.user_id = :user_id
-          AND al.action IN ({placeholders})
-        ORDER BY datetime(al.created_at) DESC
+        ORDER BY al.created_at DESC, al.log_id DESC
         LIMIT :limit
     """
     
-    rows = db.execute(text(query), params).fetchall()
-    logs = [dict(r._mapping) for r in rows]
+    rows = _read_newest(db, query, params, _log_tables(db, params), limit + 1)
+    return _page(rows, limit)
+
+@router.get("/me/daily")
+def get_daily_activity(
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+    action: Optional[str] = Query(None),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None)
+):
+    """Per-day action counts, newest day first. Finished days come from the daily rollups;
+    days not rolled up yet are counted from the hot table."""
+    user_id = current_user["user_id"]
+    
+    rolled_through = db.execute(text("SELECT MAX(log_date) FROM activity_log_daily")).scalar()
     
-    return {"logs": logs, "count": len(logs)}
+    live_params = {"user_id": user_id}
+    live_query = f"""
+        SELECT {sql_date('al.created_at')} AS log_date, al.action, COUNT(*) AS event_count
+        FROM activity_logs al
+        WHERE al.user_id = :user_id
+    """ + _log_filters(live_params, action, None, start_date, end_date)
+    days = []
+    
+    if rolled_through is not None:
+        live_since = datetime.strptime(str(rolled_through)[:10], "%Y-%m-%d") + timedelta(days=1)
+        live_query += " AND al.created_at >= :live_since"
+        live_params["live_since"] = live_since
+        
+        rolled_query = """
+            SELECT log_date, action, event_count FROM activity_log_daily
+            WHERE user_id = :user_id AND log_date < :live_since
+        """
+        rolled_params = {"user_id": user_id, "live_since": live_since.date()}
+        if action:
+            rolled_query += " AND action = :action"
+            rolled_params["action"] = action
+        if "start_ts" in live_params:
+            rolled_query += " AND log_date >= :start_day"
+            rolled_params["start_day"] = live_params["start_ts"].date()
+        if "end_ts" in live_params:
+            rolled_query += " AND log_date < :end_day"
+            rolled_params["end_day"] = live_params["end_ts"].date()
+        days += db.execute(text(rolled_query), rolled_params).fetchall()
+    
+    live_query += f" GROUP BY {sql_date('al.created_at')}, al.action"
+    days += db.execute(text(live_query), live_params).fetchall()
+    
+    result = [
+        {"date": str(d.log_date)[:10], "action": d.action, "count": d.event_count}
+        for d in days
+    ]
+    result.sort(key=lambda d: (d["date"], d["action"]), reverse=True)
+    return {"days": result}
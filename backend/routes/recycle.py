@@ -1,56 +1,75 @@
-from fastapi import APIRouter, Depends,HTTPException,Form,File,UploadFile
-from utils import get_db, log_action_for_owner
+from fastapi import APIRouter, Depends,HTTPException,Form,File,UploadFile,Query
+from utils import get_db, filter_permitted, log_action_for_owner
 from verify_token import get_current_user
 from sqlalchemy import text,bindparam
 from datetime import datetime
 from sqlalchemy.orm import Session
 import os, shutil
+from folder_tree import adjust_stats_for_files
+from blob_store import release_blobs_for_files, collect_garbage
+from search_index import remove_from_index
+from permission_cache import permission_cache
+from pagination import Section, paginate_sections, count_sections, SORT_PATTERN, FILE_SORTS
+from typing import Optional
  
 
 router = APIRouter()
 
 #check what files are in recycle bin
 @router.get('/recyclebin')
-def recyclebin(db: Session = Depends(get_db) , current_user = Depends(get_current_user)):
+def recyclebin(db: Session = Depends(get_db) , current_user = Depends(get_current_user),
+               sort: str = Query("updated_at", pattern=SORT_PATTERN), order: str = Query("desc", pattern="^(asc|desc)$"),
+               limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = None,
+               include_total: bool = False):
     user_id = current_user["user_id"]
 
-    files = db.execute(text(
-        '''
-            SELECT file_id,file_name,file_path FROM files WHERE user_id = :user_id AND status = 'deleted'     
-        '''
-    ),{
-        'user_id':user_id
-    }).fetchall()
+    # updated_at is the deletion time; newest first by default
+    sections = [
+        Section("files", '''
+            SELECT file_id,file_name,file_path,file_size,updated_at FROM files WHERE user_id = :user_id AND status = 'deleted'
+        ''', {'user_id': user_id}, FILE_SORTS[sort], "file_id", order == "desc", FILE_SORTS[sort], "file_id"),
+    ]
+    try:
+        page, next_cursor = paginate_sections(db, sections, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-    files_list = [dict(row._mapping) for row in files]
-    
-    return {'files':files_list}
+    response = {'files': page["files"], "next_cursor": next_cursor}
+    if include_total:
+        response["total"] = count_sections(db, sections)
+    return response
 
 #restore files
 @router.post('/restore')
 def restore(db: Session = Depends(get_db) , current_user = Depends(get_current_user),file_ids: list[int] = Form(None)):
     user_id = current_user["user_id"]
 
-    query = text(
-        '''
-        UPDATE files
-        SET status = 'not_deleted', parent_id = 0
-        WHERE file_id IN :file_ids AND user_id = :user_id
-        '''
-    ).bindparams(bindparam("file_ids", expanding=True), bindparam("user_id"))
+    _, permitted_ids = filter_permitted(db, user_id, file_ids=file_ids, operation='edit')
 
-    db.execute(
-        query
-    ,{
-        'file_ids':file_ids,
-        'user_id':user_id
-    })    
+    if permitted_ids:
+        adjust_stats_for_files(db, permitted_ids, -1)
 
-    db.commit()
+        query = text(
+            '''
+            UPDATE files
+            SET status = 'not_deleted', parent_id = 0
+            WHERE file_id IN :file_ids
+            '''
+        ).bindparams(bindparam("file_ids", expanding=True))
+
+        db.execute(
+            query
+        ,{
+            'file_ids':permitted_ids
+        })    
+        adjust_stats_for_files(db, permitted_ids, 1)
+
+        db.commit()
+        permission_cache.invalidate(file_ids=permitted_ids)
     # Log restore action (attribute to file owners)
     try:
-        if file_ids:
-            for fid in file_ids:
+        if permitted_ids:
+            for fid in permitted_ids:
                 log_action_for_owner(db, actor_user_id=user_id, action="restore_file", resource_type="file", resource_id=fid)
             db.commit()
     except Exception:
@@ -69,56 +88,64 @@ def permanent_delete(db: Session = Depends(get_db) , current_user = Depends(get_
     if(file_ids is None):
         raise HTTPException(status_code=400, detail="No files selected")
 
-    # Compute total size to decrement from user storage
+    _, permitted_ids = filter_permitted(db, user_id, file_ids=file_ids, operation='edit')
+    if not permitted_ids:
+        return {'message':'Files permanently deleted successfully'}
+
+    # Compute the size to decrement from each owner's storage
     size_query = text(
         '''
-        SELECT COALESCE(SUM(file_size), 0) FROM files
-        WHERE file_id IN :file_ids AND user_id = :user_id
+        SELECT user_id, COALESCE(SUM(file_size), 0) AS total FROM files
+        WHERE file_id IN :file_ids
+        GROUP BY user_id
         '''
-    ).bindparams(bindparam("file_ids", expanding=True), bindparam("user_id"))
+    ).bindparams(bindparam("file_ids", expanding=True))
 
-    size_row = db.execute(
+    owner_sizes = db.execute(
         size_query,
         {
-            'file_ids': file_ids,
-            'user_id': user_id
+            'file_ids': permitted_ids
         }
-    ).fetchone()
-    total_size = int(size_row[0]) if size_row else 0
+    ).fetchall()
 
+    # blob-backed files are released below; only files stored before the blob store are unlinked here
     query = text(
         '''
-        SELECT file_path FROM files
-        WHERE file_id IN :file_ids AND user_id = :user_id
+        SELECT file_id, file_path FROM files
+        WHERE file_id IN :file_ids AND blob_digest IS NULL
         '''
-    ).bindparams(bindparam("file_ids", expanding=True), bindparam("user_id"))
+    ).bindparams(bindparam("file_ids", expanding=True))
 
     results = db.execute(
         query
     ,{
-        'file_ids':file_ids,
-        'user_id':user_id
+        'file_ids':permitted_ids
     }).fetchall()
 
-    for file_path, in results:
-        os.remove(file_path)
+    for _, file_path in results:
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
 
     try:
+        adjust_stats_for_files(db, permitted_ids, -1)
+        released = release_blobs_for_files(db, permitted_ids)
+        remove_from_index(db, file_ids=permitted_ids)
         query = text(
             '''
             DELETE FROM files
-            WHERE file_id IN :file_ids AND user_id = :user_id
+            WHERE file_id IN :file_ids
             '''
-        ).bindparams(bindparam("file_ids", expanding=True), bindparam("user_id"))
+        ).bindparams(bindparam("file_ids", expanding=True))
 
         db.execute(
             query
         ,{
-            'file_ids':file_ids,
-            'user_id':user_id
+            'file_ids':permitted_ids
         })
 
-        if total_size > 0:
+        for owner_id, total_size in owner_sizes:
+            if int(total_size or 0) <= 0:
+                continue
             db.execute(text(
                 '''
                 UPDATE users
@@ -126,8 +153,8 @@ def permanent_delete(db: Session = Depends(get_db) , current_user = Depends(get_
                 WHERE user_id = :user_id
                 '''
             ), {
-                'dec': total_size,
-                'user_id': user_id
+                'dec': int(total_size),
+                'user_id': owner_id
             })
 
     except Exception as e:
@@ -135,10 +162,12 @@ def permanent_delete(db: Session = Depends(get_db) , current_user = Depends(get_
         raise HTTPException(status_code=400, detail="Error deleting files")
     
     db.commit()
+    permission_cache.invalidate(file_ids=permitted_ids)
+    collect_garbage(db, released)
     # Log permanent delete (attribute to file owners)
     try:
-        if file_ids:
-            for fid in file_ids:
+        if permitted_ids:
+            for fid in permitted_ids:
                 log_action_for_owner(db, actor_user_id=user_id, action="permanent_delete", resource_type="file", resource_id=fid)
             db.commit()
     except Exception:
@@ -1,83 +1,102 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import text
 from typing import Optional
 
 from utils import get_db
 from verify_token import get_current_user
+from search_index import search, search_names, search_name_substrings, decode_cursor
 
 router = APIRouter()
 
+
+def _split_items(rows, extra):
+    """Index rows (dicts, best first) as the folder and file shapes the client knows, plus `extra` keys."""
+    folders, files = [], []
+    for r in rows:
+        if r["item_type"] == "folder":
+            item = {
+                "folder_id": r["item_id"],
+                "folder_name": r["folder_name"],
+                "parent_id": r["folder_parent_id"],
+                "user_id": r["folder_user_id"],
+                "created_at": r["folder_created_at"],
+                "updated_at": r["folder_updated_at"],
+            }
+            folders.append(item)
+        else:
+            item = {
+                "file_id": r["item_id"],
+                "file_name": r["file_name"],
+                "parent_id": r["file_parent_id"],
+                "user_id": r["file_user_id"],
+                "file_size": r["file_size"],
+                "created_at": r["file_created_at"],
+                "updated_at": r["file_updated_at"],
+            }
+            files.append(item)
+        item.update({key: r[key] for key in extra})
+    return folders, files
+
+
 @router.get("/items")
 def search_items(
     q: str,
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user),
     parent_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
 ):
     """
-    Dynamic search across folders and files for the current user.
-    - No pagination.
-    - Does not change existing logic; new read-only endpoint.
+    Full-text search across the current user's folders and files (see search_index.py).
+    - Matches names and extracted document text; every word must match as a prefix.
+    - Best matches first, each with a highlighted snippet.
+    - After the full-text matches come the other names containing q anywhere ("voice"
+      finds "invoice_2023.txt"), by name and with rank null.
+    - Paginated: pass next_cursor back as cursor for the following page.
     - Filters out deleted files.
     - If parent_id is provided, narrows results to that folder scope.
     """
     if not q or not q.strip():
         raise HTTPException(status_code=400, detail="Query 'q' is required")
 
-    user_id = current_user["user_id"]
-    like_q = f"%{q.strip()}%"
+    section, after = "text", None
+    if cursor:
+        try:
+            section, *after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
 
-    params = {"user_id": user_id, "q": like_q}
+    rows, next_cursor = [], None
+    if section == "text":
+        rows, next_cursor = search(db, current_user["user_id"], q.strip(), limit=limit, cursor=after, parent_id=parent_id)
+        rows = [dict(r._mapping) for r in rows]
+        after = None
+    if next_cursor is None:
+        more, next_cursor = search_name_substrings(db, current_user["user_id"], q, limit - len(rows),
+                                                   parent_id=parent_id, cursor=after)
+        rows += more
 
-    if parent_id is not None:
-        params["parent_id"] = parent_id
-        folders_sql = text(
-            """
-            SELECT folder_id, folder_name, parent_id, user_id, created_at, updated_at
-            FROM folders
-            WHERE user_id = :user_id
-              AND parent_id = :parent_id
-              AND LOWER(folder_name) LIKE LOWER(:q)
-            ORDER BY updated_at DESC
-            """
-        )
-        files_sql = text(
-            """
-            SELECT file_id, file_name, parent_id, user_id, file_size, created_at, updated_at
-            FROM files
-            WHERE user_id = :user_id
-              AND status != 'deleted'
-              AND parent_id = :parent_id
-              AND LOWER(file_name) LIKE LOWER(:q)
-            ORDER BY updated_at DESC
-            """
-        )
-    else:
-        folders_sql = text(
-            """
-            SELECT folder_id, folder_name, parent_id, user_id, created_at, updated_at
-            FROM folders
-            WHERE user_id = :user_id
-              AND LOWER(folder_name) LIKE LOWER(:q)
-            ORDER BY updated_at DESC
-            """
-        )
-        files_sql = text(
-            """
-            SELECT file_id, file_name, parent_id, user_id, file_size, created_at, updated_at
-            FROM files
-            WHERE user_id = :user_id
-              AND status != 'deleted'
-              AND LOWER(file_name) LIKE LOWER(:q)
-            ORDER BY updated_at DESC
-            """
-        )
+    folders, files = _split_items(rows, ("rank", "snippet"))
+    return {"folders": folders, "files": files, "next_cursor": next_cursor}
 
-    folders = db.execute(folders_sql, params).fetchall()
-    files = db.execute(files_sql, params).fetchall()
 
-    return {
-        "folders": [dict(r._mapping) for r in folders],
-        "files": [dict(r._mapping) for r in files],
-    }
+@router.get("/names")
+def search_item_names(
+    q: str,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    Search-as-you-type over folder and file names, including items shared with the user.
+    - Substring matches ("nvoice_20" finds "invoice_2023.pdf") rank first.
+    - Then near misses by trigram similarity ("invce_2023" still finds it).
+    - Each item carries a score from 0 to 1.
+    """
+    if not q or not q.strip():
+        raise HTTPException(status_code=400, detail="Query 'q' is required")
+
+    rows = search_names(db, current_user["user_id"], q, limit=limit)
+    folders, files = _split_items(rows, ("score",))
+    return {"folders": folders, "files": files}
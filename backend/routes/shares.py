@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends,HTTPException,Form,File,UploadFile
+from fastapi import APIRouter, Depends,HTTPException,Form,File,UploadFile,Query
 from utils import get_db,check_permission, log_action_for_owner
 from verify_token import get_current_user
 from sqlalchemy import text,bindparam
@@ -6,9 +6,35 @@ from datetime import datetime
 from sqlalchemy.orm import Session
 import os, shutil
 import secrets
+from permission_cache import permission_cache
+from pagination import Section, paginate_sections, count_sections
+from typing import Optional
 
 router = APIRouter()
 
+SHARE_SORT_PATTERN = "^(shared_at|name|updated_at)$"
+# ?sort= -> (column, row key) per section; shared_at follows share_id, which grows with time
+_SHARED_FOLDER_SORTS = {"shared_at": ("sa.share_id", "share_id"), "name": ("f.folder_name", "folder_name"), "updated_at": ("f.updated_at", "updated_at")}
+_SHARED_FILE_SORTS = {"shared_at": ("sa.share_id", "share_id"), "name": ("f.file_name", "file_name"), "updated_at": ("f.updated_at", "updated_at")}
+
+
+def _grant_access(db, share_id: int, emails: list[str]):
+    """Give the users behind `emails` access to the share in one lookup and one insert;
+    unknown emails are skipped."""
+    if not emails:
+        return
+    users = db.execute(
+        text("SELECT user_id FROM users WHERE email IN :emails").bindparams(bindparam("emails", expanding=True)),
+        {"emails": list(set(emails))}
+    ).fetchall()
+    if users:
+        db.execute(text(
+            '''
+                INSERT INTO share_access (share_id, user_id)
+                VALUES (:share_id, :user_id)
+            '''
+        ), [{"share_id": share_id, "user_id": u.user_id} for u in users])
+
 # make share permissions
 @router.post('/share_link')
 def share(db: Session = Depends(get_db) , current_user = Depends(get_current_user),
@@ -34,6 +60,7 @@ def share(db: Session = Depends(get_db) , current_user = Depends(get_current_use
         '''
             INSERT INTO shares(folder_id,file_id,token,permission,created_at,updated_at,is_public)
             VALUES(:folder_id,:file_id,:token,:permission,:created_at,:updated_at,:is_public)
+            RETURNING share_id
         '''
     ),{
         'folder_id': folder_id,
@@ -45,32 +72,13 @@ def share(db: Session = Depends(get_db) , current_user = Depends(get_current_use
         'is_public': is_public,
     })
 
-    share_id = result.lastrowid
-
-    if not is_public:
-        for e in emails:
-            user = db.execute(text(
-                '''
-                    SELECT user_id FROM users WHERE email = :email
-                '''
-            ),{
-                'email': e
-            }).fetchone()
-
-            if not user:
-                continue
-
-            db.execute(text(
-                '''
-                    INSERT INTO share_access (share_id,user_id)
-                    VALUES(:share_id,:user_id)
-                ''' 
-            ),{
-                'share_id': share_id,
-                'user_id': user.user_id
-            })
+    share_id = result.scalar()
+
+    # named recipients see a public share in their shared view too
+    _grant_access(db, share_id, emails)
 
     db.commit()
+    permission_cache.invalidate(folder_ids=[folder_id], file_ids=[file_id])
     # Log share creation (attribute to resource owner)
     try:
         rtype = 'file' if file_id else 'folder'
@@ -90,7 +98,12 @@ def share(db: Session = Depends(get_db) , current_user = Depends(get_current_use
 
 #get details of the share
 @router.get("/share_details")
-def share_details(db: Session = Depends(get_db), file_id: int = None, folder_id: int = None):
+def share_details(db: Session = Depends(get_db), file_id: int = None, folder_id: int = None,
+                  sort: str = Query("created_at", pattern="^(created_at|updated_at)$"),
+                  order: str = Query("asc", pattern="^(asc|desc)$"),
+                  limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = None):
+    """Shares of a file or folder with their recipients: one query for the page of shares
+    and one batched lookup for the recipients of all of them."""
     if not file_id and not folder_id:
         raise HTTPException(status_code=400, detail="Provide file_id or folder_id")
 
@@ -105,26 +118,33 @@ def share_details(db: Session = Depends(get_db), file_id: int = None, folder_id:
         query += " AND folder_id = :folder_id"
         params["folder_id"] = folder_id
 
-    shares = db.execute(text(query), params).fetchall()
-    result = []
-
-    for s in shares:
-        share_dict = dict(s._mapping)
-
+    sort_column = "share_id" if sort == "created_at" else "updated_at"
+    sections = [Section("shares", query, params, sort_column, "share_id", order == "desc", sort_column, "share_id")]
+    try:
+        page, next_cursor = paginate_sections(db, sections, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    shares = page["shares"]
+
+    private_ids = [s["share_id"] for s in shares if not s["is_public"]]
+    recipients = {share_id: [] for share_id in private_ids}
+    if private_ids:
+        users = db.execute(text("""
+            SELECT sa.share_id, u.user_id, u.username, u.email
+            FROM share_access sa
+            JOIN users u ON sa.user_id = u.user_id
+            WHERE sa.share_id IN :share_ids
+        """).bindparams(bindparam("share_ids", expanding=True)), {"share_ids": private_ids}).fetchall()
+        for u in users:
+            recipients[u.share_id].append({"user_id": u.user_id, "username": u.username, "email": u.email})
+
+    for share_dict in shares:
         if share_dict["is_public"]:
             share_dict["users"] = "Anyone with the link"
         else:
-            users = db.execute(text("""
-                SELECT u.user_id, u.username, u.email
-                FROM share_access sa
-                JOIN users u ON sa.user_id = u.user_id
-                WHERE sa.share_id = :share_id
-            """), {"share_id": share_dict["share_id"]}).fetchall()
-            share_dict["users"] = [dict(u._mapping) for u in users]
+            share_dict["users"] = recipients[share_dict["share_id"]]
 
-        result.append(share_dict)
-
-    return {"shares": result}
+    return {"shares": shares, "next_cursor": next_cursor}
 
 @router.get('/get_shares')
 def get_shares(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user) , token: str = None):
@@ -215,17 +235,10 @@ def update_shares(db: Session = Depends(get_db), current_user: dict = Depends(ge
             "share_id": share_id
         })
 
-        for email in emails:
-            user = db.execute(text('SELECT user_id FROM users WHERE email = :email'), {"email": email}).fetchone()
-            if not user:
-                continue
-
-            db.execute(text('''
-                INSERT INTO share_access (share_id, user_id)
-                VALUES (:share_id, :user_id)
-            '''), {"share_id": share_id, "user_id": user.user_id})
+        _grant_access(db, share_id, emails)
         
     db.commit()
+    permission_cache.invalidate(folder_ids=[share.folder_id], file_ids=[share.file_id])
     # Log share update (attribute to resource owner)
     try:
         rtype = 'file' if share.file_id else 'folder'
@@ -274,6 +287,7 @@ def delete_share(db: Session = Depends(get_db), current_user: dict = Depends(get
     })
 
     db.commit()
+    permission_cache.invalidate(folder_ids=[share.folder_id], file_ids=[share.file_id])
     # Log share delete (attribute to resource owner)
     try:
         rtype = 'file' if share.file_id else 'folder'
@@ -285,57 +299,45 @@ def delete_share(db: Session = Depends(get_db), current_user: dict = Depends(get
     return {"message": "Share deleted successfully"}
 
 @router.get('/shared_with_me')
-def get_shared_with_me(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    """Get all files and folders shared with the current user"""
+def get_shared_with_me(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user),
+                       sort: str = Query("shared_at", pattern=SHARE_SORT_PATTERN), order: str = Query("desc", pattern="^(asc|desc)$"),
+                       limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = None,
+                       include_total: bool = False):
+    """Get all files and folders shared with the current user (newest share first by default),
+    public shares addressed to them included. One query per kind; keyset-paginated when
+    `limit` is given."""
     user_id = current_user["user_id"]
-    
-    # Get shares where user has explicit access
-    user_shares = db.execute(text('''
-        SELECT s.share_id, s.file_id, s.folder_id, s.token, s.permission, s.is_public,
-               s.created_at, s.updated_at
-        FROM shares s
-        INNER JOIN share_access sa ON s.share_id = sa.share_id
-        WHERE sa.user_id = :user_id
-    '''), {"user_id": user_id}).fetchall()
-    
-    files = []
-    folders = []
-    
-    for share in user_shares:
-        share_dict = dict(share._mapping)
-        
-        if share.file_id:
-            # Get file details
-            file_data = db.execute(text('''
-                SELECT f.file_id, f.file_name, f.file_size, f.created_at, f.updated_at,
-                       u.username as owner_name, u.email as owner_email
-                FROM files f
-                JOIN users u ON f.user_id = u.user_id
-                WHERE f.file_id = :file_id AND f.status != 'deleted'
-            '''), {"file_id": share.file_id}).fetchone()
-            
-            if file_data:
-                file_dict = dict(file_data._mapping)
-                file_dict['share_token'] = share.token
-                file_dict['permission'] = share.permission
-                file_dict['shared_at'] = share.created_at
-                files.append(file_dict)
-        
-        elif share.folder_id:
-            # Get folder details
-            folder_data = db.execute(text('''
-                SELECT f.folder_id, f.folder_name, f.created_at, f.updated_at,
-                       u.username as owner_name, u.email as owner_email
-                FROM folders f
-                JOIN users u ON f.user_id = u.user_id
-                WHERE f.folder_id = :folder_id
-            '''), {"folder_id": share.folder_id}).fetchone()
-            
-            if folder_data:
-                folder_dict = dict(folder_data._mapping)
-                folder_dict['share_token'] = share.token
-                folder_dict['permission'] = share.permission
-                folder_dict['shared_at'] = share.created_at
-                folders.append(folder_dict)
-    
-    return {"files": files, "folders": folders}
\ No newline at end of file
+    folder_sort, folder_key = _SHARED_FOLDER_SORTS[sort]
+    file_sort, file_key = _SHARED_FILE_SORTS[sort]
+
+    sections = [
+        Section("folders", '''
+            SELECT sa.share_id, f.folder_id, f.folder_name, f.created_at, f.updated_at,
+                   u.username as owner_name, u.email as owner_email,
+                   s.token as share_token, s.permission, s.is_public, s.created_at as shared_at
+            FROM share_access sa
+            JOIN shares s ON s.share_id = sa.share_id
+            JOIN folders f ON f.folder_id = s.folder_id
+            JOIN users u ON f.user_id = u.user_id
+            WHERE sa.user_id = :user_id
+        ''', {"user_id": user_id}, folder_sort, "sa.share_id", order == "desc", folder_key, "share_id"),
+        Section("files", '''
+            SELECT sa.share_id, f.file_id, f.file_name, f.file_size, f.created_at, f.updated_at,
+                   u.username as owner_name, u.email as owner_email,
+                   s.token as share_token, s.permission, s.is_public, s.created_at as shared_at
+            FROM share_access sa
+            JOIN shares s ON s.share_id = sa.share_id
+            JOIN files f ON f.file_id = s.file_id
+            JOIN users u ON f.user_id = u.user_id
+            WHERE sa.user_id = :user_id AND f.status != 'deleted'
+        ''', {"user_id": user_id}, file_sort, "sa.share_id", order == "desc", file_key, "share_id"),
+    ]
+    try:
+        page, next_cursor = paginate_sections(db, sections, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    response = {"files": page["files"], "folders": page["folders"], "next_cursor": next_cursor}
+    if include_total:
+        response["total"] = count_sections(db, sections)
+    return response
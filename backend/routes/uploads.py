@@ -0,0 +1,336 @@
+from fastapi import APIRouter, Depends, HTTPException, Form, Request
+from starlette.concurrency import run_in_threadpool
+from utils import get_db, check_permission, log_action_for_owner
+from verify_token import get_current_user
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from datetime import datetime
+from folder_tree import adjust_stats_for_files
+from search_index import index_items
+from blob_store import STAGING_DIR, hash_file, acquire_blob, discard_blob
+from routes.files import STORAGE_LIMIT_BYTES
+import hashlib
+import hmac
+import os
+import secrets
+
+router = APIRouter()
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# Retry-After of a finalize that found chunk writes still running
+UPLOAD_FINALIZE_RETRY_SECONDS = int(os.getenv("UPLOAD_FINALIZE_RETRY_SECONDS", "1"))
+
+
+def _total_chunks(total_size: int, chunk_size: int) -> int:
+    return (total_size + chunk_size - 1) // chunk_size
+
+
+def _get_session(db, upload_id: str, user_id: int):
+    session = db.execute(text(
+        '''
+            SELECT upload_id, user_id, parent_id, file_name, total_size, chunk_size, temp_path, status
+            FROM upload_sessions WHERE upload_id = :upload_id AND user_id = :user_id
+        '''
+    ), {"upload_id": upload_id, "user_id": user_id}).fetchone()
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+
+def _name_taken(db, file_name: str, parent_id: int) -> bool:
+    return db.execute(text(
+        "SELECT 1 FROM files WHERE file_name = :file_name AND parent_id = :parent_id"
+    ), {"file_name": file_name, "parent_id": parent_id}).fetchone() is not None
+
+
+def _start_chunk(db, upload_id: str, user_id: int) -> bool:
+    """Count a chunk write in, only while the session is open. Finalize claims the session
+    only while no write is counted in, in one statement, so the two never overlap."""
+    started = db.execute(text(
+        '''
+            UPDATE upload_sessions SET chunks_in_flight = chunks_in_flight + 1, updated_at = :now
+            WHERE upload_id = :upload_id AND user_id = :user_id AND status = 'open'
+        '''
+    ), {"now": datetime.now(), "upload_id": upload_id, "user_id": user_id})
+    db.commit()
+    return started.rowcount == 1
+
+
+def _finish_chunk(db, upload_id: str, chunk_index: int = None, size: int = None, sha256: str = None):
+    """Count a chunk write out, recording the chunk when it was written in full. Nothing is
+    recorded for a session that was aborted or expired meanwhile."""
+    try:
+        if chunk_index is not None:
+            db.execute(text(
+                '''
+                    INSERT INTO upload_chunks (upload_id, chunk_index, size, sha256)
+                    SELECT upload_id, :chunk_index, :size, :sha256 FROM upload_sessions WHERE upload_id = :upload_id
+                    ON CONFLICT (upload_id, chunk_index) DO UPDATE SET size = excluded.size, sha256 = excluded.sha256
+                '''
+            ), {"upload_id": upload_id, "chunk_index": chunk_index, "size": size, "sha256": sha256})
+        db.execute(text(
+            '''
+                UPDATE upload_sessions SET chunks_in_flight = chunks_in_flight - 1, updated_at = :now
+                WHERE upload_id = :upload_id AND chunks_in_flight > 0
+            '''
+        ), {"now": datetime.now(), "upload_id": upload_id})
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def remove_upload_session(db, upload_id: str, temp_path: str):
+    """Drop a session, its chunk records and its partial file (caller commits)."""
+    db.execute(text("DELETE FROM upload_chunks WHERE upload_id = :upload_id"), {"upload_id": upload_id})
+    db.execute(text("DELETE FROM upload_sessions WHERE upload_id = :upload_id"), {"upload_id": upload_id})
+    try:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+    except Exception:
+        pass
+
+
+@router.post('')
+def create_upload_session(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user),
+                          file_name: str = Form(...), total_size: int = Form(...), parent_id: int = Form(0),
+                          chunk_size: int = Form(None)):
+    """Start a resumable upload. Chunks can then be PUT in any order, in parallel."""
+    user_id = current_user["user_id"]
+    parent_id = parent_id or 0
+    if parent_id != 0 and not check_permission(db, user_id, folder_id=parent_id, operation='edit'):
+        raise HTTPException(status_code=400, detail="You don't have permission to access this folder")
+    if not file_name or "/" in file_name or "\\" in file_name:
+        raise HTTPException(status_code=400, detail="Invalid file name")
+    if total_size < 0:
+        raise HTTPException(status_code=400, detail="Invalid total_size")
+    if _name_taken(db, file_name, parent_id):
+        raise HTTPException(status_code=400, detail="File already exists")
+
+    # fail fast on obviously oversized uploads; the authoritative check happens at finalize
+    storage = db.execute(text('SELECT storage FROM users WHERE user_id = :user_id'), {"user_id": user_id}).scalar() or 0
+    if int(storage) + total_size > STORAGE_LIMIT_BYTES:
+        raise HTTPException(status_code=413, detail="Storage limit exceeded (10GB)")
+
+    chunk_size = min(max(chunk_size or UPLOAD_CHUNK_SIZE, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+    upload_id = secrets.token_hex(16)
+    # staged next to the blobs so finalize can rename it into place
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    temp_path = os.path.join(STAGING_DIR, f'upload_{upload_id}.part')
+    # chunks are written in place at their offset, so the finished file never has to be copied
+    with open(temp_path, "wb") as f:
+        f.truncate(total_size)
+
+    db.execute(text(
+        '''
+            INSERT INTO upload_sessions (upload_id, user_id, parent_id, file_name, total_size, chunk_size, temp_path, status, created_at, updated_at)
+            VALUES (:upload_id, :user_id, :parent_id, :file_name, :total_size, :chunk_size, :temp_path, 'open', :now, :now)
+        '''
+    ), {
+        "upload_id": upload_id,
+        "user_id": user_id,
+        "parent_id": parent_id,
+        "file_name": file_name,
+        "total_size": total_size,
+        "chunk_size": chunk_size,
+        "temp_path": temp_path,
+        "now": datetime.now(),
+    })
+    db.commit()
+    return {
+        "upload_id": upload_id,
+        "chunk_size": chunk_size,
+        "total_chunks": _total_chunks(total_size, chunk_size),
+    }
+
+
+@router.put('/{upload_id}/chunks/{chunk_index}')
+async def upload_chunk(upload_id: str, chunk_index: int, request: Request,
+                       db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    """Write one chunk from the raw request body. Send X-Chunk-SHA256 (hex) to have it verified."""
+    # queries run in the threadpool, never on the event loop that streams the body
+    session = await run_in_threadpool(_get_session, db, upload_id, current_user["user_id"])
+    total_chunks = _total_chunks(session.total_size, session.chunk_size)
+    if chunk_index < 0 or chunk_index >= total_chunks:
+        raise HTTPException(status_code=400, detail="Chunk index out of range")
+    if not await run_in_threadpool(_start_chunk, db, upload_id, current_user["user_id"]):
+        raise HTTPException(status_code=409, detail="Upload is being finalized")
+
+    offset = chunk_index * session.chunk_size
+    expected = min(session.chunk_size, session.total_size - offset)
+    digest = hashlib.sha256()
+    written = 0
+    recorded = False
+    try:
+        try:
+            fd = os.open(session.temp_path, os.O_WRONLY)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        try:
+            async for piece in request.stream():
+                if not piece:
+                    continue
+                if written + len(piece) > expected:
+                    raise HTTPException(status_code=400, detail=f"Chunk larger than {expected} bytes")
+                digest.update(piece)
+                await run_in_threadpool(os.pwrite, fd, piece, offset + written)
+                written += len(piece)
+        finally:
+            os.close(fd)
+        if written != expected:
+            raise HTTPException(status_code=400, detail=f"Chunk must be {expected} bytes, got {written}")
+
+        sha256 = digest.hexdigest()
+        claimed = request.headers.get("x-chunk-sha256")
+        if claimed and not hmac.compare_digest(claimed.strip().lower(), sha256):
+            raise HTTPException(status_code=422, detail="Chunk checksum mismatch")
+
+        await run_in_threadpool(_finish_chunk, db, upload_id, chunk_index, written, sha256)
+        recorded = True
+    finally:
+        if not recorded:
+            await run_in_threadpool(_finish_chunk, db, upload_id)
+    return {"chunk_index": chunk_index, "size": written, "sha256": sha256}
+
+
+@router.get('/{upload_id}')
+def upload_status(upload_id: str, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    """Received chunks and byte ranges, so an interrupted client knows what to resend."""
+    session = _get_session(db, upload_id, current_user["user_id"])
+    rows = db.execute(text(
+        "SELECT chunk_index, size FROM upload_chunks WHERE upload_id = :upload_id ORDER BY chunk_index"
+    ), {"upload_id": upload_id}).fetchall()
+    received = [r.chunk_index for r in rows]
+    ranges = []
+    for r in rows:
+        start = r.chunk_index * session.chunk_size
+        end = start + r.size - 1
+        if ranges and ranges[-1][1] + 1 == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    total_chunks = _total_chunks(session.total_size, session.chunk_size)
+    have = set(received)
+    return {
+        "upload_id": upload_id,
+        "file_name": session.file_name,
+        "status": session.status,
+        "total_size": session.total_size,
+        "chunk_size": session.chunk_size,
+        "total_chunks": total_chunks,
+        "received_chunks": received,
+        "received_ranges": ranges,
+        "missing_chunks": [i for i in range(total_chunks) if i not in have],
+    }
+
+
+@router.post('/{upload_id}/complete')
+def finalize_upload(upload_id: str, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    user_id = current_user["user_id"]
+    session = _get_session(db, upload_id, user_id)
+
+    # claim the session so a concurrent finalize or a new chunk PUT cannot interleave.
+    # Chunk writes still running make the client retry; waiting here would hold a worker
+    # thread and a connection for as long as the slowest chunk takes
+    claimed = db.execute(text(
+        '''
+            UPDATE upload_sessions SET status = 'finalizing', updated_at = :now
+            WHERE upload_id = :upload_id AND status = 'open' AND chunks_in_flight = 0
+        '''
+    ), {"now": datetime.now(), "upload_id": upload_id})
+    if claimed.rowcount != 1:
+        db.rollback()
+        if _get_session(db, upload_id, user_id).status == 'open':
+            raise HTTPException(status_code=409, detail="Chunks are still being written",
+                                headers={"Retry-After": str(UPLOAD_FINALIZE_RETRY_SECONDS)})
+        raise HTTPException(status_code=409, detail="Upload is already being finalized")
+    db.commit()
+
+    def fail(status_code: int, detail: str):
+        # reopen the session for another attempt, or drop it once its .part file is gone
+        db.rollback()
+        if os.path.exists(session.temp_path):
+            db.execute(text("UPDATE upload_sessions SET status = 'open' WHERE upload_id = :upload_id"), {"upload_id": upload_id})
+        else:
+            remove_upload_session(db, upload_id, session.temp_path)
+        db.commit()
+        raise HTTPException(status_code=status_code, detail=detail)
+
+    received = db.execute(text(
+        "SELECT COUNT(*) AS chunks, COALESCE(SUM(size), 0) AS bytes FROM upload_chunks WHERE upload_id = :upload_id"
+    ), {"upload_id": upload_id}).fetchone()
+    total_chunks = _total_chunks(session.total_size, session.chunk_size)
+    if received.chunks != total_chunks or int(received.bytes) != session.total_size:
+        fail(400, f"Upload incomplete: {total_chunks - received.chunks} chunk(s) missing")
+
+    parent_id = session.parent_id
+    if parent_id != 0 and not check_permission(db, user_id, folder_id=parent_id, operation='edit'):
+        fail(400, "You don't have permission to access this folder")
+    if _name_taken(db, session.file_name, parent_id):
+        fail(400, "File already exists")
+
+    # the one authoritative quota check: reserve the bytes atomically
+    reserved = db.execute(text(
+        '''
+            UPDATE users SET storage = storage + :size
+            WHERE user_id = :user_id AND storage + :size <= :limit
+        '''
+    ), {"size": session.total_size, "user_id": user_id, "limit": STORAGE_LIMIT_BYTES})
+    if reserved.rowcount != 1:
+        fail(413, "Storage limit exceeded (10GB)")
+
+    digest = None
+    created = False
+    try:
+        digest, _ = hash_file(session.temp_path)
+        now = datetime.now()
+        inserted = db.execute(text(
+            '''
+                INSERT INTO files (file_name, parent_id, user_id, created_at, updated_at, file_size, blob_digest, status)
+                VALUES (:file_name, :parent_id, :user_id, :now, :now, :file_size, :digest, 'not_deleted')
+                RETURNING file_id
+            '''
+        ), {
+            "file_name": session.file_name,
+            "parent_id": parent_id,
+            "user_id": user_id,
+            "now": now,
+            "file_size": session.total_size,
+            "digest": digest,
+        }).fetchone()
+        file_id = inserted[0]
+        # rename, not copy: the assembled .part file becomes the blob (or is dropped if we already hold it)
+        blob, created = acquire_blob(db, digest, session.total_size, temp_path=session.temp_path)
+        db.execute(text("UPDATE files SET file_path = :file_path WHERE file_id = :file_id"),
+                   {"file_path": blob, "file_id": file_id})
+        adjust_stats_for_files(db, [file_id], 1)
+        index_items(db, file_ids=[file_id], content_changed=True)
+        db.execute(text("DELETE FROM upload_chunks WHERE upload_id = :upload_id"), {"upload_id": upload_id})
+        db.execute(text("DELETE FROM upload_sessions WHERE upload_id = :upload_id"), {"upload_id": upload_id})
+        db.commit()
+    except Exception as e:
+        print(f"Finalizing upload {upload_id} failed: {e}")
+        if created:
+            discard_blob(digest)
+        fail(500, "Upload failed")
+
+    try:
+        log_action_for_owner(db, actor_user_id=user_id, action="upload", resource_type="file", resource_id=file_id, details=session.file_name)
+        db.commit()
+    except Exception:
+        pass
+
+    new_file = db.execute(text("SELECT * FROM files WHERE file_id = :file_id"), {"file_id": file_id}).fetchone()
+    return {"message": "File uploaded successfully", "file": dict(new_file._mapping)}
+
+
+@router.delete('/{upload_id}')
+def abort_upload(upload_id: str, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    session = _get_session(db, upload_id, current_user["user_id"])
+    if session.status != 'open':
+        raise HTTPException(status_code=409, detail="Upload is being finalized")
+    remove_upload_session(db, upload_id, session.temp_path)
+    db.commit()
+    return {"message": "Upload aborted"}
@@ -1,6 +1,11 @@
 from datetime import datetime, timedelta
 from sqlalchemy import text
-from utils import get_db
+from utils import get_sync_db
+from folder_tree import verify_folder_stats, rebuild_folder_stats
+from permission_cache import permission_cache
+from blob_store import release_blobs_for_files, collect_garbage, migrate_legacy_files
+from search_index import remove_from_index, index_pending_content
+from log_retention import roll_up_daily, archive_old_logs, drop_expired_archives
 from pathlib import Path
 from apscheduler.schedulers.background import BackgroundScheduler
 import os
@@ -8,13 +13,22 @@ import atexit
 
 RETENTION_MINUTES = int(os.getenv("RECYCLE_RETENTION_MINUTES", "0"))
 RETENTION_DAYS = int(os.getenv("RECYCLE_RETENTION_DAYS", "30"))
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+# files moved out of the flat uploads/user_{id}/ directories per run; 0 disables the job
+LEGACY_MIGRATION_BATCH = int(os.getenv("LEGACY_MIGRATION_BATCH", "500"))
+LEGACY_MIGRATION_INTERVAL_MINUTES = int(os.getenv("LEGACY_MIGRATION_INTERVAL_MINUTES", "10"))
+SEARCH_INDEX_BATCH = int(os.getenv("SEARCH_INDEX_BATCH", "50"))
+SEARCH_INDEX_INTERVAL_SECONDS = int(os.getenv("SEARCH_INDEX_INTERVAL_SECONDS", "30"))
+LOG_RETENTION_INTERVAL_MINUTES = int(os.getenv("LOG_RETENTION_INTERVAL_MINUTES", "60"))
+# raw log rows archived per run, so one run never holds the hot table for long
+LOG_ARCHIVE_MAX_ROWS = int(os.getenv("LOG_ARCHIVE_MAX_ROWS", "100000"))
 
 _scheduler = None
 
 def delete_old_recycle_bin_files():
     print(f"🧹 Running recycle bin cleanup at {datetime.now()}")
 
-    db_gen = get_db()
+    db_gen = get_sync_db()
     db = next(db_gen)
 
     try:
@@ -24,7 +38,7 @@ def delete_old_recycle_bin_files():
             threshold = datetime.now() - timedelta(days=RETENTION_DAYS)
 
         old_files = db.execute(text('''
-            SELECT file_id, file_path, file_size, user_id
+            SELECT file_id, file_path, file_size, user_id, blob_digest
             FROM files
             WHERE status = 'deleted'
               AND updated_at < :threshold
@@ -32,23 +46,28 @@ def delete_old_recycle_bin_files():
 
         print(f"DEBUG: Found {len(old_files)} files to delete (older than {RETENTION_DAYS}d).")
 
+        # blob-backed files just drop their reference; the blob goes when nothing else uses it
+        released = release_blobs_for_files(db, [f.file_id for f in old_files])
+        remove_from_index(db, file_ids=[f.file_id for f in old_files])
+
         for f in old_files:
             file = dict(f._mapping)
             file_path = Path(file["file_path"]).absolute()
 
-            # Delete file from disk if it exists
-            if file_path.exists():
-                try:
-                    file_path.unlink()
-                    print(f"Deleted file: {file_path}")
-                except Exception as e:
-                    print(f"Could not delete {file_path}: {e}")
-            else:
-                print(f"File missing on disk: {file_path}")
+            # Delete file from disk if it exists (files stored before the blob store)
+            if not file["blob_digest"]:
+                if file_path.exists():
+                    try:
+                        file_path.unlink()
+                        print(f"Deleted file: {file_path}")
+                    except Exception as e:
+                        print(f"Could not delete {file_path}: {e}")
+                else:
+                    print(f"File missing on disk: {file_path}")
 
             db.execute(text(''' 
                 UPDATE users
-                SET storage = MAX(storage - :size, 0)
+                SET storage = CASE WHEN storage >= :size THEN storage - :size ELSE 0 END
                 WHERE user_id = :user_id
             '''), {"size": file["file_size"], "user_id": file["user_id"]})
 
@@ -56,6 +75,8 @@ def delete_old_recycle_bin_files():
                        {"file_id": file["file_id"]})
 
         db.commit()
+        permission_cache.invalidate(file_ids=[f.file_id for f in old_files])
+        collect_garbage(db, released)
         if old_files:
             print(f"Cleanup completed. Removed {len(old_files)} files.")
         else:
@@ -73,6 +94,146 @@ def delete_old_recycle_bin_files():
             pass
 
 
+def repair_folder_stats():
+    """Recompute folder_stats from scratch in case an out-of-band change left it drifting."""
+    db_gen = get_sync_db()
+    db = next(db_gen)
+
+    try:
+        result = verify_folder_stats(db)
+        if not result["ok"]:
+            count = rebuild_folder_stats(db)
+            db.commit()
+            print(f"folder_stats repaired: {result['mismatched']} mismatched, {count} rows rebuilt.")
+    except Exception as e:
+        db.rollback()
+        print(f"folder_stats repair failed: {e}")
+
+    finally:
+        db.close()
+        try:
+            next(db_gen)
+        except StopIteration:
+            pass
+
+
+def expire_upload_sessions():
+    """Drop resumable uploads that have not received a chunk within the TTL, and ones
+    whose finalize died (process killed mid-request) and left them 'finalizing'."""
+    from routes.uploads import remove_upload_session
+
+    db_gen = get_sync_db()
+    db = next(db_gen)
+
+    try:
+        threshold = datetime.now() - timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+        stale = db.execute(text('''
+            SELECT upload_id, temp_path FROM upload_sessions
+            WHERE status IN ('open', 'finalizing') AND updated_at < :threshold
+        '''), {"threshold": threshold}).fetchall()
+        for s in stale:
+            remove_upload_session(db, s.upload_id, s.temp_path)
+        db.commit()
+        if stale:
+            print(f"Expired {len(stale)} upload sessions.")
+    except Exception as e:
+        db.rollback()
+        print(f"Upload session cleanup failed: {e}")
+
+    finally:
+        db.close()
+        try:
+            next(db_gen)
+        except StopIteration:
+            pass
+
+
+def collect_blob_garbage():
+    """Remove blobs whose last reference went away without being collected inline."""
+    db_gen = get_sync_db()
+    db = next(db_gen)
+
+    try:
+        removed = collect_garbage(db)
+        if removed:
+            print(f"Collected {removed} unreferenced blobs.")
+    except Exception as e:
+        db.rollback()
+        print(f"Blob garbage collection failed: {e}")
+
+    finally:
+        db.close()
+        try:
+            next(db_gen)
+        except StopIteration:
+            pass
+
+
+def migrate_legacy_uploads():
+    """Move a batch of flat-directory files into the sharded blob store."""
+    db_gen = get_sync_db()
+    db = next(db_gen)
+
+    try:
+        moved = migrate_legacy_files(db, max_files=LEGACY_MIGRATION_BATCH)
+        if moved:
+            print(f"Moved {moved} legacy files into the blob store.")
+    except Exception as e:
+        db.rollback()
+        print(f"Legacy file migration failed: {e}")
+
+    finally:
+        db.close()
+        try:
+            next(db_gen)
+        except StopIteration:
+            pass
+
+
+def index_search_content():
+    """Extract document text for files uploaded or replaced since the last run."""
+    db_gen = get_sync_db()
+    db = next(db_gen)
+
+    try:
+        indexed = index_pending_content(db, limit=SEARCH_INDEX_BATCH)
+        if indexed:
+            print(f"Indexed content of {indexed} files.")
+    except Exception as e:
+        db.rollback()
+        print(f"Search indexing failed: {e}")
+
+    finally:
+        db.close()
+        try:
+            next(db_gen)
+        except StopIteration:
+            pass
+
+
+def maintain_activity_logs():
+    """Roll up finished days, archive raw logs past retention, drop expired archive months."""
+    db_gen = get_sync_db()
+    db = next(db_gen)
+
+    try:
+        rolled = roll_up_daily(db)
+        archived = archive_old_logs(db, max_rows=LOG_ARCHIVE_MAX_ROWS)
+        dropped = drop_expired_archives(db)
+        if rolled or archived or dropped:
+            print(f"Activity logs: {rolled} daily rollups, {archived} rows archived, dropped {dropped or 'none'}.")
+    except Exception as e:
+        db.rollback()
+        print(f"Activity log retention failed: {e}")
+
+    finally:
+        db.close()
+        try:
+            next(db_gen)
+        except StopIteration:
+            pass
+
+
 def start_cleanup_scheduler():
     global _scheduler
     if _scheduler is not None:
@@ -84,6 +245,16 @@ def start_cleanup_scheduler():
         hour = int(os.getenv('RECYCLE_CLEAN_HOUR', '2'))
         minute = int(os.getenv('RECYCLE_CLEAN_MINUTE', '30'))
         _scheduler.add_job(delete_old_recycle_bin_files, 'cron', hour=hour, minute=minute)
+    _scheduler.add_job(repair_folder_stats, 'cron', hour=int(os.getenv('FOLDER_STATS_REPAIR_HOUR', '3')), minute=0)
+    _scheduler.add_job(expire_upload_sessions, 'interval', hours=1)
+    _scheduler.add_job(collect_blob_garbage, 'interval', hours=1)
+    if LEGACY_MIGRATION_BATCH > 0:
+        _scheduler.add_job(migrate_legacy_uploads, 'interval', minutes=LEGACY_MIGRATION_INTERVAL_MINUTES,
+                           max_instances=1, coalesce=True)
+    _scheduler.add_job(index_search_content, 'interval', seconds=SEARCH_INDEX_INTERVAL_SECONDS,
+                       max_instances=1, coalesce=True)
+    _scheduler.add_job(maintain_activity_logs, 'interval', minutes=LOG_RETENTION_INTERVAL_MINUTES,
+                       max_instances=1, coalesce=True)
     _scheduler.start()
     print("Recycle bin cleanup scheduler started.")
 
@@ -0,0 +1,580 @@
+"""Full-text search index over folder names, file names and extracted document text.
+
+search_documents holds one row per file or folder (keyed by owner). On SQLite an
+external-content FTS5 table (search_fts) is kept in step with it by triggers; on
+PostgreSQL a generated tsvector column with a GIN index plays the same role.
+
+Names also get a trigram index for substring and typo-tolerant lookups
+(search_names): an FTS5 trigram table on SQLite, pg_trgm on PostgreSQL. The FTS5
+table carries each name's owner as a one-trigram key, so a lookup matches only the
+names of the owners a user can see instead of ranking every user's names.
+
+Routes call index_items() / remove_from_index() in their own transaction. Text
+extraction is slow, so new or replaced files are only flagged content_pending and
+index_pending_content() (a scheduler job) fills the content in afterwards.
+"""
+import os
+import re
+
+from sqlalchemy import text, bindparam
+
+from database import IS_POSTGRES, translate_ddl
+from pagination import encode_cursor, decode_cursor as _decode_cursor
+
+SEARCH_MAX_TERMS = 8
+# trigram candidates scored by similarity per name lookup, after substring matches (SQLite)
+SEARCH_FUZZY_CANDIDATES = int(os.getenv("SEARCH_FUZZY_CANDIDATES", "200"))
+# files larger than this are indexed by name only
+SEARCH_MAX_EXTRACT_BYTES = int(os.getenv("SEARCH_MAX_EXTRACT_BYTES", str(50 * 1024 * 1024)))
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def create_search_schema(conn):
+    """Migration step: tables, the dialect's full-text structure, and a backfill of names."""
+    conn.execute(text(translate_ddl(
+        """
+        CREATE TABLE IF NOT EXISTS search_documents (
+            doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_type VARCHAR(10) NOT NULL CHECK(item_type IN ('file', 'folder')),
+            item_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            content TEXT NOT NULL DEFAULT '',
+            content_digest VARCHAR(64),
+            content_pending BOOLEAN DEFAULT 0,
+            UNIQUE (item_type, item_id)
+        )
+        """
+    )))
+    if IS_POSTGRES:
+        conn.execute(text(
+            """
+            ALTER TABLE search_documents ADD COLUMN IF NOT EXISTS tsv tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', content), 'B')
+            ) STORED
+            """
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_search_documents_tsv ON search_documents USING GIN (tsv)"))
+    else:
+        conn.execute(text(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+                name, content, content='search_documents', content_rowid='doc_id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+            """
+        ))
+        conn.execute(text(
+            """
+            CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN
+                INSERT INTO search_fts (rowid, name, content) VALUES (new.doc_id, new.name, new.content);
+            END
+            """
+        ))
+        conn.execute(text(
+            """
+            CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN
+                INSERT INTO search_fts (search_fts, rowid, name, content) VALUES ('delete', old.doc_id, old.name, old.content);
+            END
+            """
+        ))
+        conn.execute(text(
+            """
+            CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE OF name, content ON search_documents BEGIN
+                INSERT INTO search_fts (search_fts, rowid, name, content) VALUES ('delete', old.doc_id, old.name, old.content);
+                INSERT INTO search_fts (rowid, name, content) VALUES (new.doc_id, new.name, new.content);
+            END
+            """
+        ))
+    # existing rows: names now, document text later via index_pending_content()
+    conn.execute(text(
+        """
+        INSERT INTO search_documents (item_type, item_id, user_id, name, content, content_pending)
+        SELECT 'folder', folder_id, user_id, folder_name, '', FALSE FROM folders
+        WHERE folder_id != 0 AND user_id IS NOT NULL
+        ON CONFLICT (item_type, item_id) DO NOTHING
+        """
+    ))
+    conn.execute(text(
+        """
+        INSERT INTO search_documents (item_type, item_id, user_id, name, content, content_pending)
+        SELECT 'file', file_id, user_id, file_name, '', TRUE FROM files
+        WHERE user_id IS NOT NULL
+        ON CONFLICT (item_type, item_id) DO NOTHING
+        """
+    ))
+
+
+# owner keys: user_id as three characters from the Private Use Area, which the trigram
+# tokenizer turns into one trigram no file name uses (11 bits per character)
+_OWNER_KEY_BASE = 0xE000
+_OWNER_KEY_SQL = (
+    "char({base} + ((user_id >> 22) & 2047)) || char({base} + ((user_id >> 11) & 2047)) || char({base} + (user_id & 2047))"
+)
+
+
+def _owner_key(user_id: int) -> str:
+    return "".join(chr(_OWNER_KEY_BASE + ((user_id >> shift) & 2047)) for shift in (22, 11, 0))
+
+
+def create_name_trigram_index(conn):
+    """Migration step: trigram index over search_documents.name (GIN index added separately on PostgreSQL)."""
+    if IS_POSTGRES:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        return
+    # contentless: owner is not a search_documents column, and lookups only need rowids
+    conn.execute(text(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS name_trgm USING fts5(
+            name, owner, content='', tokenize='trigram'
+        )
+        """
+    ))
+    new_key = _OWNER_KEY_SQL.format(base=_OWNER_KEY_BASE).replace("user_id", "new.user_id")
+    old_key = _OWNER_KEY_SQL.format(base=_OWNER_KEY_BASE).replace("user_id", "old.user_id")
+    conn.execute(text(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS search_documents_trgm_ai AFTER INSERT ON search_documents BEGIN
+            INSERT INTO name_trgm (rowid, name, owner) VALUES (new.doc_id, new.name, {new_key});
+        END
+        """
+    ))
+    conn.execute(text(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS search_documents_trgm_ad AFTER DELETE ON search_documents BEGIN
+            INSERT INTO name_trgm (name_trgm, rowid, name, owner) VALUES ('delete', old.doc_id, old.name, {old_key});
+        END
+        """
+    ))
+    conn.execute(text(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS search_documents_trgm_au AFTER UPDATE OF name, user_id ON search_documents BEGIN
+            INSERT INTO name_trgm (name_trgm, rowid, name, owner) VALUES ('delete', old.doc_id, old.name, {old_key});
+            INSERT INTO name_trgm (rowid, name, owner) VALUES (new.doc_id, new.name, {new_key});
+        END
+        """
+    ))
+    conn.execute(text(
+        f"""
+        INSERT INTO name_trgm (rowid, name, owner)
+        SELECT doc_id, name, {_OWNER_KEY_SQL.format(base=_OWNER_KEY_BASE)} FROM search_documents
+        """
+    ))
+
+
+def drop_name_trigram_index(conn):
+    """Migration step: drop the SQLite trigram table and its triggers so they can be recreated."""
+    if IS_POSTGRES:
+        return
+    for trigger in ("search_documents_trgm_ai", "search_documents_trgm_ad", "search_documents_trgm_au"):
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+    conn.execute(text("DROP TABLE IF EXISTS name_trgm"))
+
+
+def index_items(db, file_ids=None, folder_ids=None, content_changed: bool = False):
+    """Add or refresh the names of these items; content_changed queues files for text extraction."""
+    if file_ids:
+        db.execute(text(
+            """
+            INSERT INTO search_documents (item_type, item_id, user_id, name, content, content_pending)
+            SELECT 'file', file_id, user_id, file_name, '', TRUE FROM files
+            WHERE file_id IN :ids
+            ON CONFLICT (item_type, item_id) DO UPDATE SET
+                name = excluded.name,
+                content_pending = CASE WHEN :changed THEN TRUE ELSE search_documents.content_pending END
+            """
+        ).bindparams(bindparam("ids", expanding=True)), {"ids": list(file_ids), "changed": content_changed})
+    if folder_ids:
+        db.execute(text(
+            """
+            INSERT INTO search_documents (item_type, item_id, user_id, name, content, content_pending)
+            SELECT 'folder', folder_id, user_id, folder_name, '', FALSE FROM folders
+            WHERE folder_id IN :ids
+            ON CONFLICT (item_type, item_id) DO UPDATE SET name = excluded.name
+            """
+        ).bindparams(bindparam("ids", expanding=True)), {"ids": list(folder_ids)})
+
+
+def remove_from_index(db, file_ids=None, folder_ids=None):
+    for item_type, ids in (("file", file_ids), ("folder", folder_ids)):
+        if ids:
+            db.execute(text(
+                "DELETE FROM search_documents WHERE item_type = :item_type AND item_id IN :ids"
+            ).bindparams(bindparam("ids", expanding=True)), {"item_type": item_type, "ids": list(ids)})
+
+
+def _extract(file_name: str, file_path: str, blob_digest: str) -> str:
+    from blob_store import open_local
+    from routes.ai import extract_text
+
+    with open_local(file_path, blob_digest) as path:
+        return extract_text(path, file_name) or ""
+
+
+def index_pending_content(db, limit: int = 50) -> int:
+    """Extract text for up to `limit` queued files, committing one file at a time."""
+    rows = db.execute(text(
+        """
+        SELECT d.doc_id, f.file_id, f.file_name, f.file_path, f.file_size, f.blob_digest
+        FROM search_documents d
+        JOIN files f ON f.file_id = d.item_id
+        WHERE d.content_pending = TRUE AND d.item_type = 'file'
+        LIMIT :limit
+        """
+    ), {"limit": limit}).fetchall()
+    db.commit()
+    done = 0
+    for row in rows:
+        content = ""
+        if row.file_path and (row.file_size or 0) <= SEARCH_MAX_EXTRACT_BYTES:
+            try:
+                content = _extract(row.file_name, row.file_path, row.blob_digest)
+            except Exception:
+                content = ""  # unreadable or unsupported: searchable by name only
+        # skip the write if the file was replaced while we were reading it
+        result = db.execute(text(
+            """
+            UPDATE search_documents
+            SET content = :content, content_digest = :digest, content_pending = FALSE
+            WHERE doc_id = :doc_id
+              AND EXISTS (SELECT 1 FROM files WHERE file_id = :file_id AND blob_digest IS NOT DISTINCT FROM :digest)
+            """
+        ), {"content": content.replace("\x00", ""), "digest": row.blob_digest, "doc_id": row.doc_id, "file_id": row.file_id})
+        db.commit()
+        done += result.rowcount
+    # documents whose file vanished without going through remove_from_index()
+    db.execute(text(
+        """
+        DELETE FROM search_documents
+        WHERE content_pending = TRUE AND item_type = 'file'
+          AND NOT EXISTS (SELECT 1 FROM files WHERE file_id = search_documents.item_id)
+        """
+    ))
+    db.commit()
+    return done
+
+
+def decode_cursor(cursor: str):
+    """(section, key, doc_id) or ValueError. Section "text" pages search() by (rank, doc_id),
+    then "name" pages search_name_substrings() by (name, doc_id); (None, None) is its start.
+    """
+    try:
+        section, key, doc_id = _decode_cursor(cursor)
+        if section == "text":
+            return section, float(key), int(doc_id)
+        if section == "name":
+            if key is None and doc_id is None:
+                return section, None, None
+            if isinstance(key, str):
+                return section, key, int(doc_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("invalid cursor") from e
+    raise ValueError("invalid cursor")
+
+
+def _terms(q: str):
+    return _TERM.findall(q.lower())[:SEARCH_MAX_TERMS]
+
+
+def _match_query(terms) -> str:
+    """The dialect's full-text query: every term as a prefix."""
+    if IS_POSTGRES:
+        return " & ".join(f"{t}:*" for t in terms)
+    return " ".join('"' + t + '"*' for t in terms)
+
+
+def search(db, user_id: int, q: str, limit: int = 50, cursor=None, parent_id: int = None):
+    """Ranked matches among the user's own items, best first. Every term must match, as a
+    prefix, in the name or the document text. cursor is (rank, doc_id) of the last row seen.
+    Returns (rows, next_cursor).
+    """
+    terms = _terms(q)
+    if not terms:
+        return [], None
+    params = {"user_id": user_id, "q": _match_query(terms), "limit": limit + 1}
+    if IS_POSTGRES:
+        matches = """
+            SELECT d.doc_id, d.item_type, d.item_id, d.name, d.content,
+                   CAST(-ts_rank(d.tsv, query) AS DOUBLE PRECISION) AS rank
+            FROM search_documents d, to_tsquery('simple', :q) query
+            WHERE d.tsv @@ query AND d.user_id = :user_id
+        """
+    else:
+        matches = """
+            SELECT d.doc_id, d.item_type, d.item_id,
+                   bm25(search_fts, 10.0, 1.0) AS rank,
+                   snippet(search_fts, -1, '<mark>', '</mark>', '…', 12) AS snippet
+            FROM search_fts JOIN search_documents d ON d.doc_id = search_fts.rowid
+            WHERE search_fts MATCH :q AND d.user_id = :user_id
+        """
+
+    conditions = [
+        "((m.item_type = 'file' AND f.status != 'deleted'{file_scope}) OR "
+        "(m.item_type = 'folder' AND fo.folder_id IS NOT NULL{folder_scope}))".format(
+            file_scope=" AND f.parent_id = :parent_id" if parent_id is not None else "",
+            folder_scope=" AND fo.parent_id = :parent_id" if parent_id is not None else "",
+        )
+    ]
+    if parent_id is not None:
+        params["parent_id"] = parent_id
+    if cursor is not None:
+        params["after_rank"], params["after_id"] = cursor
+        conditions.append("(m.rank > :after_rank OR (m.rank = :after_rank AND m.doc_id > :after_id))")
+
+    if IS_POSTGRES:
+        snippet = ("ts_headline('simple', CASE WHEN m.content = '' THEN m.name ELSE m.content END, "
+                   "to_tsquery('simple', :q), 'StartSel=<mark>, StopSel=</mark>, MaxWords=24, MinWords=8')")
+    else:
+        snippet = "m.snippet"
+    rows = db.execute(text(
+        f"""
+        SELECT m.doc_id, m.item_type, m.item_id, m.rank, {snippet} AS snippet,
+               f.file_name, f.file_size, f.parent_id AS file_parent_id, f.user_id AS file_user_id,
+               f.created_at AS file_created_at, f.updated_at AS file_updated_at,
+               fo.folder_name, fo.parent_id AS folder_parent_id, fo.user_id AS folder_user_id,
+               fo.created_at AS folder_created_at, fo.updated_at AS folder_updated_at
+        FROM ({matches}) m
+        LEFT JOIN files f ON m.item_type = 'file' AND f.file_id = m.item_id
+        LEFT JOIN folders fo ON m.item_type = 'folder' AND fo.folder_id = m.item_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY m.rank, m.doc_id
+        LIMIT :limit
+        """
+    ), params).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor("text", rows[-1].rank, rows[-1].doc_id)
+    return rows, next_cursor
+
+
+# documents a user can see: their own, plus files and folder trees shared with them
+_VISIBLE = """
+    (d.user_id = :user_id
+     OR (d.item_type = 'file' AND d.item_id IN (
+            SELECT s.file_id FROM shares s JOIN share_access sa ON sa.share_id = s.share_id
+            WHERE sa.user_id = :user_id AND s.file_id IS NOT NULL))
+     OR (d.item_type = 'folder' AND d.item_id IN (
+            SELECT fc.descendant_id FROM folder_closure fc WHERE fc.ancestor_id IN (
+                SELECT s.folder_id FROM shares s JOIN share_access sa ON sa.share_id = s.share_id
+                WHERE sa.user_id = :user_id AND s.folder_id IS NOT NULL)))
+     OR (d.item_type = 'file' AND d.item_id IN (
+            SELECT sf.file_id FROM files sf JOIN folder_closure fc ON fc.descendant_id = sf.parent_id
+            WHERE fc.ancestor_id IN (
+                SELECT s.folder_id FROM shares s JOIN share_access sa ON sa.share_id = s.share_id
+                WHERE sa.user_id = :user_id AND s.folder_id IS NOT NULL))))
+"""
+
+_NAME_COLUMNS = """
+    f.file_name, f.file_size, f.parent_id AS file_parent_id, f.user_id AS file_user_id,
+    f.created_at AS file_created_at, f.updated_at AS file_updated_at,
+    fo.folder_name, fo.parent_id AS folder_parent_id, fo.user_id AS folder_user_id,
+    fo.created_at AS folder_created_at, fo.updated_at AS folder_updated_at
+"""
+
+_NAME_JOINS = """
+    LEFT JOIN files f ON d.item_type = 'file' AND f.file_id = d.item_id
+    LEFT JOIN folders fo ON d.item_type = 'folder' AND fo.folder_id = d.item_id
+"""
+
+_LIVE = "((d.item_type = 'file' AND f.status != 'deleted') OR (d.item_type = 'folder' AND fo.folder_id IS NOT NULL))"
+
+
+def _trigrams(value: str) -> set:
+    """pg_trgm-style trigrams: each word lower-cased and padded with two spaces before, one after."""
+    grams = set()
+    for word in _TERM.findall(value.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def name_similarity(query: str, name: str) -> float:
+    """Share of trigrams in common (0..1), as pg_trgm's similarity()."""
+    a, b = _trigrams(query), _trigrams(name)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _visible_owners(db, user_id: int) -> list:
+    """The user plus everyone owning something shared with them: owners of shared files,
+    of folders inside shared trees, and of files counted in a shared folder's stats."""
+    rows = db.execute(text(
+        """
+        SELECT f.user_id FROM shares s JOIN share_access sa ON sa.share_id = s.share_id
+        JOIN files f ON f.file_id = s.file_id
+        WHERE sa.user_id = :user_id
+        UNION
+        SELECT fo.user_id FROM shares s JOIN share_access sa ON sa.share_id = s.share_id
+        JOIN folder_closure fc ON fc.ancestor_id = s.folder_id
+        JOIN folders fo ON fo.folder_id = fc.descendant_id
+        WHERE sa.user_id = :user_id
+        UNION
+        SELECT st.user_id FROM shares s JOIN share_access sa ON sa.share_id = s.share_id
+        JOIN folder_stats st ON st.folder_id = s.folder_id
+        WHERE sa.user_id = :user_id AND st.file_count > 0
+        """
+    ), {"user_id": user_id}).fetchall()
+    return sorted({user_id} | {r[0] for r in rows if r[0] is not None})
+
+
+def _like_pattern(q: str) -> str:
+    """%q% with LIKE wildcards in q escaped (ESCAPE '\\')."""
+    return "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def search_names(db, user_id: int, q: str, limit: int = 20):
+    """Items whose name contains q or resembles it (typos, missing letters), among the
+    user's own and shared items. Substring matches come first, then by similarity.
+    Returns dicts with a `score` (0..1, 1 = substring match).
+    """
+    q = q.strip().lower()
+    if not q:
+        return []
+    params = {"user_id": user_id, "q": q, "pattern": _like_pattern(q)}
+
+    if IS_POSTGRES:
+        params["limit"] = limit
+        rows = db.execute(text(
+            f"""
+            SELECT d.doc_id, d.item_type, d.item_id, d.name,
+                   CASE WHEN lower(d.name) LIKE :pattern ESCAPE '\\' THEN 1.0
+                        ELSE word_similarity(:q, lower(d.name)) END AS score,
+                   {_NAME_COLUMNS}
+            FROM search_documents d
+            {_NAME_JOINS}
+            WHERE (lower(d.name) LIKE :pattern ESCAPE '\\' OR :q <% lower(d.name))
+              AND {_VISIBLE} AND {_LIVE}
+            ORDER BY score DESC, d.doc_id
+            LIMIT :limit
+            """
+        ), params).fetchall()
+        return [_with_score(row, float(row.score)) for row in rows]
+
+    if len(q) < 3:
+        # too short for trigrams: plain substring scan of the visible names
+        params["limit"] = limit
+        rows = db.execute(text(
+            f"""
+            SELECT d.doc_id, d.item_type, d.item_id, d.name, {_NAME_COLUMNS}
+            FROM search_documents d
+            {_NAME_JOINS}
+            WHERE lower(d.name) LIKE :pattern ESCAPE '\\' AND {_VISIBLE} AND {_LIVE}
+            ORDER BY d.name, d.doc_id
+            LIMIT :limit
+            """
+        ), params).fetchall()
+        return [_with_score(row, 1.0) for row in rows]
+
+    # only the visible owners' names are candidates. No bm25 ordering: its IDF is read
+    # from every user's doclists, which is the global cost the owner filter avoids
+    owners = " OR ".join('"' + _owner_key(u) + '"' for u in _visible_owners(db, user_id))
+    lookup = f"""
+        SELECT d.doc_id, d.item_type, d.item_id, d.name, {_NAME_COLUMNS}
+        FROM name_trgm
+        JOIN search_documents d ON d.doc_id = name_trgm.rowid
+        {_NAME_JOINS}
+        WHERE name_trgm MATCH :match AND {_VISIBLE} AND {_LIVE}
+    """
+    # a trigram phrase matches q as a substring
+    params["match"] = f'owner : ({owners}) AND name : "{q.replace(chr(34), chr(34) * 2)}"'
+    params["limit"] = limit
+    exact = db.execute(text(lookup + " ORDER BY d.name, d.doc_id LIMIT :limit"), params).fetchall()
+    results = [_with_score(row, 1.0) for row in exact]
+    if len(results) >= limit:
+        return results
+
+    # near misses: any shared trigram makes a candidate, newest first, scored here
+    grams = sorted({q[i:i + 3] for i in range(len(q) - 2)})
+    names = " OR ".join('"' + g.replace('"', '""') + '"' for g in grams)
+    params["match"] = f"owner : ({owners}) AND name : ({names})"
+    params["limit"] = SEARCH_FUZZY_CANDIDATES
+    candidates = db.execute(text(lookup + " ORDER BY name_trgm.rowid DESC LIMIT :limit"), params).fetchall()
+
+    found = {row.doc_id for row in exact}
+    scored = []
+    for row in candidates:
+        if row.doc_id not in found:
+            scored.append((name_similarity(q, row.name), row))
+    scored.sort(key=lambda pair: (-pair[0], pair[1].doc_id))
+    return results + [_with_score(row, score) for score, row in scored[:limit - len(results)] if score > 0]
+
+
+def _mark(name: str, q: str) -> str:
+    start = name.lower().find(q)
+    if start < 0:
+        return name
+    return f"{name[:start]}<mark>{name[start:start + len(q)]}</mark>{name[start + len(q):]}"
+
+
+def search_name_substrings(db, user_id: int, q: str, limit: int, parent_id: int = None, cursor=None):
+    """The user's own items whose name contains q but that search() does not return, as it
+    matches whole words and prefixes only ("voice" in "invoice_2023.txt"). Paged after
+    search()'s results by (name, doc_id); cursor is that pair of the last row seen.
+    Returns (dicts shaped like search() rows, with rank None and the match marked in the
+    snippet; next_cursor).
+    """
+    q = q.strip().lower()
+    if not q:
+        return [], None
+    params = {"user_id": user_id, "limit": limit + 1}
+    conditions = ["d.user_id = :user_id", _LIVE]
+    if parent_id is not None:
+        params["parent_id"] = parent_id
+        conditions.append("((d.item_type = 'file' AND f.parent_id = :parent_id) OR "
+                          "(d.item_type = 'folder' AND fo.parent_id = :parent_id))")
+    if IS_POSTGRES or len(q) < 3:
+        source = "search_documents d"
+        params["pattern"] = _like_pattern(q)
+        conditions.append("lower(d.name) LIKE :pattern ESCAPE '\\'")
+    else:
+        # a trigram phrase matches q as a substring, within this owner's names only
+        source = "name_trgm JOIN search_documents d ON d.doc_id = name_trgm.rowid"
+        params["match"] = f'owner : "{_owner_key(user_id)}" AND name : "{q.replace(chr(34), chr(34) * 2)}"'
+        conditions.append("name_trgm MATCH :match")
+    terms = _terms(q)
+    if terms:
+        # already listed by search()
+        params["q"] = _match_query(terms)
+        if IS_POSTGRES:
+            conditions.append("NOT (d.tsv @@ to_tsquery('simple', :q))")
+        else:
+            conditions.append("d.doc_id NOT IN (SELECT rowid FROM search_fts WHERE search_fts MATCH :q)")
+    if cursor is not None and cursor[1] is not None:
+        params["after_name"], params["after_id"] = cursor
+        conditions.append("(d.name > :after_name OR (d.name = :after_name AND d.doc_id > :after_id))")
+    rows = db.execute(text(
+        f"""
+        SELECT d.doc_id, d.item_type, d.item_id, d.name, {_NAME_COLUMNS}
+        FROM {source}
+        {_NAME_JOINS}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY d.name, d.doc_id
+        LIMIT :limit
+        """
+    ), params).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if rows:
+            next_cursor = encode_cursor("name", rows[-1].name, rows[-1].doc_id)
+        else:
+            # the page filled up exactly before this section
+            next_cursor = encode_cursor("name", *(cursor or (None, None)))
+    items = []
+    for row in rows:
+        item = dict(row._mapping)
+        item["rank"] = None
+        item["snippet"] = _mark(item.pop("name"), q)
+        items.append(item)
+    return items, next_cursor
+
+
+def _with_score(row, score: float):
+    item = dict(row._mapping)
+    item["score"] = round(score, 4)
+    return item
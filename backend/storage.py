@@ -0,0 +1,213 @@
+"""Storage drivers for file content.
+
+Blobs are addressed by key (their SHA-256 digest). STORAGE_BACKEND picks the driver:
+
+    local  sharded directory tree under BLOB_DIR (default)
+    s3     any S3-compatible service (AWS, MinIO, ...); needs boto3
+
+With STORAGE_REDIRECT=1 and a driver that can sign URLs, downloads answer with a
+redirect to a pre-signed URL instead of streaming the bytes through the API worker.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from contextlib import closing, contextmanager
+from urllib.parse import quote
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_REDIRECT = os.getenv("STORAGE_REDIRECT", "0") == "1"
+PRESIGNED_URL_TTL_SECONDS = int(os.getenv("PRESIGNED_URL_TTL_SECONDS", "300"))
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join("uploads", "blobs"))
+CHUNK_SIZE = 64 * 1024
+
+StorageStat = namedtuple("StorageStat", ["size", "mtime"])
+
+_HEX_KEY = re.compile(r"[0-9a-f]{8,}")
+
+
+class StorageDriver(ABC):
+    """Interface every driver implements. Keys are opaque strings."""
+
+    @abstractmethod
+    def put_file(self, key: str, path: str):
+        """Store a finished local file under key; the local file is consumed."""
+
+    @abstractmethod
+    def open(self, key: str):
+        """Readable binary stream of the whole object."""
+
+    @abstractmethod
+    def iter_range(self, key: str, start: int, end: int, chunk_size: int = CHUNK_SIZE):
+        """Yield bytes start..end (inclusive)."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove the object; a missing object is not an error."""
+
+    @abstractmethod
+    def stat(self, key: str):
+        """StorageStat, or None when the object does not exist."""
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def local_path(self, key: str):
+        """Path on this host's disk, when the driver has one (lets downloads use sendfile)."""
+        return None
+
+    def presigned_url(self, key: str, filename: str = None):
+        return None
+
+    @abstractmethod
+    def describe(self, key: str) -> str:
+        """Location recorded in files.file_path, for operators."""
+
+
+class LocalDriver(StorageDriver):
+    """Objects under root/ab/cd/<key>; the two-level prefix keeps directories small."""
+
+    def __init__(self, root: str = BLOB_DIR):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        prefix = key if _HEX_KEY.fullmatch(key) else hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.root, prefix[:2], prefix[2:4], key)
+
+    def put_file(self, key, path):
+        dest = self._path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # a rename when staging and root share a filesystem, a copy otherwise
+        shutil.move(path, dest)
+
+    def open(self, key):
+        return open(self._path(key), "rb")
+
+    def iter_range(self, key, start, end, chunk_size=CHUNK_SIZE):
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = f.read(min(chunk_size, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def stat(self, key):
+        try:
+            st = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return StorageStat(st.st_size, st.st_mtime)
+
+    def local_path(self, key):
+        return self._path(key)
+
+    def describe(self, key):
+        return self._path(key)
+
+
+class S3Driver(StorageDriver):
+    """S3-compatible object storage. Configure with S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL
+    (for MinIO and friends), S3_REGION and the usual AWS_* credentials.
+    """
+
+    def __init__(self, bucket: str = None, prefix: str = None, endpoint_url: str = None, region: str = None):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)") from e
+        self.bucket = bucket or os.getenv("S3_BUCKET")
+        if not self.bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        self.prefix = (prefix if prefix is not None else os.getenv("S3_PREFIX", "blobs/")).lstrip("/")
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or os.getenv("S3_ENDPOINT_URL") or None,
+            region_name=region or os.getenv("S3_REGION") or None,
+        )
+
+    def _key(self, key):
+        return f"{self.prefix}{key[:2]}/{key}"
+
+    def put_file(self, key, path):
+        # upload_file switches to multipart uploads for large files
+        self.client.upload_file(path, self.bucket, self._key(key))
+        os.remove(path)
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"]
+
+    def iter_range(self, key, start, end, chunk_size=CHUNK_SIZE):
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(key), Range=f"bytes={start}-{end}")["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def stat(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return StorageStat(head["ContentLength"], head["LastModified"].timestamp())
+
+    def presigned_url(self, key, filename=None):
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if filename:
+            params["ResponseContentDisposition"] = f"attachment; filename*=UTF-8''{quote(filename)}"
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=PRESIGNED_URL_TTL_SECONDS)
+
+    def describe(self, key):
+        return f"s3://{self.bucket}/{self._key(key)}"
+
+
+_DRIVERS = {"local": LocalDriver, "s3": S3Driver}
+_storage = None
+
+
+def get_storage() -> StorageDriver:
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND not in _DRIVERS:
+            raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+        _storage = _DRIVERS[STORAGE_BACKEND]()
+    return _storage
+
+
+@contextmanager
+def local_copy(key: str, storage: StorageDriver = None):
+    """A local path holding the object, for libraries that need a real file (pypdf, docx, ...).
+    Remote objects are downloaded to a temp file that is removed afterwards.
+    """
+    storage = storage or get_storage()
+    path = storage.local_path(key)
+    if path is not None:
+        yield path
+        return
+    fd, temp_path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, "wb") as out, closing(storage.open(key)) as src:
+            shutil.copyfileobj(src, out, CHUNK_SIZE)
+        yield temp_path
+    finally:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
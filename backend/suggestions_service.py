@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta
 from sqlalchemy import text
+from database import sql_date
 
 A_UPLOAD = "UPLOAD"
 A_DOWNLOAD = "DOWNLOAD"
@@ -81,10 +82,10 @@ def generate_suggestions(db, user_id: int):
 
     try:
         rows = db.execute(text(
-            """
+            f"""
             SELECT file_id, COUNT(*) AS cnt
             FROM user_activity
-            WHERE user_id = :uid AND action = :act AND date(timestamp) = date('now') AND file_id IS NOT NULL
+            WHERE user_id = :uid AND action = :act AND {sql_date('timestamp')} = CURRENT_DATE AND file_id IS NOT NULL
             GROUP BY file_id
             HAVING COUNT(*) >= 3
             """
@@ -0,0 +1,78 @@
+"""Shared fixtures: the app on a throwaway SQLite database, or on the database in
+TEST_DATABASE_URL (test_postgres_matrix.py sets it to rerun the suite on PostgreSQL).
+
+Run from backend/:  pip install -r requirements-dev.txt && python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+# configure before the app (and database.py) is imported
+_WORKDIR = tempfile.mkdtemp(prefix="fs-tests-")
+os.chdir(_WORKDIR)  # uploads/ and the blob store are relative to the working directory
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{os.path.join(_WORKDIR, 'test.db')}"
+os.environ.setdefault("JWT_SECRET", "test-secret-with-enough-bytes-for-hs256")
+os.environ["AUTO_MIGRATE"] = "1"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import app as app_module
+from database import engine
+
+
+@pytest.fixture(scope="session")
+def client():
+    # not entered as a context manager: the scheduler and the log writer stay off,
+    # so activity logs are written inline
+    return TestClient(app_module.app)
+
+
+@pytest.fixture
+def make_user(client):
+    """Sign up and log in a fresh user; returns (auth headers, email)."""
+    def make():
+        email = f"{uuid.uuid4().hex[:10]}@example.com"
+        r = client.post("/auth/signup", json={"username": email.split("@")[0], "password": "pw123456", "email": email})
+        assert r.status_code == 200, r.text
+        r = client.post("/auth/login", data={"username": email, "password": "pw123456"})
+        assert r.status_code == 200, r.text
+        return {"Authorization": "Bearer " + r.json()["access_token"]}, email
+    return make
+
+
+@pytest.fixture
+def db():
+    with engine.connect() as conn:
+        yield conn
+
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements run on the engine inside the block."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def create_folder(client, headers, name, parent_id=0):
+    r = client.post("/folders/create_folder", data={"folder_name": name, "parent_id": parent_id}, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()["folder"]["folder_id"]
+
+
+def upload(client, headers, name, data, parent_id=0):
+    r = client.post("/files/upload_file", data={"parent_id": parent_id}, files={"file": (name, data)}, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()["file"]["file_id"]
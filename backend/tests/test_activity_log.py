@@ -0,0 +1,66 @@
+import logging
+import threading
+import uuid
+
+from sqlalchemy import text
+
+from activity_log import ActivityLogWriter, make_event
+
+
+def _count(db, marker):
+    db.rollback()
+    return db.execute(text("SELECT COUNT(*) FROM activity_logs WHERE details = :d"), {"d": marker}).scalar()
+
+
+def test_writer_batches_and_flushes_on_stop(make_user, db):
+    make_user()
+    user_id = db.execute(text("SELECT MAX(user_id) FROM users")).scalar()
+    marker = uuid.uuid4().hex
+    writer = ActivityLogWriter(batch_size=50, interval=0.05)
+    writer.start()
+    for _ in range(230):
+        assert writer.submit(make_event(user_id, "upload", "file", 1, marker))
+    writer.stop()
+    assert not writer.running
+    assert _count(db, marker) == 230
+    stats = writer.stats()
+    assert stats["enqueued"] == stats["written"] == 230
+    assert stats["failed"] == stats["failed_batches"] == stats["dropped"] == 0
+    assert stats["batches"] >= 230 // 50
+
+
+def test_failed_batches_are_logged_and_counted(make_user, db, monkeypatch, caplog):
+    make_user()
+    user_id = db.execute(text("SELECT MAX(user_id) FROM users")).scalar()
+    writer = ActivityLogWriter(batch_size=10, interval=0.05)
+
+    def broken(conn, events):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(writer.resolver, "rows", broken)
+    with caplog.at_level(logging.ERROR, logger="activity_log"):
+        writer.start()
+        for _ in range(25):
+            writer.submit(make_event(user_id, "upload", details="lost"))
+        writer.stop()
+    stats = writer.stats()
+    assert stats["failed"] == 25 and stats["failed_batches"] >= 3 and stats["written"] == 0
+    assert any("database went away" in (r.exc_text or "") for r in caplog.records)
+
+
+def test_counters_hold_under_contention():
+    writer = ActivityLogWriter(maxsize=100)  # not started: the queue fills, then drops
+    event = make_event(1, "upload")
+
+    def submit_many():
+        for _ in range(2000):
+            writer.submit(event)
+
+    threads = [threading.Thread(target=submit_many) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = writer.stats()
+    assert stats["enqueued"] == 100
+    assert stats["enqueued"] + stats["dropped"] == 8 * 2000
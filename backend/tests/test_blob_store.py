@@ -0,0 +1,47 @@
+import os
+from datetime import datetime
+
+from sqlalchemy import text
+
+import blob_store
+from storage import get_storage
+
+
+def _legacy_file(db, user_id, name, data):
+    os.makedirs(f"uploads/user_{user_id}", exist_ok=True)
+    path = f"uploads/user_{user_id}/{name}"
+    with open(path, "wb") as f:
+        f.write(data)
+    file_id = db.execute(text(
+        """
+        INSERT INTO files (file_name, parent_id, file_path, user_id, created_at, updated_at, file_size, status)
+        VALUES (:name, 0, :path, :user_id, :now, :now, :size, 'not_deleted')
+        RETURNING file_id
+        """
+    ), {"name": name, "path": path, "user_id": user_id, "now": datetime.now(), "size": len(data)}).scalar()
+    db.commit()
+    return file_id, path
+
+
+def test_legacy_file_survives_failed_migration(client, make_user, db, monkeypatch):
+    make_user()
+    user_id = db.execute(text("SELECT MAX(user_id) FROM users")).scalar()
+    file_id, path = _legacy_file(db, user_id, "old.txt", b"legacy bytes")
+    real_acquire = blob_store.acquire_blob
+
+    def acquire_then_fail(*args, **kwargs):
+        real_acquire(*args, **kwargs)
+        raise RuntimeError("commit never happens")
+
+    monkeypatch.setattr(blob_store, "acquire_blob", acquire_then_fail)
+    assert blob_store.migrate_legacy_files(db) == 0
+    assert os.path.exists(path)
+    db.rollback()
+    assert db.execute(text("SELECT blob_digest FROM files WHERE file_id = :f"), {"f": file_id}).scalar() is None
+
+    monkeypatch.undo()
+    assert blob_store.migrate_legacy_files(db) == 1
+    assert not os.path.exists(path)
+    digest = db.execute(text("SELECT blob_digest FROM files WHERE file_id = :f"), {"f": file_id}).scalar()
+    with get_storage().open(digest) as f:
+        assert f.read() == b"legacy bytes"
@@ -0,0 +1,47 @@
+from sqlalchemy import text
+
+from conftest import create_folder, upload
+from folder_tree import verify_folder_stats
+
+
+def _total_bytes(db, folder_id):
+    return db.execute(text("SELECT COALESCE(SUM(total_bytes), 0) FROM folder_stats WHERE folder_id = :f"),
+                      {"f": folder_id}).scalar()
+
+
+def test_bulk_delete_of_nested_selection_keeps_ancestor_rollup(client, make_user, db):
+    user, _ = make_user()
+    r = create_folder(client, user, "R")
+    a = create_folder(client, user, "A", r)
+    b = create_folder(client, user, "B", a)
+    upload(client, user, "r.bin", b"r" * 1000, r)
+    upload(client, user, "a.bin", b"a" * 100, a)
+    upload(client, user, "b.bin", b"b" * 10, b)
+    assert _total_bytes(db, r) == 1110
+
+    resp = client.post("/folders/bulk_delete", data={"folder_ids": [a, b]}, headers=user)
+    assert resp.status_code == 200, resp.text
+    db.rollback()
+    assert _total_bytes(db, r) == 1000
+    assert verify_folder_stats(db)["ok"]
+
+
+def test_quota_breakdown_counts_only_the_callers_files(client, make_user, db):
+    owner, _ = make_user()
+    editor, editor_email = make_user()
+    shared = create_folder(client, owner, "team")
+    inner = create_folder(client, owner, "inner", shared)
+    r = client.post("/shares/share_link", data={"folder_id": shared, "emails": [editor_email], "permission": "edit"},
+                    headers=owner)
+    assert r.status_code == 200, r.text
+    upload(client, owner, "mine.bin", b"o" * 300, inner)
+    upload(client, editor, "theirs.bin", b"e" * 70, inner)
+
+    summary = client.get("/files/storage/summary", headers=owner).json()
+    assert {f["folder_id"]: f["bytes"] for f in summary["by_folder"]}[shared] == 300
+    breakdown = client.get("/files/storage/folder_breakdown", params={"folder_id": shared}, headers=owner).json()
+    assert {c["folder_id"]: c["bytes"] for c in breakdown["children"] if "count" not in c}[inner] == 300
+
+    db.rollback()
+    assert _total_bytes(db, shared) == 370
+    assert verify_folder_stats(db)["ok"]
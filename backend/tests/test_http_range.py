@@ -0,0 +1,35 @@
+import logging
+import uuid
+
+import http_range
+from conftest import upload
+
+
+def _download(client, headers, file_id, **extra):
+    return client.get(f"/files/download_file/{file_id}", headers={**headers, **extra})
+
+
+def test_sendfile_mode_warns_once_without_zerocopy(client, make_user, monkeypatch, caplog):
+    me, _ = make_user()
+    data = b"0123456789" * 1000
+    file_id = upload(client, me, f"{uuid.uuid4().hex}.bin", data)
+    monkeypatch.setattr(http_range, "SENDFILE_MODE", "sendfile")
+    monkeypatch.setattr(http_range, "_zerocopy_checked", False)
+
+    with caplog.at_level(logging.WARNING, logger="http_range"):
+        r = _download(client, me, file_id)
+        assert r.status_code == 200 and r.content == data
+        r = _download(client, me, file_id, Range="bytes=10-19")
+        assert r.status_code == 206 and r.content == data[10:20]
+    warnings = [rec for rec in caplog.records if "zerocopysend" in rec.getMessage()]
+    assert len(warnings) == 1
+
+
+def test_stream_mode_is_quiet(client, make_user, monkeypatch, caplog):
+    me, _ = make_user()
+    file_id = upload(client, me, f"{uuid.uuid4().hex}.bin", b"quiet")
+    monkeypatch.setattr(http_range, "SENDFILE_MODE", "stream")
+    monkeypatch.setattr(http_range, "_zerocopy_checked", False)
+    with caplog.at_level(logging.WARNING, logger="http_range"):
+        assert _download(client, me, file_id).content == b"quiet"
+    assert not caplog.records
@@ -0,0 +1,140 @@
+import csv
+import gzip
+import io
+import json
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from conftest import count_queries
+from database import engine
+from log_retention import archive_old_logs, archive_tables, drop_expired_archives, roll_up_daily
+
+DAYS = 150
+RETENTION_DAYS = 30
+
+
+@pytest.fixture(scope="module")
+def archived(client):
+    """A user with three events a day over DAYS days, rolled up and archived past
+    RETENTION_DAYS. Returns (headers, user_id, every log row newest first, raw daily counts)."""
+    email = f"logs-{uuid.uuid4().hex[:10]}@example.com"
+    r = client.post("/auth/signup", json={"username": email.split("@")[0], "password": "pw123456", "email": email})
+    assert r.status_code == 200, r.text
+    r = client.post("/auth/login", data={"username": email, "password": "pw123456"})
+    headers = {"Authorization": "Bearer " + r.json()["access_token"]}
+
+    with engine.connect() as db:
+        user_id = db.execute(text("SELECT user_id FROM users WHERE email = :e"), {"e": email}).scalar()
+        now = datetime.now().replace(microsecond=0)
+        events = []
+        for day in range(DAYS):
+            for i, action in enumerate(("upload", "download", "upload")):
+                events.append({"user_id": user_id, "action": action, "resource_type": "file", "resource_id": day,
+                               "details": f"d{day}-{i}", "created_at": now - timedelta(days=day, minutes=i)})
+        db.execute(text(
+            """
+            INSERT INTO activity_logs (user_id, action, resource_type, resource_id, details, created_at)
+            VALUES (:user_id, :action, :resource_type, :resource_id, :details, :created_at)
+            """
+        ), events)
+        db.commit()
+        rows = db.execute(text(
+            "SELECT log_id, action, created_at FROM activity_logs WHERE user_id = :u ORDER BY created_at DESC, log_id DESC"
+        ), {"u": user_id}).fetchall()
+        daily = Counter((str(r.created_at)[:10], r.action) for r in rows)
+
+        roll_up_daily(db)
+        moved = archive_old_logs(db, retention_days=RETENTION_DAYS, batch_size=50)
+        assert moved >= (DAYS - RETENTION_DAYS - 1) * 3
+        assert archive_tables(db)
+    return headers, user_id, rows, daily
+
+
+def _pages(client, headers, limit, **params):
+    ids, cursor = [], None
+    while True:
+        query = {"limit": limit, **params}
+        if cursor:
+            query["cursor"] = cursor
+        r = client.get("/logs/me", params=query, headers=headers)
+        assert r.status_code == 200, r.text
+        ids += [log["log_id"] for log in r.json()["logs"]]
+        cursor = r.json()["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+def test_cursor_paging_crosses_the_archive_boundary(client, archived):
+    headers, _, rows, _ = archived
+    expected = [r.log_id for r in rows]
+    for limit in (7, 50):
+        ids = _pages(client, headers, limit)
+        assert ids == expected  # no duplicates, no gaps, newest first
+
+
+def test_daily_counts_match_raw_counts_after_archiving(client, archived, db):
+    headers, user_id, _, daily = archived
+    hot = db.execute(text("SELECT COUNT(*) FROM activity_logs WHERE user_id = :u"), {"u": user_id}).scalar()
+    assert hot < sum(daily.values())  # most rows only survive in the archives
+    r = client.get("/logs/me/daily", headers=headers)
+    assert r.status_code == 200, r.text
+    assert Counter({(d["date"], d["action"]): d["count"] for d in r.json()["days"]}) == daily
+
+    r = client.get("/logs/me/daily", params={"action": "download"}, headers=headers)
+    assert {(d["date"], d["action"]): d["count"] for d in r.json()["days"]} == {
+        key: n for key, n in daily.items() if key[1] == "download"
+    }
+
+
+def test_date_filters_prune_archive_tables(client, archived, db):
+    headers, _, rows, _ = archived
+    today = date.today()
+    recent = today - timedelta(days=5)
+    with count_queries() as statements:
+        ids = _pages(client, headers, 100, start_date=recent.isoformat())
+    assert not [s for s in statements if "activity_logs_2" in s]
+    assert ids == [r.log_id for r in rows if str(r.created_at)[:10] >= recent.isoformat()]
+
+    old_day = today - timedelta(days=DAYS - 10)
+    start = datetime.combine(old_day, datetime.min.time())
+    tables = archive_tables(db, start, start + timedelta(days=1))
+    assert tables == [f"activity_logs_{old_day:%Y%m}"]
+    with count_queries() as statements:
+        ids = _pages(client, headers, 100, start_date=old_day.isoformat(), end_date=old_day.isoformat())
+    assert [r.log_id for r in rows if str(r.created_at)[:10] == old_day.isoformat()] == ids and len(ids) == 3
+    queried = {t for s in statements for t in archive_tables(db) if t in s}
+    assert queried == set(tables)
+
+
+def test_export_streams_every_row(client, archived):
+    headers, _, rows, _ = archived
+    r = client.get("/logs/me/export", params={"format": "ndjson", "gzip": True}, headers=headers)
+    assert r.status_code == 200, r.text
+    lines = gzip.decompress(r.content).decode().splitlines()
+    assert [json.loads(line)["log_id"] for line in lines] == [row.log_id for row in rows]
+
+    r = client.get("/logs/me/export", headers=headers)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/csv")
+    table = list(csv.reader(io.StringIO(r.text)))
+    assert table[0][0] == "Log ID"
+    assert [int(line[0]) for line in table[1:]] == [row.log_id for row in rows]
+
+
+def test_drop_expired_archives(archived, db):
+    months = archive_tables(db)
+    assert len(months) >= 4
+    dropped = drop_expired_archives(db, keep_months=3)
+    assert dropped == months[len(months) - len(dropped):] and dropped
+    remaining = archive_tables(db)
+    assert remaining == months[:len(months) - len(dropped)]
+    oldest_kept = date.today().replace(day=1)
+    for _ in range(2):
+        oldest_kept = (oldest_kept - timedelta(days=1)).replace(day=1)
+    assert all(t >= f"activity_logs_{oldest_kept:%Y%m}" for t in remaining)
+    for table in dropped:
+        assert db.execute(text("SELECT COUNT(*) FROM activity_log_archives WHERE table_name = :t"),
+                          {"t": table}).scalar() == 0
@@ -0,0 +1,67 @@
+"""Backend matrix: the suite runs in-process on SQLite; this reruns it on PostgreSQL.
+
+PostgreSQL comes from TEST_POSTGRES_URL (a scratch database: the tests write to it)
+or, when initdb and pg_ctl are on PATH, a throwaway cluster started for the run.
+Without either, or without psycopg2, the PostgreSQL leg is skipped.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+from database import IS_POSTGRES
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def _embedded_postgres():
+    """A trust-auth cluster in a temp dir, listening on a unix socket only."""
+    data_dir = tempfile.mkdtemp(prefix="fs-pg-")
+    port = _free_port()
+    subprocess.run(["initdb", "-D", data_dir, "-U", "postgres", "-A", "trust"],
+                   check=True, capture_output=True)
+    subprocess.run(["pg_ctl", "-D", data_dir, "-w", "-l", os.path.join(data_dir, "server.log"),
+                    "-o", f"-k {data_dir} -p {port} -h ''", "start"], check=True, capture_output=True)
+    try:
+        yield f"postgresql://postgres@/postgres?host={data_dir}&port={port}"
+    finally:
+        subprocess.run(["pg_ctl", "-D", data_dir, "-m", "fast", "stop"], capture_output=True)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+@contextmanager
+def _postgres_url():
+    url = os.getenv("TEST_POSTGRES_URL")
+    if url:
+        yield url
+    elif shutil.which("initdb") and shutil.which("pg_ctl"):
+        with _embedded_postgres() as url:
+            yield url
+    else:
+        yield None
+
+
+@pytest.mark.skipif(IS_POSTGRES, reason="this run already is the PostgreSQL leg")
+def test_suite_on_postgres():
+    pytest.importorskip("psycopg2")
+    with _postgres_url() as url:
+        if url is None:
+            pytest.skip("no PostgreSQL: set TEST_POSTGRES_URL or put initdb and pg_ctl on PATH")
+        result = subprocess.run(
+            [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", TESTS_DIR],
+            cwd=os.path.dirname(TESTS_DIR), env={**os.environ, "TEST_DATABASE_URL": url},
+            capture_output=True, text=True,
+        )
+    assert result.returncode == 0, result.stdout[-5000:] + result.stderr[-2000:]
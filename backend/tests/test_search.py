@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy import text
+
+from conftest import create_folder, upload
+from database import IS_POSTGRES
+from search_index import _OWNER_KEY_BASE, _OWNER_KEY_SQL, _owner_key
+
+
+def _names(client, headers, q):
+    r = client.get("/search/names", params={"q": q}, headers=headers)
+    assert r.status_code == 200, r.text
+    return sorted(f["file_name"] for f in r.json()["files"])
+
+
+def test_name_lookup_sees_own_and_shared_names_only(client, make_user):
+    me, my_email = make_user()
+    stranger, _ = make_user()
+    sharer, _ = make_user()
+    upload(client, me, "ledger_mine.txt", b"a")
+    upload(client, stranger, "ledger_theirs.txt", b"b")
+    folder_id = create_folder(client, sharer, "shared-ledgers")
+    upload(client, sharer, "ledger_shared.txt", b"c", parent_id=folder_id)
+    r = client.post("/shares/share_link", headers=sharer, data={
+        "folder_id": folder_id, "emails": my_email, "permission": "view", "is_public": False,
+    })
+    assert r.status_code == 200, r.text
+
+    assert _names(client, me, "ledger") == ["ledger_mine.txt", "ledger_shared.txt"]
+    assert _names(client, me, "ledgr") == ["ledger_mine.txt", "ledger_shared.txt"]  # typo, trigram path
+    assert _names(client, stranger, "ledger") == ["ledger_theirs.txt"]
+
+
+@pytest.mark.skipif(IS_POSTGRES, reason="owner keys are SQLite-only")
+def test_owner_key_matches_sql(db):
+    for user_id in (0, 1, 2047, 2048, 123456789):
+        sql = _OWNER_KEY_SQL.format(base=_OWNER_KEY_BASE).replace("user_id", ":u")
+        assert db.execute(text(f"SELECT {sql}"), {"u": user_id}).scalar() == _owner_key(user_id)
+
+
+def test_item_search_falls_back_to_name_substrings(client, make_user):
+    me, _ = make_user()
+    other, _ = make_user()
+    folder_id = create_folder(client, me, "bills")
+    upload(client, me, "invoice_2023.txt", b"a", parent_id=folder_id)
+    upload(client, me, "voice memo.txt", b"b")
+    upload(client, other, "invoice_other.txt", b"c")
+
+    def files(**params):
+        r = client.get("/search/items", params=params, headers=me)
+        assert r.status_code == 200, r.text
+        return [(f["file_name"], f["rank"] is None) for f in r.json()["files"]]
+
+    # the word match ranks first, the substring-only match follows
+    assert files(q="voice") == [("voice memo.txt", False), ("invoice_2023.txt", True)]
+    assert files(q="voice", parent_id=folder_id) == [("invoice_2023.txt", True)]
+    assert files(q="vo") == [("voice memo.txt", False), ("invoice_2023.txt", True)]
+
+
+def test_item_search_pages_through_word_then_substring_matches(client, make_user):
+    me, _ = make_user()
+    for name in ("voice a.txt", "voice b.txt", "voice c.txt", "invoice.txt", "invoiced.txt"):
+        upload(client, me, name, b"x")
+
+    def pages(limit):
+        names, cursor = [], None
+        while True:
+            params = {"q": "voice", "limit": limit}
+            if cursor:
+                params["cursor"] = cursor
+            r = client.get("/search/items", params=params, headers=me)
+            assert r.status_code == 200, r.text
+            body = r.json()
+            assert len(body["files"]) <= limit
+            names += [f["file_name"] for f in body["files"]]
+            cursor = body["next_cursor"]
+            if cursor is None:
+                return names
+
+    everything = pages(10)
+    assert sorted(everything[:3]) == ["voice a.txt", "voice b.txt", "voice c.txt"]
+    assert everything[3:] == ["invoice.txt", "invoiced.txt"]
+    for limit in (1, 2, 3, 4):
+        assert pages(limit) == everything
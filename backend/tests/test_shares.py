@@ -0,0 +1,125 @@
+import uuid
+
+from sqlalchemy import text
+
+from conftest import count_queries, create_folder, upload
+from utils import check_permission, filter_permitted
+
+
+def _share(client, headers, folder_id, emails, is_public=False):
+    r = client.post("/shares/share_link", headers=headers, data={
+        "folder_id": folder_id, "emails": emails, "permission": "view", "is_public": is_public,
+    })
+    assert r.status_code == 200, r.text
+
+
+def _query_counts(client, owner, recipient, recipient_email, sizes):
+    counts = []
+    folder_id = create_folder(client, owner, "shared-root")
+    shared = 0
+    client.get("/shares/shared_with_me", headers=recipient)  # warm the per-user caches
+    for n in sizes:
+        while shared < n:
+            _share(client, owner, create_folder(client, owner, f"s{shared}", folder_id), [recipient_email])
+            _share(client, owner, folder_id, [recipient_email])
+            shared += 1
+        with count_queries() as details:
+            r = client.get("/shares/share_details", params={"folder_id": folder_id})
+        assert r.status_code == 200 and len(r.json()["shares"]) == n
+        with count_queries() as swm:
+            r = client.get("/shares/shared_with_me", headers=recipient)
+        assert r.status_code == 200 and len(r.json()["folders"]) == 2 * n
+        counts.append((len(details), len(swm)))
+    return counts
+
+
+def test_share_listings_use_constant_queries(client, make_user):
+    owner, _ = make_user()
+    recipient, recipient_email = make_user()
+    counts = _query_counts(client, owner, recipient, recipient_email, [1, 5, 25])
+    assert len(set(counts)) == 1, counts
+
+
+def test_share_details_recipients_and_paging(client, make_user):
+    owner, _ = make_user()
+    _, email = make_user()
+    folder_id = create_folder(client, owner, "paged")
+    for _ in range(5):
+        _share(client, owner, folder_id, [email, email, "nobody@example.com"])
+    _share(client, owner, folder_id, [email], is_public=True)
+
+    ids, cursor = [], None
+    while True:
+        params = {"folder_id": folder_id, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/shares/share_details", params=params).json()
+        ids += [s["share_id"] for s in page["shares"]]
+        for s in page["shares"]:
+            if s["is_public"]:
+                assert s["users"] == "Anyone with the link"
+            else:
+                assert [u["email"] for u in s["users"]] == [email]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert len(ids) == 6 and ids == sorted(ids)
+
+
+def test_public_share_shows_for_named_recipient(client, make_user):
+    owner, _ = make_user()
+    recipient, email = make_user()
+    folder_id = create_folder(client, owner, "public")
+    _share(client, owner, folder_id, [email], is_public=True)
+    folders = client.get("/shares/shared_with_me", headers=recipient).json()["folders"]
+    assert [(f["folder_id"], f["is_public"]) for f in folders] == [(folder_id, True)]
+
+
+def _edit_share(client, owner, email, is_public, **item):
+    r = client.post("/shares/share_link", headers=owner, data={
+        **item, "emails": [email], "permission": "edit", "is_public": is_public,
+    })
+    assert r.status_code == 200, r.text
+
+
+def _access(db, user_id, folder_id, file_id):
+    """(view, edit) on the folder and on the file, through check_permission and filter_permitted."""
+    result = []
+    for operation in ("view", "edit"):
+        single = (check_permission(db, user_id, folder_id=folder_id, operation=operation),
+                  check_permission(db, user_id, file_id=file_id, operation=operation))
+        folders, files = filter_permitted(db, user_id, folder_ids=[folder_id], file_ids=[file_id], operation=operation)
+        assert single == (folders == [folder_id], files == [file_id])
+        result.append(single)
+    return result
+
+
+def _user_id(db, email):
+    return db.execute(text("SELECT user_id FROM users WHERE email = :email"), {"email": email}).scalar()
+
+
+def test_public_edit_share_gives_named_recipients_view_only(client, make_user, db):
+    owner, _ = make_user()
+    recipient, email = make_user()
+    folder_id = create_folder(client, owner, "public-edit")
+    file_id = upload(client, owner, f"{uuid.uuid4().hex}.txt", b"x")
+    _edit_share(client, owner, email, True, folder_id=folder_id)
+    _edit_share(client, owner, email, True, file_id=file_id)
+
+    shared = client.get("/shares/shared_with_me", headers=recipient).json()
+    assert [f["folder_id"] for f in shared["folders"]] == [folder_id]
+    assert [f["file_id"] for f in shared["files"]] == [file_id]
+    assert _access(db, _user_id(db, email), folder_id, file_id) == [(True, True), (False, False)]
+    r = client.put("/folders/folder_rename", headers=recipient, data={"folder_id": folder_id, "folder_name": "taken", "parent_id": 0})
+    assert r.status_code == 400 and "permission" in r.json()["detail"]
+
+
+def test_private_edit_share_gives_named_recipients_edit(client, make_user, db):
+    owner, _ = make_user()
+    recipient, email = make_user()
+    folder_id = create_folder(client, owner, "private-edit")
+    file_id = upload(client, owner, f"{uuid.uuid4().hex}.txt", b"y")
+    _edit_share(client, owner, email, False, folder_id=folder_id)
+    _edit_share(client, owner, email, False, file_id=file_id)
+
+    assert _access(db, _user_id(db, email), folder_id, file_id) == [(True, True), (True, True)]
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import schedular
+from routes import uploads
+from routes.uploads import _finish_chunk
+
+
+def _start(client, headers, name, data):
+    r = client.post("/uploads", data={"file_name": name, "total_size": len(data)}, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()["upload_id"]
+
+
+def _put(client, headers, upload_id, data):
+    return client.put(f"/uploads/{upload_id}/chunks/0", content=data, headers=headers)
+
+
+def _session(db, upload_id):
+    db.rollback()
+    return db.execute(text("SELECT status, chunks_in_flight FROM upload_sessions WHERE upload_id = :u"),
+                      {"u": upload_id}).fetchone()
+
+
+def test_chunk_rejected_once_finalize_claimed(client, make_user, db):
+    headers, _ = make_user()
+    upload_id = _start(client, headers, "late.txt", b"late chunk")
+    db.execute(text("UPDATE upload_sessions SET status = 'finalizing' WHERE upload_id = :u"), {"u": upload_id})
+    db.commit()
+    assert _put(client, headers, upload_id, b"late chunk").status_code == 409
+    assert _session(db, upload_id).chunks_in_flight == 0
+
+
+def test_finalize_retries_while_chunks_in_flight(client, make_user, db):
+    headers, _ = make_user()
+    data = b"in flight"
+    upload_id = _start(client, headers, "wait.txt", data)
+    assert _put(client, headers, upload_id, data).status_code == 200
+    db.execute(text("UPDATE upload_sessions SET chunks_in_flight = 1 WHERE upload_id = :u"), {"u": upload_id})
+    db.commit()
+    r = client.post(f"/uploads/{upload_id}/complete", headers=headers)
+    assert r.status_code == 409
+    assert r.headers["retry-after"] == str(uploads.UPLOAD_FINALIZE_RETRY_SECONDS)
+    assert _session(db, upload_id).status == "open"
+
+    _finish_chunk(db, upload_id)
+    r = client.post(f"/uploads/{upload_id}/complete", headers=headers)
+    assert r.status_code == 200, r.text
+
+
+def test_failed_finalize_reopens_session(client, make_user, db, monkeypatch):
+    headers, _ = make_user()
+    data = b"retry me"
+    upload_id = _start(client, headers, "retry.txt", data)
+    assert _put(client, headers, upload_id, data).status_code == 200
+
+    def broken(path):
+        raise OSError("disk went away")
+
+    monkeypatch.setattr(uploads, "hash_file", broken)
+    assert client.post(f"/uploads/{upload_id}/complete", headers=headers).status_code == 500
+    assert _session(db, upload_id).status == "open"
+    monkeypatch.undo()
+    r = client.post(f"/uploads/{upload_id}/complete", headers=headers)
+    assert r.status_code == 200, r.text
+
+
+def test_chunk_not_recorded_for_removed_session(client, make_user, db):
+    headers, _ = make_user()
+    upload_id = _start(client, headers, "gone.txt", b"gone")
+    assert client.delete(f"/uploads/{upload_id}", headers=headers).status_code == 200
+    _finish_chunk(db, upload_id, 0, 4, "0" * 64)
+    db.rollback()
+    assert db.execute(text("SELECT COUNT(*) FROM upload_chunks WHERE upload_id = :u"), {"u": upload_id}).scalar() == 0
+
+
+def test_expiry_collects_stuck_finalizing_sessions(client, make_user, db):
+    headers, _ = make_user()
+    upload_id = _start(client, headers, "stuck.txt", b"stuck")
+    old = datetime.now() - timedelta(hours=schedular.UPLOAD_SESSION_TTL_HOURS + 1)
+    db.execute(text("UPDATE upload_sessions SET status = 'finalizing', updated_at = :t WHERE upload_id = :u"),
+               {"t": old, "u": upload_id})
+    db.commit()
+    schedular.expire_upload_sessions()
+    assert _session(db, upload_id) is None
@@ -0,0 +1,31 @@
+import io
+import zipfile
+
+import pytest
+
+from zip_stream import stream_zip
+
+
+@pytest.fixture
+def small_zip64_limit(monkeypatch):
+    # stand-in for the 2 GiB limit, so "large" remote entries stay small in tests
+    monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 1000)
+
+
+@pytest.mark.parametrize("size", [5000, None])
+def test_large_remote_entries_use_zip64(small_zip64_limit, size):
+    payload = b"z" * 5000
+    entries = [("big.bin", lambda: io.BytesIO(payload), size)]
+    archive = b"".join(stream_zip(entries, store=True))
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert zf.read("big.bin") == payload
+
+
+def test_local_and_remote_entries(tmp_path):
+    local = tmp_path / "a.txt"
+    local.write_bytes(b"hello" * 100)
+    entries = [("top/a.txt", str(local), 500), ("top/b.txt", lambda: io.BytesIO(b"remote"), 6),
+               ("top/gone.txt", str(tmp_path / "missing"), 1)]
+    with zipfile.ZipFile(io.BytesIO(b"".join(stream_zip(entries)))) as zf:
+        assert sorted(zf.namelist()) == ["top/a.txt", "top/b.txt"]
+        assert zf.read("top/b.txt") == b"remote" and zf.testzip() is None
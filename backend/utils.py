@@ -3,10 +3,16 @@ from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import HTTPException, status
 from passlib.context import CryptContext
-from database import engine
-from sqlalchemy import text
+from database import engine, DB_POOL_CAPACITY, DB_RESERVED_CONNECTIONS
+from starlette.concurrency import run_in_threadpool
+import anyio
+from permission_cache import permission_cache
+import activity_log
+from sqlalchemy import text, bindparam
 from dotenv import load_dotenv
 import os
+import hmac
+import hashlib
 
 load_dotenv()
 # ---------- Config ----------
@@ -33,6 +39,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     token = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return token
 
+def password_fingerprint(hashed_password: str) -> str:
+    """Short keyed digest of the stored hash; carried in tokens so a password change revokes them."""
+    return hmac.new((JWT_SECRET or "").encode(), (hashed_password or "").encode(), hashlib.sha256).hexdigest()[:16]
+
 def decode_access_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
@@ -43,126 +53,219 @@ def decode_access_token(token: str) -> dict:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
 
-def get_db():
+# Requests wait here, on the event loop, for one of the pool's connections. Waiting in
+# engine.connect() would hold a threadpool worker: a burst of requests filled the
+# threadpool with such waiters while the requests already holding connections waited
+# for a worker to run their endpoint, until the pool timeout failed them all.
+_request_connections = anyio.Semaphore(max(1, DB_POOL_CAPACITY - DB_RESERVED_CONNECTIONS))
+
+
+async def get_db():
+    async with _request_connections:
+        db = await run_in_threadpool(engine.connect)
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+
+
+def get_sync_db():
+    """get_db for code outside a request (scheduler jobs): db = next(gen), then next(gen) closes it."""
+    db = engine.connect()
     try:
-        db = engine.connect()
         yield db
     finally:
         db.close()
 
 def check_permission(db, user_id: int, folder_id: int = None, file_id: int = None, operation: str = 'view'):
+    """Effective permission of user_id on a file or folder, served from the
+    in-process permission cache when possible (see permission_cache.py).
+    """
+    if file_id:
+        key = (user_id, "file", file_id, operation)
+    else:
+        key = (user_id, "folder", folder_id, operation)
+
+    cached = permission_cache.get(key)
+    if cached is not None:
+        return cached
+
+    generation = permission_cache.generation()
+    allowed, deps = resolve_permission(db, user_id, folder_id=folder_id, file_id=file_id, operation=operation)
+    permission_cache.put(key, allowed, deps, generation)
+    return allowed
+
+
+def resolve_permission(db, user_id: int, folder_id: int = None, file_id: int = None, operation: str = 'view'):
+    """Uncached permission check. Returns (allowed, deps) where deps lists the
+    ("file"|"folder", id) resources the answer was derived from.
+    """
     # Check for file permissions
     if file_id:
         owner = db.execute(
             text("SELECT user_id, parent_id FROM files WHERE file_id = :file_id"),
             {"file_id": file_id}
         ).fetchone()
-        import logging
-        logger = logging.getLogger("uvicorn.error") 
-        
-        logger.info(f"File ID: {file_id}")
-        logger.info(f"Owner row: {owner}")
-        logger.info(f"User ID: {user_id}")
 
         if owner is None:
-            return False  # file doesn't exist
+            return False, []  # file doesn't exist
+
+        deps = [("file", file_id)]
 
         if str(owner[0]) == str(user_id):
-            return True  # user owns the file
+            return True, deps  # user owns the file
 
 
         # Check public share
         public = db.execute(
-            text("SELECT is_public FROM shares WHERE file_id = :file_id AND is_public = 1"),
+            text("SELECT is_public FROM shares WHERE file_id = :file_id AND is_public = TRUE"),
             {"file_id": file_id}
         ).fetchone()
         if public and operation == 'view':
-            return True
+            return True, deps
 
-        # Check explicit user share
+        # Check explicit user share; named recipients of a public share only view it, as above
         shares = db.execute(
             text("""
                 SELECT s.permission
                 FROM shares s
                 JOIN share_access sa ON s.share_id = sa.share_id
                 WHERE sa.user_id = :user_id AND s.file_id = :file_id
+                  AND COALESCE(s.is_public, FALSE) = FALSE
             """),
             {"user_id": user_id, "file_id": file_id}
         ).fetchone()
         if shares:
             if operation == "view" and shares.permission in ("view", "edit"):
-                return True
+                return True, deps
             if operation == "edit" and shares.permission == "edit":
-                return True
+                return True, deps
 
-        # Check parent folder recursively
+        # Check the parent folder chain
         if owner[1] not in (0, None):
-            return check_permission(db, user_id, folder_id=owner[1], operation=operation)
+            allowed, folder_deps = resolve_folder_chain_permission(db, user_id, owner[1], operation)
+            return allowed, deps + folder_deps
 
-        return False
+        return False, deps
 
     # Check for folder permissions
-    else:
-        owner = db.execute(
-            text("SELECT user_id, parent_id FROM folders WHERE folder_id = :folder_id"),
-            {"folder_id": folder_id}
-        ).fetchone()
+    return resolve_folder_chain_permission(db, user_id, folder_id, operation)
 
-        if owner is None:
-            return False  # folder doesn't exist
 
-        if owner[0] == user_id:
-            return True  
-        
+def resolve_folder_chain_permission(db, user_id: int, folder_id: int, operation: str = 'view'):
+    """Resolve access to a folder from the folder and all of its ancestors in one query.
+    Ancestors come from the folder_closure index, so no tree walk is needed.
+    Owning, a public share (view only, named recipients included) or an explicit share on
+    any level grants access.
+    """
+    rows = db.execute(
+        text("""
+            SELECT c.ancestor_id, f.user_id, s.is_public, s.permission, sa.user_id AS granted_to
+            FROM folder_closure c
+            JOIN folders f ON f.folder_id = c.ancestor_id
+            LEFT JOIN shares s ON s.folder_id = c.ancestor_id
+            LEFT JOIN share_access sa ON sa.share_id = s.share_id AND sa.user_id = :user_id
+            WHERE c.descendant_id = :folder_id
+        """),
+        {"user_id": user_id, "folder_id": folder_id}
+    ).fetchall()
 
-        # Check public share
-        public = db.execute(
-            text("SELECT is_public FROM shares WHERE folder_id = :folder_id AND is_public = 1"),
-            {"folder_id": folder_id}
-        ).fetchone()
-        if public and operation == 'view':
-            return True
+    if not rows:
+        return False, []  # folder doesn't exist
 
-        # Check explicit user share
-        shares = db.execute(
-            text("""
-                SELECT s.permission
-                FROM shares s
-                JOIN share_access sa ON s.share_id = sa.share_id
-                WHERE sa.user_id = :user_id AND s.folder_id = :folder_id
-            """),
-            {"user_id": user_id, "folder_id": folder_id}
-        ).fetchone()
-        if shares:
-            if operation == "view" and shares.permission in ("view", "edit"):
-                return True
-            if operation == "edit" and shares.permission == "edit":
-                return True
+    deps = list({("folder", r.ancestor_id) for r in rows})
 
-        if owner[1] not in (0, None):
-            return check_permission(db, user_id, folder_id=owner[1], operation=operation)
+    for r in rows:
+        if r.user_id == user_id:
+            return True, deps
+
+        if r.is_public and operation == 'view':
+            return True, deps
+
+        if r.granted_to is not None and not r.is_public:
+            if operation == "view" and r.permission in ("view", "edit"):
+                return True, deps
+            if operation == "edit" and r.permission == "edit":
+                return True, deps
+
+    return False, deps
+
+
+def _share_grants_clause(operation: str) -> str:
+    # shares s / share_access sa (joined for the current user) that grant `operation`;
+    # public shares grant view only, to named recipients too
+    if operation == 'edit':
+        return "(sa.user_id IS NOT NULL AND s.permission = 'edit' AND COALESCE(s.is_public, FALSE) = FALSE)"
+    return "(s.is_public = TRUE OR sa.user_id IS NOT NULL)"
+
+
+def filter_permitted(db, user_id: int, folder_ids=None, file_ids=None, operation: str = 'view'):
+    """Batched check_permission. Returns (permitted_folder_ids, permitted_file_ids),
+    keeping the input order. Cached answers are used first; the rest are resolved
+    with one query per resource type, joining each item's ancestors (folder_closure)
+    against shares and share_access.
+    """
+    folder_ids = list(folder_ids or [])
+    file_ids = list(file_ids or [])
+    allowed = {"folder": set(), "file": set()}
+    pending = {"folder": [], "file": []}
+
+    for rtype, ids in (("folder", folder_ids), ("file", file_ids)):
+        for rid in ids:
+            cached = permission_cache.get((user_id, rtype, rid, operation))
+            if cached is None:
+                pending[rtype].append(rid)
+            elif cached:
+                allowed[rtype].add(rid)
+
+    grants = _share_grants_clause(operation)
+    params = {"user_id": user_id}
+
+    if pending["folder"]:
+        rows = db.execute(text(f"""
+            SELECT DISTINCT c.descendant_id
+            FROM folder_closure c
+            JOIN folders f ON f.folder_id = c.ancestor_id
+            LEFT JOIN shares s ON s.folder_id = c.ancestor_id
+            LEFT JOIN share_access sa ON sa.share_id = s.share_id AND sa.user_id = :user_id
+            WHERE c.descendant_id IN :folder_ids
+              AND (f.user_id = :user_id OR {grants})
+        """).bindparams(bindparam("folder_ids", expanding=True)),
+            {**params, "folder_ids": pending["folder"]}).fetchall()
+        allowed["folder"].update(r[0] for r in rows)
+
+    if pending["file"]:
+        rows = db.execute(text(f"""
+            SELECT fi.file_id
+            FROM files fi
+            LEFT JOIN shares s ON s.file_id = fi.file_id
+            LEFT JOIN share_access sa ON sa.share_id = s.share_id AND sa.user_id = :user_id
+            WHERE fi.file_id IN :file_ids
+              AND (fi.user_id = :user_id OR {grants})
+            UNION
+            SELECT fi.file_id
+            FROM files fi
+            JOIN folder_closure c ON c.descendant_id = fi.parent_id
+            JOIN folders f ON f.folder_id = c.ancestor_id
+            LEFT JOIN shares s ON s.folder_id = c.ancestor_id
+            LEFT JOIN share_access sa ON sa.share_id = s.share_id AND sa.user_id = :user_id
+            WHERE fi.file_id IN :file_ids
+              AND (f.user_id = :user_id OR {grants})
+        """).bindparams(bindparam("file_ids", expanding=True)),
+            {**params, "file_ids": pending["file"]}).fetchall()
+        allowed["file"].update(r[0] for r in rows)
 
-        return False
+    return (
+        [i for i in folder_ids if i in allowed["folder"]],
+        [i for i in file_ids if i in allowed["file"]],
+    )
 
 
 def log_action(db, user_id: int, action: str, resource_type: str = None, resource_id: int = None, details: str = None, ip_address: str = None):
-    """Insert a log entry into activity_logs.
-    Expects an open DB connection from get_db().
+    """Record a log entry in activity_logs.
+    Queued for the batched writer when it is running, otherwise inserted on db (caller commits).
     """
-    db.execute(text(
-        """
-        INSERT INTO activity_logs (user_id, action, resource_type, resource_id, details, ip_address, created_at)
-        VALUES (:user_id, :action, :resource_type, :resource_id, :details, :ip_address, :created_at)
-        """
-    ), {
-        "user_id": user_id,
-        "action": action,
-        "resource_type": resource_type,
-        "resource_id": resource_id,
-        "details": details,
-        "ip_address": ip_address,
-        "created_at": datetime.now()
-    })
+    activity_log.record(db, activity_log.make_event(user_id, action, resource_type, resource_id, details, ip_address))
 
 def get_owner_user_id(db, resource_type: str, resource_id: int) -> int | None:
     """Return owner user_id for a given resource (file/folder)."""
@@ -183,25 +286,9 @@ def log_action_for_owner(
     details: str | None = None,
     ip_address: str | None = None,
 ):
-    """Resolve resource owner and store the log under owner's user_id.
-    The actor is appended to details for auditing.
+    """Store the log under the resource owner's user_id, with the actor appended to details
+    for auditing. Owner and actor email are resolved per batch by the writer.
     """
-    owner_user_id = get_owner_user_id(db, resource_type, resource_id)
-    # Fallback: if owner not found, attribute to actor
-    target_user_id = owner_user_id if owner_user_id is not None else actor_user_id
-    # Fetch actor email for better audit visibility
-    actor_email_row = db.execute(text("SELECT email FROM users WHERE user_id = :uid"), {"uid": actor_user_id}).fetchone()
-    actor_email = actor_email_row.email if actor_email_row else None
-    extra = f" | actor_id={actor_user_id}"
-    if actor_email:
-        extra += f" actor_email={actor_email}"
-    detail_text = (details or "") + extra
-    log_action(
-        db,
-        user_id=target_user_id,
-        action=action,
-        resource_type=resource_type,
-        resource_id=resource_id,
-        details=detail_text,
-        ip_address=ip_address,
-    )
\ No newline at end of file
+    activity_log.record(db, activity_log.make_event(
+        None, action, resource_type, resource_id, details, ip_address, actor_user_id=actor_user_id,
+    ))
@@ -1,26 +1,85 @@
 from fastapi.security import OAuth2PasswordBearer
-from utils import decode_access_token
+from utils import decode_access_token, password_fingerprint
 from fastapi import Depends, HTTPException
 from database import engine
 from db_helpers import get_user_by_id
+import os
+import threading
+import time
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")  # token endpoint name (we'll use /login instead)
 
+# How much of the user row to re-check on each request:
+#   claims - trust the signed token claims, no user lookup at all
+#   cached - check the user still exists and the password was not changed, via a TTL cache (default)
+#   strict - same checks against the database on every request
+AUTH_USER_CHECK = os.getenv("AUTH_USER_CHECK", "cached")
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+
+_user_cache = {}  # user_id -> (user dict, expires_at)
+_user_cache_lock = threading.Lock()
+
+
+def invalidate_cached_user(user_id: int):
+    """Call after a password change or account deletion so old tokens stop working."""
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+
+def _load_user(user_id: int, use_cache: bool):
+    if use_cache:
+        with _user_cache_lock:
+            entry = _user_cache.get(user_id)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+
+    with engine.connect() as conn:
+        row = get_user_by_id(conn, user_id)
+    if not row:
+        invalidate_cached_user(user_id)
+        return None
+
+    user = {
+        "user_id": row.user_id,
+        "username": row.username,
+        "email": row.email,
+        "profile": row.profile,
+        "storage": row.storage,
+        "pwd_fp": password_fingerprint(row.password),
+    }
+    if use_cache:
+        with _user_cache_lock:
+            _user_cache[user_id] = (user, time.monotonic() + USER_CACHE_TTL_SECONDS)
+    return user
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     payload = decode_access_token(token)
     user_id = payload.get("user_id")
     if user_id is None:
         raise HTTPException(status_code=401, detail="Invalid token payload")
 
-    with engine.connect() as conn:
-        user = get_user_by_id(conn, user_id)
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        # return a dict-like object
+    # Fast path: the token already carries everything the routers need
+    if AUTH_USER_CHECK == "claims" and "email" in payload:
         return {
-            "user_id": user.user_id,
-            "username": user.username,
-            "email": user.email,
-            "profile": user.profile,
-            "storage": user.storage
+            "user_id": user_id,
+            "username": payload.get("username"),
+            "email": payload.get("email"),
+            "profile": payload.get("profile"),
         }
+
+    user = _load_user(user_id, use_cache=AUTH_USER_CHECK != "strict")
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    # tokens issued before the last password change are revoked
+    if "pwd_fp" in payload and payload["pwd_fp"] != user["pwd_fp"]:
+        raise HTTPException(status_code=401, detail="Token revoked")
+
+    # return a dict-like object
+    return {
+        "user_id": user["user_id"],
+        "username": user["username"],
+        "email": user["email"],
+        "profile": user["profile"],
+        "storage": user["storage"]
+    }
@@ -0,0 +1,75 @@
+import time
+import zipfile
+from contextlib import closing
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkSink:
+    """Write-only, non-seekable target for ZipFile.
+    zipfile falls back to data descriptors when tell()/seek() are missing,
+    so every byte written here can be handed to the client right away.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries, store: bool = False, chunk_size: int = CHUNK_SIZE):
+    """Yield a ZIP archive chunk by chunk.
+    entries: iterable of (arcname, source, size) triples, read lazily one file at a time; source
+    is a local path or a callable returning a readable stream (remote storage), size its
+    length in bytes if known (remote entries need it to pick zip64 before writing).
+    store=True writes entries uncompressed (for media that is already compressed).
+    Memory use is bounded by chunk_size, not by the archive size.
+    """
+    compression = zipfile.ZIP_STORED if store else zipfile.ZIP_DEFLATED
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=compression, allowZip64=True) as zf:
+        for arcname, source, size in entries:
+            force_zip64 = False
+            try:
+                if callable(source):
+                    info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                    if size is not None:
+                        info.file_size = int(size)
+                    else:
+                        # zipfile can't switch to zip64 mid-entry, so assume the worst
+                        force_zip64 = True
+                    src = source()
+                else:
+                    info = zipfile.ZipInfo.from_file(source, arcname=arcname)
+                    src = open(source, "rb")
+            except Exception:
+                # file vanished from storage; skip it rather than break the archive mid-stream
+                continue
+            info.compress_type = compression
+            with closing(src), zf.open(info, "w", force_zip64=force_zip64) as dest:
+                while True:
+                    block = src.read(chunk_size)
+                    if not block:
+                        break
+                    dest.write(block)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # central directory is written on close
+    data = sink.drain()
+    if data:
+        yield data